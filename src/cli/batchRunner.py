@@ -0,0 +1,221 @@
+import os
+import sys
+import json
+import time
+import argparse
+import warnings
+import traceback
+import multiprocessing
+
+from ..dataIO.videoIO import VideoSampler
+from ..dataIO.memoryBudget import MemoryBudget
+from ..dataIO.resultCache import ResultCache
+from ..videoAnalysis.verticalShiftRateUtils import (find_vertical_shift_rate,
+                                                    DEFAULT_BINARY_THRESH,
+                                                    DEFAULT_NUM_SHIFT_COUNT_THRESHOLD)
+
+DEFAULT_VIDEO_EXTENSIONS = (".mp4", ".mkv", ".webm", ".avi", ".mov")
+DEFAULT_SAMPLES_PER_SECOND = 2
+BYTES_PER_MB = 1024 * 1024
+
+
+def collect_video_filenames(input_path,
+                            extensions=DEFAULT_VIDEO_EXTENSIONS):
+
+    # A directory: every file in it (non-recursively) with a video extension
+    if os.path.isdir(input_path):
+        video_filenames = [os.path.join(input_path, filename)
+                           for filename in sorted(os.listdir(input_path))
+                           if filename.lower().endswith(tuple(extensions))]
+
+    # A manifest: one video path per line. Blank lines and lines starting with
+    # '#' are ignored, and relative paths are relative to the manifest itself
+    elif os.path.isfile(input_path):
+        manifest_dir = os.path.dirname(os.path.abspath(input_path))
+        video_filenames = []
+        with open(input_path, "r") as manifest_file:
+            for line in manifest_file:
+                line = line.strip()
+                if (not line) or line.startswith("#"):
+                    continue
+                video_filenames.append(os.path.join(manifest_dir, line))
+
+    else:
+        raise Exception("Input path ({}) is neither a directory nor a manifest file".format(input_path))
+
+    return video_filenames
+
+
+def process_video(job):
+
+    # --------------------------------------------------------------------------
+    # Runs the full analysis for a single video. Every failure is caught and
+    # recorded in the result, so that one bad video can never take down the
+    # rest of the batch.
+    # --------------------------------------------------------------------------
+    video_filename, options = job
+
+    result = {"video": video_filename,
+              "status": "ok",
+              "vertical_shift_rate": None,
+              "warnings": [],
+              "error": None,
+              "timing": {},
+              "memory": None}
+
+    t_start = time.perf_counter()
+    vid_sampler = None
+    result_cache = None
+
+    # ----------------------------------------------------------------------
+    # Every job gets its own budget, which its decoder, frame buffers and
+    # shift analysis reserve from (and fail if they cannot); its peak usage is
+    # part of the result. Tracing every other allocation as well is opt-in,
+    # since tracemalloc slows decoding and numpy work down a lot
+    # ----------------------------------------------------------------------
+    memory_budget = None
+    if options.get("memory_budget_mb") is not None:
+        memory_budget = MemoryBudget(options["memory_budget_mb"] * BYTES_PER_MB)
+        if options.get("trace_memory", False):
+            memory_budget.start_tracing()
+
+    try:
+        with warnings.catch_warnings(record=True) as warn_list:
+            warnings.simplefilter("always")
+
+            t_open = time.perf_counter()
+            vid_sampler = VideoSampler(video_filename, memory_budget=memory_budget)
+            if options.get("result_cache_filename") is not None:
+                result_cache = ResultCache(options["result_cache_filename"])
+            vid_sampler.gen_sampling_schedule_using_time(start_time=options["start_time"],
+                                                         end_time=options["end_time"],
+                                                         samples_per_second=options["samples_per_second"])
+            result["timing"]["open"] = time.perf_counter() - t_open
+
+            t_analysis = time.perf_counter()
+            result["vertical_shift_rate"] = find_vertical_shift_rate(vid_sampler,
+                                                                     top_bound=options["top_bound"],
+                                                                     bottom_bound=options["bottom_bound"],
+                                                                     left_bound=options["left_bound"],
+                                                                     right_bound=options["right_bound"],
+                                                                     bin_thresh=options["bin_thresh"],
+                                                                     num_shift_count_threshold=options["num_shift_count_threshold"],
+                                                                     auto_roi=options.get("auto_roi", False),
+                                                                     result_cache=result_cache)
+            result["timing"]["analysis"] = time.perf_counter() - t_analysis
+
+        result["warnings"] = [str(w.message) for w in warn_list]
+
+    except Exception:
+        result["status"] = "error"
+        result["error"] = traceback.format_exc()
+
+    finally:
+        if vid_sampler is not None:
+            vid_sampler.close_sampler()
+        if result_cache is not None:
+            result_cache.close()
+        if memory_budget is not None:
+            result["memory"] = memory_budget.get_report()
+            memory_budget.stop_tracing()
+
+    result["timing"]["total"] = time.perf_counter() - t_start
+
+    return result
+
+
+def run_batch(video_filenames, options,
+              output_file,
+              num_workers=None):
+
+    if num_workers is None:
+        num_workers = os.cpu_count()
+
+    jobs = [(video_filename, options) for video_filename in video_filenames]
+    num_failed = 0
+
+    # ----------------------------------------------------------------------
+    # maxtasksperchild=1 gives every video a fresh worker process, so that
+    # leaked ffmpeg handles or memory from one video never affect another.
+    # Results are written as soon as they arrive, one JSON object per line
+    # ----------------------------------------------------------------------
+    with multiprocessing.Pool(processes=num_workers, maxtasksperchild=1) as pool:
+        for result in pool.imap_unordered(process_video, jobs):
+            if result["status"] != "ok":
+                num_failed += 1
+            output_file.write(json.dumps(result) + "\n")
+            output_file.flush()
+
+    return num_failed
+
+
+def build_arg_parser():
+
+    parser = argparse.ArgumentParser(prog="scanthesia",
+                                     description="Batch-analyse Synthesia-like piano videos")
+
+    parser.add_argument("input_path",
+                        help="Directory of videos, or a manifest file listing one video per line")
+    parser.add_argument("-o", "--output", default=None,
+                        help="JSON lines output file (default: stdout)")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="Number of worker processes (default: number of CPUs)")
+
+    parser.add_argument("--top-bound", type=int, default=None)
+    parser.add_argument("--bottom-bound", type=int, default=None)
+    parser.add_argument("--left-bound", type=int, default=None)
+    parser.add_argument("--right-bound", type=int, default=None)
+    parser.add_argument("--auto-roi", action="store_true",
+                        help="Detect the region of falling notes, instead of using the bounds above")
+    parser.add_argument("--bin-thresh", type=int, default=DEFAULT_BINARY_THRESH)
+    parser.add_argument("--num-shift-count-threshold", type=int,
+                        default=DEFAULT_NUM_SHIFT_COUNT_THRESHOLD)
+
+    parser.add_argument("--result-cache", default=None,
+                        help="SQLite file in which results are cached, so that videos that were "
+                             "already analysed with the same options are not analysed again")
+    parser.add_argument("--memory-budget-mb", type=int, default=None,
+                        help="Memory budget (in MB) per video for the decoder, frame buffers and "
+                             "the shift analysis; videos that do not fit fail, and peak usage is "
+                             "reported (default: no budget)")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="With --memory-budget-mb, also report the peak of all traced "
+                             "allocations (slow)")
+
+    parser.add_argument("--samples-per-second", type=int, default=DEFAULT_SAMPLES_PER_SECOND)
+    parser.add_argument("--start-time", type=float, default=None)
+    parser.add_argument("--end-time", type=float, default=None)
+
+    return parser
+
+
+def main(argv=None):
+
+    args = build_arg_parser().parse_args(argv)
+
+    video_filenames = collect_video_filenames(args.input_path)
+
+    options = {"top_bound": args.top_bound,
+               "bottom_bound": args.bottom_bound,
+               "left_bound": args.left_bound,
+               "right_bound": args.right_bound,
+               "auto_roi": args.auto_roi,
+               "bin_thresh": args.bin_thresh,
+               "num_shift_count_threshold": args.num_shift_count_threshold,
+               "samples_per_second": args.samples_per_second,
+               "start_time": args.start_time,
+               "end_time": args.end_time,
+               "memory_budget_mb": args.memory_budget_mb,
+               "trace_memory": args.trace_memory,
+               "result_cache_filename": args.result_cache}
+
+    if args.output is None:
+        num_failed = run_batch(video_filenames, options, sys.stdout,
+                               num_workers=args.workers)
+    else:
+        with open(args.output, "w") as output_file:
+            num_failed = run_batch(video_filenames, options, output_file,
+                                   num_workers=args.workers)
+
+    # Non-zero exit status if any video failed, so that batch schedulers notice
+    return 1 if num_failed > 0 else 0
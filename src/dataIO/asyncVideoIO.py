@@ -0,0 +1,155 @@
+import asyncio
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+from .memoryBudget import make_consumer_name
+
+DEFAULT_READ_AHEAD = 4
+
+
+class AsyncVideoSampler:
+
+    def __init__(self,
+                 vid_sampler,
+                 read_ahead=DEFAULT_READ_AHEAD):
+
+        if (not isinstance(read_ahead, int)) or (read_ahead < 1):
+            raise Exception("Read ahead ({}) should be a positive integer".format(read_ahead))
+
+        # ----------------------------------------------------------------------
+        # The wrapped VideoSampler is not thread-safe (reading mutates its
+        # position), so all decoding runs on one dedicated thread. Since that
+        # thread executes reads strictly in submission order, up to
+        # <read_ahead> samples can be requested in advance without reordering
+        # ----------------------------------------------------------------------
+        self.vid_sampler = vid_sampler
+        self.read_ahead = read_ahead
+
+        # ----------------------------------------------------------------------
+        # If the wrapped sampler has a memory budget, every read-ahead slot
+        # reserves one frame of it. If the budget cannot hold all of them, or
+        # later runs short, the sampler reads ahead less (but always at least
+        # one sample)
+        # ----------------------------------------------------------------------
+        self.memory_budget = vid_sampler.memory_budget
+        self._consumer_name = make_consumer_name(self)
+
+        # Shrinks come from whichever thread reserves from the budget, while
+        # the event loop sizes the read-ahead from the same value
+        self._read_ahead_lock = threading.Lock()
+        self._frame_bytes = vid_sampler.frame_height * vid_sampler.frame_width * 3
+        if self.memory_budget is not None:
+            self.memory_budget.reserve_or_raise(self._frame_bytes, self._consumer_name)
+            num_extra_slots = 0
+            while ((num_extra_slots < (read_ahead - 1)) and
+                   self.memory_budget.reserve(self._frame_bytes, self._consumer_name)):
+                num_extra_slots += 1
+            self.read_ahead = 1 + num_extra_slots
+            self.memory_budget.register_shrinkable(self._consumer_name, self._shrink_read_ahead)
+
+        # ----------------------------------------------------------------------
+        # A ring buffer frame is only valid for the next <ring_buffer_size - 1>
+        # reads, and the read-ahead makes those reads before the caller even
+        # sees the frame. If there is not at least one read of margin left (so
+        # that the previous frame can be held), the decode thread hands out
+        # copies instead, which the read-ahead slots (above) account for.
+        # Otherwise frames are valid for the next
+        # <ring_buffer_size - 1 - read_ahead> samples
+        # ----------------------------------------------------------------------
+        self._copy_frames = (vid_sampler.use_ring_buffer and (not vid_sampler.copy_frames) and
+                             (self.read_ahead >= (vid_sampler.ring_buffer_size - 1)))
+
+        self._decode_executor = ThreadPoolExecutor(max_workers=1)
+        self._pending_reads = collections.deque()
+        self._is_exhausted = False
+        self._is_closed = False
+
+        return
+
+    def _shrink_read_ahead(self, num_bytes):
+
+        # Reads already in flight finish as usual; only new ones are limited
+        with self._read_ahead_lock:
+            num_dropped_slots = min(self.read_ahead - 1, -(-num_bytes // self._frame_bytes))
+            if num_dropped_slots > 0:
+                self.read_ahead -= num_dropped_slots
+
+        if num_dropped_slots > 0:
+            self.memory_budget.release(num_dropped_slots * self._frame_bytes, self._consumer_name)
+        return
+
+    def _read_next_sample(self):
+
+        # StopIteration cannot be passed through a Future, hence the flag
+        try:
+            frame = next(self.vid_sampler)
+        except StopIteration:
+            return False, None
+
+        if self._copy_frames:
+            frame = frame.copy()
+
+        return True, frame
+
+    def _fill_read_ahead(self, loop):
+        with self._read_ahead_lock:
+            read_ahead = self.read_ahead
+        while (not self._is_exhausted) and (len(self._pending_reads) < read_ahead):
+            self._pending_reads.append(loop.run_in_executor(self._decode_executor,
+                                                            self._read_next_sample))
+        return
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+
+        if self._is_closed:
+            raise StopAsyncIteration
+
+        self._fill_read_ahead(asyncio.get_running_loop())
+        if not self._pending_reads:
+            raise StopAsyncIteration
+
+        success, frame = await self._pending_reads.popleft()
+        if not success:
+            # Every read queued after this one will also come back empty
+            self._is_exhausted = True
+            self._pending_reads.clear()
+            raise StopAsyncIteration
+
+        return frame
+
+    async def aclose(self):
+
+        # ----------------------------------------------------------------------
+        # Drop the read-ahead and stop the decode thread. Reads that have not
+        # started are cancelled, and the one in progress (if any) is awaited so
+        # that the wrapped sampler is left in a consistent state. The wrapped
+        # VideoSampler itself is NOT closed; it belongs to the caller
+        # ----------------------------------------------------------------------
+        if self._is_closed:
+            return
+
+        self._is_closed = True
+        for pending_read in self._pending_reads:
+            pending_read.cancel()
+        self._pending_reads.clear()
+
+        if self.memory_budget is not None:
+            self.memory_budget.unregister_shrinkable(self._consumer_name)
+            with self._read_ahead_lock:
+                num_reserved_slots = self.read_ahead
+            self.memory_budget.release(num_reserved_slots * self._frame_bytes, self._consumer_name)
+
+        await asyncio.get_running_loop().run_in_executor(None, self._decode_executor.shutdown)
+
+        return
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        await self.aclose()
+        return
@@ -0,0 +1,174 @@
+import os
+import re
+import struct
+import tempfile
+import threading
+import subprocess
+
+import imageio_ffmpeg
+
+# Suffix of temporary files, when in-memory videos have to be written to disk
+TEMP_VIDEO_SUFFIX = ".mp4"
+
+# ISO base media (MP4, MOV, ...) files start with an "ftyp" box
+MP4_FILE_TYPE_BOX = b"ftyp"
+
+
+def is_in_memory_video(video_input):
+    return (isinstance(video_input, (bytes, bytearray, memoryview)) or
+            hasattr(video_input, "read"))
+
+
+def read_video_data(video_input):
+
+    # --------------------------------------------------------------------------
+    # Returns the whole encoded video as a read-only memoryview. The data is
+    # kept in memory (and not streamed from a file-like object) because ffmpeg
+    # has to be restarted, and the data fed again, for every backward seek
+    # --------------------------------------------------------------------------
+    if hasattr(video_input, "read"):
+        video_input = video_input.read()
+        if not isinstance(video_input, (bytes, bytearray)):
+            raise Exception("File-like video input should be opened in binary mode")
+
+    video_data = memoryview(video_input).cast("B").toreadonly()
+    if len(video_data) == 0:
+        raise Exception("In-memory video input is empty")
+
+    return video_data
+
+
+def is_pipeable_video_data(video_data):
+
+    # --------------------------------------------------------------------------
+    # Through a pipe, ffmpeg can only read forward. Most containers are fine
+    # with that, but an MP4 whose index ("moov" box) comes after the media
+    # data ("mdat" box) cannot be decoded without seeking back to the start.
+    # Only the top-level box headers are walked, so this is cheap
+    # --------------------------------------------------------------------------
+    if bytes(video_data[4: 8]) != MP4_FILE_TYPE_BOX:
+        return True
+
+    box_start = 0
+    while box_start + 8 <= len(video_data):
+        box_size, box_type = struct.unpack(">I4s", video_data[box_start: box_start + 8])
+        if box_type == b"moov":
+            return True
+        if box_type == b"mdat":
+            return False
+
+        # Size 1: 64-bit size follows the header. Size 0: box runs to the end
+        if box_size == 1:
+            box_size = struct.unpack(">Q", video_data[box_start + 8: box_start + 16])[0]
+        elif box_size == 0:
+            break
+        if box_size < 8:
+            break
+        box_start += box_size
+
+    return False
+
+
+def _feed_video_data(stdin_pipe, video_data):
+
+    # ffmpeg is killed as soon as it is not needed anymore (e.g. to seek), so
+    # it closing its end of the pipe early is expected, and not an error
+    try:
+        stdin_pipe.write(video_data)
+    except (BrokenPipeError, ValueError, OSError):
+        pass
+    finally:
+        try:
+            stdin_pipe.close()
+        except (BrokenPipeError, OSError):
+            pass
+    return
+
+
+def start_video_data_feeder(ffmpeg_process, video_data):
+
+    # Writes the video data to ffmpeg's stdin from a separate thread, so that
+    # reading its output can never deadlock against a full input pipe
+    feeder_thread = threading.Thread(target=_feed_video_data,
+                                     args=(ffmpeg_process.stdin, video_data),
+                                     daemon=True)
+    feeder_thread.start()
+
+    return feeder_thread
+
+
+def _parse_video_header(header_text):
+
+    # --------------------------------------------------------------------------
+    # The few fields that are needed, from the first video stream of ffmpeg's
+    # input description, e.g.:
+    #   Duration: 00:02:11.73, start: 0.000000, bitrate: 512 kb/s
+    #   Stream #0:0(und): Video: h264 (High) (...), yuv420p(...), 1274x720 [SAR
+    #   1:1 DAR 637:360], 507 kb/s, 30 fps, 30 tbr, 15360 tbn (default)
+    # The frame rate is "fps" if given, else "tbr". The duration is None if
+    # the container does not give one
+    # --------------------------------------------------------------------------
+    video_lines = [line for line in header_text.splitlines()
+                   if line.lstrip().startswith("Stream #") and " Video: " in line]
+    if not video_lines:
+        raise Exception("In-memory video has no video stream")
+    video_line = video_lines[0]
+
+    size_match = re.search(r" ([0-9]+)x([0-9]+)[, ]", video_line)
+    fps_match = (re.search(r" ([0-9]+\.?[0-9]*) fps", video_line) or
+                 re.search(r" ([0-9]+\.?[0-9]*) tbr", video_line))
+    if (size_match is None) or (fps_match is None):
+        raise Exception("Could not read the frame size and rate of the in-memory video: {}".format(video_line.strip()))
+
+    duration = None
+    duration_match = re.search(r"Duration: ([0-9]+):([0-9]+):([0-9]+\.?[0-9]*)", header_text)
+    if duration_match is not None:
+        hours, minutes, seconds = duration_match.groups()
+        duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    vid_metadata = {"source_size": (int(size_match.group(1)), int(size_match.group(2))),
+                    "fps": float(fps_match.group(1)),
+                    "duration": duration}
+
+    return vid_metadata
+
+
+def probe_video_data(video_data):
+
+    # --------------------------------------------------------------------------
+    # Metadata of an in-memory video, with the keys of the imageio reader's
+    # that are used (source_size, fps, duration, nframes). The number of
+    # frames is counted from the video packets, which are copied to the frame
+    # checksum muxer without being decoded
+    # --------------------------------------------------------------------------
+    cmd = [imageio_ffmpeg.get_ffmpeg_exe(), "-hide_banner", "-nostats",
+           "-i", "pipe:0",
+           "-map", "0:v:0", "-c", "copy", "-f", "framecrc", "-"]
+
+    ffmpeg_process = subprocess.Popen(cmd,
+                                      stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE,
+                                      stderr=subprocess.PIPE)
+    packet_lines, header_text = ffmpeg_process.communicate(input=video_data)
+
+    if ffmpeg_process.returncode != 0:
+        raise Exception("Could not read in-memory video: {}".format(header_text.decode(errors="ignore").strip()))
+
+    vid_metadata = _parse_video_header(header_text.decode(errors="ignore"))
+    vid_metadata["nframes"] = sum(1 for line in packet_lines.splitlines()
+                                  if line and not line.startswith(b"#"))
+
+    if vid_metadata["duration"] is None:
+        vid_metadata["duration"] = vid_metadata["nframes"] / vid_metadata["fps"]
+
+    return vid_metadata
+
+
+def write_temp_video_file(video_data):
+
+    # Fallback for data that cannot be piped. The caller removes the file
+    file_descriptor, temp_video_filename = tempfile.mkstemp(suffix=TEMP_VIDEO_SUFFIX)
+    with os.fdopen(file_descriptor, "wb") as temp_video_file:
+        temp_video_file.write(video_data)
+
+    return temp_video_filename
@@ -0,0 +1,140 @@
+import threading
+import weakref
+import tracemalloc
+
+
+class MemoryBudget:
+
+    def __init__(self, limit_bytes):
+
+        # ----------------------------------------------------------------------
+        # A per-job limit on the memory held by frame buffers, read-ahead
+        # queues and caches. Every such structure reserves its bytes here
+        # before allocating them, under a consumer name. Structures that can
+        # make do with less (e.g. by evicting or reading ahead less) register a
+        # shrink callback, which is called when another reservation does not
+        # fit. Fixed-size structures simply fail to be created instead
+        # ----------------------------------------------------------------------
+        if limit_bytes <= 0:
+            raise Exception("Memory budget ({} bytes) should be greater than 0".format(limit_bytes))
+
+        self.limit_bytes = int(limit_bytes)
+        self.used_bytes = 0
+        self.peak_bytes = 0
+
+        self._consumer_bytes = {}
+        self._consumer_peak_bytes = {}
+        self._shrink_callbacks = {}
+
+        # Reentrant, since shrink callbacks release bytes while a reservation
+        # is in progress
+        self._budget_lock = threading.RLock()
+        self._is_tracing = False
+
+        return
+
+    def register_shrinkable(self, consumer_name, shrink_callback):
+
+        # shrink_callback(num_bytes) should try to free (and release) at least
+        # <num_bytes>, and may free less if it cannot
+        with self._budget_lock:
+            self._shrink_callbacks[consumer_name] = shrink_callback
+        return
+
+    def unregister_shrinkable(self, consumer_name):
+        with self._budget_lock:
+            self._shrink_callbacks.pop(consumer_name, None)
+        return
+
+    def get_available_bytes(self):
+        with self._budget_lock:
+            return self.limit_bytes - self.used_bytes
+
+    def _shrink_other_consumers(self, num_bytes, consumer_name):
+
+        # Largest consumers are asked first, so that as few as possible shrink
+        shrinkable_names = sorted((name for name in self._shrink_callbacks if name != consumer_name),
+                                  key=lambda name: self._consumer_bytes.get(name, 0),
+                                  reverse=True)
+
+        for name in shrinkable_names:
+            num_missing_bytes = (self.used_bytes + num_bytes) - self.limit_bytes
+            if num_missing_bytes <= 0:
+                break
+            self._shrink_callbacks[name](num_missing_bytes)
+
+        return
+
+    def reserve(self, num_bytes, consumer_name):
+
+        # Returns whether the bytes could be reserved (after shrinking others)
+        with self._budget_lock:
+            if (self.used_bytes + num_bytes) > self.limit_bytes:
+                self._shrink_other_consumers(num_bytes, consumer_name)
+            if (self.used_bytes + num_bytes) > self.limit_bytes:
+                return False
+
+            self.used_bytes += num_bytes
+            self._consumer_bytes[consumer_name] = self._consumer_bytes.get(consumer_name, 0) + num_bytes
+
+            self.peak_bytes = max(self.peak_bytes, self.used_bytes)
+            self._consumer_peak_bytes[consumer_name] = max(self._consumer_peak_bytes.get(consumer_name, 0),
+                                                           self._consumer_bytes[consumer_name])
+
+        return True
+
+    def reserve_or_raise(self, num_bytes, consumer_name):
+        if not self.reserve(num_bytes, consumer_name):
+            raise Exception("{} needs {} bytes, but only {} of the {} byte memory budget are available".format(consumer_name, num_bytes,
+                                                                                                             self.get_available_bytes(),
+                                                                                                             self.limit_bytes))
+        return
+
+    def release(self, num_bytes, consumer_name):
+        with self._budget_lock:
+            self.used_bytes -= num_bytes
+            self._consumer_bytes[consumer_name] -= num_bytes
+            if self._consumer_bytes[consumer_name] == 0:
+                del self._consumer_bytes[consumer_name]
+        return
+
+    def release_when_freed(self, obj, num_bytes, consumer_name):
+
+        # For arrays that are handed over to the caller: the reservation lasts
+        # exactly as long as the array itself
+        weakref.finalize(obj, self.release, num_bytes, consumer_name)
+        return
+
+    def start_tracing(self):
+
+        # The budget only knows what is reserved; tracemalloc also sees every
+        # other (Python and numpy) allocation of the job
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._is_tracing = True
+        tracemalloc.reset_peak()
+        return
+
+    def stop_tracing(self):
+        if self._is_tracing:
+            tracemalloc.stop()
+            self._is_tracing = False
+        return
+
+    def get_report(self):
+
+        with self._budget_lock:
+            memory_report = {"limit_bytes": self.limit_bytes,
+                             "used_bytes": self.used_bytes,
+                             "peak_bytes": self.peak_bytes,
+                             "consumer_peak_bytes": dict(self._consumer_peak_bytes),
+                             "traced_peak_bytes": None}
+
+        if tracemalloc.is_tracing():
+            memory_report["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+
+        return memory_report
+
+
+def make_consumer_name(consumer):
+    return "{}-{:x}".format(type(consumer).__name__, id(consumer))
@@ -0,0 +1,233 @@
+import struct
+
+import numpy as np
+
+NOTE_EVENT_DTYPE = np.dtype([("pitch", "uint8"),
+                             ("start_frame", "int64"),
+                             ("end_frame", "int64"),
+                             ("start_time", "float64"),
+                             ("end_time", "float64"),
+                             ("velocity", "uint8"),
+                             ("track", "uint8")])
+
+DEFAULT_INITIAL_CAPACITY = 1024
+
+# MIDI pitch of the lowest key (A0) of an 88 key piano
+LOWEST_PIANO_PITCH = 21
+
+DEFAULT_TICKS_PER_BEAT = 480
+DEFAULT_TEMPO_BPM = 120
+NOTE_OFF_VELOCITY = 64
+
+# Delta times are at most 4 bytes long, i.e. 28 bits
+MAX_VLQ_NUM_BYTES = 4
+MAX_VLQ_VALUE = (1 << (7 * MAX_VLQ_NUM_BYTES)) - 1
+
+
+def _encode_vlq(values):
+
+    # --------------------------------------------------------------------------
+    # MIDI variable-length quantities of all the values at once: 7 bits per
+    # byte, most significant group first, with the top bit set on every byte
+    # but the last. Returns a (num_values, 4) uint8 matrix with every encoding
+    # left-aligned in its row, and the number of bytes of each encoding
+    # --------------------------------------------------------------------------
+    values = np.asarray(values, dtype="int64")
+    if np.any(values < 0) or np.any(values > MAX_VLQ_VALUE):
+        raise Exception("MIDI variable-length quantities should be in [0, {}]".format(MAX_VLQ_VALUE))
+
+    vlq_lengths = 1 + (values >= (1 << 7)) + (values >= (1 << 14)) + (values >= (1 << 21))
+
+    # Byte j (from the left) of an n byte encoding holds 7-bit group n-1-j
+    byte_positions = np.arange(MAX_VLQ_NUM_BYTES)[np.newaxis, :]
+    group_indices = vlq_lengths[:, np.newaxis] - 1 - byte_positions
+    vlq_bytes = (values[:, np.newaxis] >> (7 * np.maximum(group_indices, 0))) & 0x7F
+    vlq_bytes |= np.where(group_indices > 0, 0x80, 0)
+    vlq_bytes[group_indices < 0] = 0
+
+    return vlq_bytes.astype("uint8"), vlq_lengths
+
+
+def _wrap_track_data(track_data):
+
+    # Delta time 0, end of track
+    track_data = track_data + b"\x00\xFF\x2F\x00"
+
+    return b"MTrk" + struct.pack(">I", len(track_data)) + track_data
+
+
+def _build_track_chunk(event_ticks, event_bytes):
+
+    # --------------------------------------------------------------------------
+    # event_ticks: (num_events,) absolute times, in ascending order
+    # event_bytes: (num_events, 3) status and data bytes of every event
+    #
+    # Every event is its delta time followed by its bytes. Both are laid out
+    # side by side in one matrix, and a mask of the valid bytes flattens it
+    # into the track data in a single indexing operation
+    # --------------------------------------------------------------------------
+    delta_ticks = np.diff(event_ticks, prepend=0)
+    vlq_bytes, vlq_lengths = _encode_vlq(delta_ticks)
+
+    event_matrix = np.concatenate((vlq_bytes, event_bytes.astype("uint8")), axis=1)
+    is_valid_byte = np.concatenate((np.arange(MAX_VLQ_NUM_BYTES)[np.newaxis, :] < vlq_lengths[:, np.newaxis],
+                                    np.ones(event_bytes.shape, dtype="bool")), axis=1)
+
+    return _wrap_track_data(event_matrix[is_valid_byte].tobytes())
+
+
+class NoteEventStore:
+
+    def __init__(self,
+                 vid_fps,
+                 frame_timestamps=None,
+                 initial_capacity=DEFAULT_INITIAL_CAPACITY):
+
+        # ----------------------------------------------------------------------
+        # Notes are kept column by column in one numpy structured array (see
+        # NOTE_EVENT_DTYPE), which grows by doubling, so that millions of notes
+        # take a few tens of bytes each and are appended in bulk. Times in
+        # seconds are derived from the frames: at <vid_fps> (see
+        # VideoReader.vid_fps), or from the frame timestamps of variable frame
+        # rate videos (see VideoReader.frame_timestamps)
+        # ----------------------------------------------------------------------
+        self.vid_fps = vid_fps
+        self.frame_timestamps = frame_timestamps
+        self._notes = np.empty(initial_capacity, dtype=NOTE_EVENT_DTYPE)
+        self._num_notes = 0
+
+        return
+
+    def __len__(self):
+        return self._num_notes
+
+    @property
+    def notes(self):
+        return self._notes[: self._num_notes]
+
+    def _calc_frame_times(self, frames):
+        if self.frame_timestamps is None:
+            return frames / float(self.vid_fps)
+
+        # End frames are exclusive, and may be one past the last frame
+        frame_timestamps = np.append(self.frame_timestamps, self.frame_timestamps[-1] + 1.0 / self.vid_fps)
+        return frame_timestamps[np.clip(frames, 0, len(frame_timestamps) - 1)]
+
+    def append_notes(self,
+                     pitches, start_frames, end_frames,
+                     velocities, track=0):
+
+        # One chunk of notes (e.g. from detect_note_events()); end frames are
+        # exclusive. <track> is a single track for the chunk, or one per note
+        pitches = np.asarray(pitches)
+        num_new_notes = len(pitches)
+
+        required_capacity = self._num_notes + num_new_notes
+        if required_capacity > len(self._notes):
+            new_capacity = max(required_capacity, 2 * len(self._notes))
+            grown_notes = np.empty(new_capacity, dtype=NOTE_EVENT_DTYPE)
+            grown_notes[: self._num_notes] = self.notes
+            self._notes = grown_notes
+
+        new_notes = self._notes[self._num_notes: required_capacity]
+        new_notes["pitch"] = pitches
+        new_notes["start_frame"] = start_frames
+        new_notes["end_frame"] = end_frames
+        new_notes["start_time"] = self._calc_frame_times(new_notes["start_frame"])
+        new_notes["end_time"] = self._calc_frame_times(new_notes["end_frame"])
+        new_notes["velocity"] = velocities
+        new_notes["track"] = track
+
+        self._num_notes = required_capacity
+
+        return
+
+    def append_key_notes(self,
+                         keys, onset_frames, offset_frames,
+                         velocities, track=0):
+
+        # Keys are numbered from the lowest piano key upwards
+        self.append_notes(np.asarray(keys) + LOWEST_PIANO_PITCH,
+                          onset_frames, offset_frames,
+                          velocities, track)
+        return
+
+    def sort(self):
+
+        # By start, then pitch, then end (then track and velocity): every field
+        # takes part, so that equal sets of notes always sort the same way,
+        # whatever order they were appended (or merged) in
+        notes = self.notes
+        order = np.lexsort((notes["velocity"], notes["track"], notes["end_frame"],
+                            notes["pitch"], notes["start_frame"]))
+        self._notes[: self._num_notes] = notes[order]
+
+        return
+
+    def merge(self, other_store):
+
+        # Returns a new, sorted store with the notes of both, which must have
+        # been timed the same way (same fps and frame timestamps)
+        if other_store.vid_fps != self.vid_fps:
+            raise Exception("Cannot merge notes at {} fps with notes at {} fps".format(other_store.vid_fps, self.vid_fps))
+        if (other_store.frame_timestamps is None) != (self.frame_timestamps is None):
+            raise Exception("Cannot merge notes timed by frame timestamps with notes timed by fps")
+        if (self.frame_timestamps is not None) and (not np.array_equal(other_store.frame_timestamps, self.frame_timestamps)):
+            raise Exception("Cannot merge notes timed by different frame timestamps")
+
+        merged_store = NoteEventStore(self.vid_fps, self.frame_timestamps, initial_capacity=max(1, len(self) + len(other_store)))
+        merged_store._notes[: len(self)] = self.notes
+        merged_store._notes[len(self): len(self) + len(other_store)] = other_store.notes
+        merged_store._num_notes = len(self) + len(other_store)
+        merged_store.sort()
+
+        return merged_store
+
+    def to_midi_bytes(self,
+                      ticks_per_beat=DEFAULT_TICKS_PER_BEAT,
+                      tempo_bpm=DEFAULT_TEMPO_BPM):
+
+        # ----------------------------------------------------------------------
+        # A format 1 Standard MIDI File: a tempo track, followed by one track
+        # per distinct track number (on MIDI channel track % 16). Note times
+        # are converted to ticks at the given tempo
+        # ----------------------------------------------------------------------
+        ticks_per_second = ticks_per_beat * tempo_bpm / 60.0
+        microseconds_per_beat = int(round(60e6 / tempo_bpm))
+
+        # Delta time 0, set tempo (3 bytes of microseconds per beat)
+        tempo_track = _wrap_track_data(b"\x00\xFF\x51\x03" + struct.pack(">I", microseconds_per_beat)[1:])
+
+        notes = self.notes
+        track_chunks = [tempo_track]
+        for track in np.unique(notes["track"]):
+            track_notes = notes[notes["track"] == track]
+            channel = int(track) % 16
+            num_track_notes = len(track_notes)
+
+            # Note-on and note-off events of all the notes; at equal ticks,
+            # note-offs go first so that repeated notes are not cut short
+            event_ticks = np.rint(np.concatenate((track_notes["start_time"],
+                                                  track_notes["end_time"])) * ticks_per_second).astype("int64")
+            is_note_on = np.concatenate((np.ones(num_track_notes, dtype="bool"),
+                                         np.zeros(num_track_notes, dtype="bool")))
+
+            event_bytes = np.empty((2 * num_track_notes, 3), dtype="uint8")
+            event_bytes[:, 0] = np.where(is_note_on, 0x90 | channel, 0x80 | channel)
+            event_bytes[:, 1] = np.concatenate((track_notes["pitch"], track_notes["pitch"]))
+            event_bytes[:, 2] = np.concatenate((track_notes["velocity"],
+                                                np.full(num_track_notes, NOTE_OFF_VELOCITY)))
+
+            order = np.lexsort((is_note_on, event_ticks))
+            track_chunks.append(_build_track_chunk(event_ticks[order], event_bytes[order]))
+
+        header_chunk = b"MThd" + struct.pack(">IHHH", 6, 1, len(track_chunks), ticks_per_beat)
+
+        return header_chunk + b"".join(track_chunks)
+
+    def write_midi_file(self, midi_filename,
+                        ticks_per_beat=DEFAULT_TICKS_PER_BEAT,
+                        tempo_bpm=DEFAULT_TEMPO_BPM):
+        with open(midi_filename, "wb") as midi_file:
+            midi_file.write(self.to_midi_bytes(ticks_per_beat, tempo_bpm))
+        return
@@ -0,0 +1,202 @@
+import subprocess
+
+import numpy as np
+import imageio_ffmpeg
+
+from .inMemoryVideo import start_video_data_feeder
+from .memoryBudget import make_consumer_name
+
+DEFAULT_NUM_SLOTS = 4
+
+# Same policy as the imageio ffmpeg reader: decode (and discard) frames to move
+# forward by up to this many frames, and restart ffmpeg with a seek otherwise
+MAX_FORWARD_DECODE_FRAMES = 100
+
+
+class RawFrameSource:
+
+    def __init__(self,
+                 video_filename,
+                 frame_width, frame_height,
+                 vid_fps,
+                 num_slots=DEFAULT_NUM_SLOTS,
+                 input_params=None,
+                 output_params=None,
+                 video_data=None,
+                 memory_budget=None,
+                 frame_timestamps=None):
+
+        if (not isinstance(num_slots, int)) or (num_slots < 1):
+            raise Exception("Number of ring buffer slots ({}) should be a positive integer".format(num_slots))
+
+        self.video_filename = video_filename
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        self.vid_fps = vid_fps
+        self.input_params = input_params or []
+        self.output_params = output_params or []
+
+        # With <video_data> (the encoded video, in memory), ffmpeg reads it
+        # from its stdin instead of from <video_filename>
+        self.video_data = video_data
+
+        # With <frame_timestamps> (see timestampIndex), frames are decoded as
+        # they are in the stream, without being converted to a constant frame
+        # rate, and frame indices are seeked to by their exact timestamps
+        self.frame_timestamps = frame_timestamps
+
+        # ----------------------------------------------------------------------
+        # Frames are read from the ffmpeg pipe straight into the slots of this
+        # ring buffer, and handed out as views. A view stays valid until its
+        # slot is reused, i.e. for the next <num_slots - 1> reads. Frames that
+        # are skipped over go to a separate scratch slot, so that skipping
+        # never recycles a slot that is still handed out
+        # ----------------------------------------------------------------------
+        self.num_slots = num_slots
+
+        # Views into the ring buffer are only valid for as long as promised if
+        # every slot exists, so the buffer cannot shrink: with a memory budget,
+        # it is either reserved in full, or not created at all
+        self.memory_budget = memory_budget
+        self._consumer_name = make_consumer_name(self)
+        self._num_reserved_bytes = (num_slots + 1) * frame_height * frame_width * 3
+        if self.memory_budget is not None:
+            self.memory_budget.reserve_or_raise(self._num_reserved_bytes, self._consumer_name)
+
+        self.ring_buffer = np.empty((num_slots, frame_height, frame_width, 3), dtype="uint8")
+        self._skip_buffer = np.empty((frame_height, frame_width, 3), dtype="uint8")
+        self._next_slot = 0
+        self._curr_slot = None
+
+        self._ffmpeg_process = None
+        self.curr_frame_index = -1      # Implies video has not been read yet
+
+        return
+
+    def _start_decoder(self, frame_index):
+
+        self._stop_decoder()
+
+        input_args = list(self.input_params)
+        output_args = []
+
+        # Seek exactly the way the imageio reader does (fast keyframe seek for
+        # the long stretch, accurate seek for the last 10s), so that both
+        # sources decode identical frames
+        if frame_index > 0:
+            if self.frame_timestamps is None:
+                start_time = frame_index / self.vid_fps
+            else:
+                # Half a frame early, so that timestamp rounding can never
+                # make the seek drop the frame itself
+                start_time = self.frame_timestamps[frame_index] - 0.5 * (self.frame_timestamps[frame_index] -
+                                                                        self.frame_timestamps[frame_index - 1])
+            seek_slow = min(10, start_time)
+            seek_fast = start_time - seek_slow
+            input_args += ["-ss", "%.06f" % seek_fast]
+            output_args += ["-ss", "%.06f" % seek_slow]
+
+        if self.frame_timestamps is not None:
+            output_args += ["-fps_mode", "passthrough"]
+        output_args += self.output_params
+
+        cmd = [imageio_ffmpeg.get_ffmpeg_exe(), "-loglevel", "error"]
+        cmd += input_args + ["-i", self.video_filename if self.video_data is None else "pipe:0"]
+        cmd += ["-pix_fmt", "rgb24", "-vcodec", "rawvideo", "-f", "image2pipe"]
+        cmd += output_args + ["-"]
+
+        self._ffmpeg_process = subprocess.Popen(cmd,
+                                                stdin=subprocess.DEVNULL if self.video_data is None else subprocess.PIPE,
+                                                stdout=subprocess.PIPE,
+                                                stderr=subprocess.DEVNULL,
+                                                bufsize=0)
+
+        # Every (re)start of ffmpeg reads the in-memory video from the start
+        if self.video_data is not None:
+            start_video_data_feeder(self._ffmpeg_process, self.video_data)
+
+        self.curr_frame_index = frame_index - 1
+
+        return
+
+    def _stop_decoder(self):
+        if self._ffmpeg_process is not None:
+            self._ffmpeg_process.stdout.close()
+            self._ffmpeg_process.kill()
+            self._ffmpeg_process.wait()
+            self._ffmpeg_process = None
+        return
+
+    def _read_frame_into(self, frame_buffer):
+
+        # readinto() may return fewer bytes than asked for, hence the loop
+        frame_bytes = memoryview(frame_buffer).cast("B")
+        num_bytes_read = 0
+        while num_bytes_read < len(frame_bytes):
+            n = self._ffmpeg_process.stdout.readinto(frame_bytes[num_bytes_read:])
+            if not n:
+                break
+            num_bytes_read += n
+
+        if num_bytes_read == 0:
+            return False
+        if num_bytes_read != len(frame_bytes):
+            raise Exception("End of video reached before full frame {} could be read from {}".format(self.curr_frame_index + 1,
+                                                                                                    self.video_filename))
+
+        self.curr_frame_index += 1
+
+        return True
+
+    def get_frame_by_index(self, frame_index):
+
+        # Re-reading the current frame returns the same view
+        if (frame_index == self.curr_frame_index) and (self._curr_slot is not None):
+            return True, self.ring_buffer[self._curr_slot]
+
+        if ((self._ffmpeg_process is None) or
+                (frame_index < self.curr_frame_index) or
+                (frame_index > self.curr_frame_index + MAX_FORWARD_DECODE_FRAMES)):
+            self._start_decoder(frame_index)
+
+        while self.curr_frame_index < (frame_index - 1):
+            if not self._read_frame_into(self._skip_buffer):
+                return False, None
+
+        slot = self._next_slot
+        self._curr_slot = None
+        if not self._read_frame_into(self.ring_buffer[slot]):
+            return False, None
+
+        self._curr_slot = slot
+        self._next_slot = (slot + 1) % self.num_slots
+
+        return True, self.ring_buffer[slot]
+
+    def get_frame_into(self, frame_index, frame_buffer):
+
+        # ----------------------------------------------------------------------
+        # Same as get_frame_by_index(), but the frame is decoded straight into
+        # <frame_buffer> (e.g. a slot of a SharedFrameRing) instead of into the
+        # ring buffer. Returns whether the frame could be read
+        # ----------------------------------------------------------------------
+        if ((self._ffmpeg_process is None) or
+                (frame_index <= self.curr_frame_index) or
+                (frame_index > self.curr_frame_index + MAX_FORWARD_DECODE_FRAMES)):
+            self._start_decoder(frame_index)
+
+        while self.curr_frame_index < (frame_index - 1):
+            if not self._read_frame_into(self._skip_buffer):
+                return False
+
+        # The current frame is no longer in the ring buffer
+        self._curr_slot = None
+
+        return self._read_frame_into(frame_buffer)
+
+    def close(self):
+        self._stop_decoder()
+        if (self.memory_budget is not None) and (self._num_reserved_bytes > 0):
+            self.memory_budget.release(self._num_reserved_bytes, self._consumer_name)
+            self._num_reserved_bytes = 0
+        return
@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+
+DEFAULT_CACHE_FILENAME = os.path.join(os.path.expanduser("~"), ".cache", "scanthesia", "results.sqlite")
+
+# The fingerprint hashes this many evenly spaced chunks of the video data
+DEFAULT_NUM_FINGERPRINT_CHUNKS = 16
+DEFAULT_FINGERPRINT_CHUNK_SIZE = 64 * 1024
+
+# Concurrent workers may write to the same cache; wait this long for the lock
+SQLITE_TIMEOUT_SECONDS = 30.0
+
+
+def _calc_fingerprint_chunk_offsets(num_bytes, num_chunks, chunk_size):
+
+    # First and last chunks always included, the rest evenly spaced between
+    if num_bytes <= num_chunks * chunk_size:
+        return [0], num_bytes
+
+    return [int(offset) for offset in
+            (i * (num_bytes - chunk_size) // max(1, num_chunks - 1) for i in range(num_chunks))], chunk_size
+
+
+def calc_video_fingerprint(video_source,
+                           num_chunks=DEFAULT_NUM_FINGERPRINT_CHUNKS,
+                           chunk_size=DEFAULT_FINGERPRINT_CHUNK_SIZE):
+
+    # --------------------------------------------------------------------------
+    # A fast content fingerprint: the size of the video data plus a hash of a
+    # few sampled chunks of it, instead of a hash of the whole (large) file.
+    # <video_source> is a filename, or in-memory video data (see VideoReader)
+    # --------------------------------------------------------------------------
+    fingerprint_hash = hashlib.blake2b(digest_size=16)
+
+    if isinstance(video_source, (str, os.PathLike)):
+        num_bytes = os.path.getsize(video_source)
+        chunk_offsets, num_chunk_bytes = _calc_fingerprint_chunk_offsets(num_bytes, num_chunks, chunk_size)
+        with open(video_source, "rb") as video_file:
+            for chunk_offset in chunk_offsets:
+                video_file.seek(chunk_offset)
+                fingerprint_hash.update(video_file.read(num_chunk_bytes))
+    else:
+        video_data = memoryview(video_source).cast("B")
+        num_bytes = len(video_data)
+        chunk_offsets, num_chunk_bytes = _calc_fingerprint_chunk_offsets(num_bytes, num_chunks, chunk_size)
+        for chunk_offset in chunk_offsets:
+            fingerprint_hash.update(video_data[chunk_offset: chunk_offset + num_chunk_bytes])
+
+    return "{}-{}".format(num_bytes, fingerprint_hash.hexdigest())
+
+
+class ResultCache:
+
+    def __init__(self, cache_filename=DEFAULT_CACHE_FILENAME):
+
+        # ----------------------------------------------------------------------
+        # Analysis results, stored as JSON in a local SQLite database, keyed
+        # by the video fingerprint, the name of the analysis and its full set
+        # of parameters (also as JSON, with sorted keys, so that equal
+        # parameters always give equal keys)
+        # ----------------------------------------------------------------------
+        self.cache_filename = cache_filename
+        cache_dir = os.path.dirname(os.path.abspath(cache_filename))
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._connection = sqlite3.connect(cache_filename, timeout=SQLITE_TIMEOUT_SECONDS)
+        with self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS results ("
+                                     "fingerprint TEXT NOT NULL, "
+                                     "analysis_name TEXT NOT NULL, "
+                                     "analysis_params TEXT NOT NULL, "
+                                     "result TEXT NOT NULL, "
+                                     "created_time REAL NOT NULL, "
+                                     "PRIMARY KEY (fingerprint, analysis_name, analysis_params))")
+
+        return
+
+    @staticmethod
+    def _encode_params(analysis_params):
+        return json.dumps(analysis_params, sort_keys=True)
+
+    def get_result(self, fingerprint, analysis_name, analysis_params):
+
+        # Returns (is_cached, result)
+        row = self._connection.execute("SELECT result FROM results "
+                                       "WHERE fingerprint = ? AND analysis_name = ? AND analysis_params = ?",
+                                       (fingerprint, analysis_name, self._encode_params(analysis_params))).fetchone()
+        if row is None:
+            return False, None
+
+        return True, json.loads(row[0])
+
+    def put_result(self, fingerprint, analysis_name, analysis_params, result):
+        with self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                                     (fingerprint, analysis_name, self._encode_params(analysis_params),
+                                      json.dumps(result), time.time()))
+        return
+
+    def invalidate(self, fingerprint=None, analysis_name=None):
+
+        # Removes the results of one video and/or one analysis (or everything,
+        # if neither is given), and returns how many were removed
+        conditions, values = [], []
+        if fingerprint is not None:
+            conditions.append("fingerprint = ?")
+            values.append(fingerprint)
+        if analysis_name is not None:
+            conditions.append("analysis_name = ?")
+            values.append(analysis_name)
+
+        query = "DELETE FROM results"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+
+        with self._connection:
+            num_removed = self._connection.execute(query, values).rowcount
+
+        return num_removed
+
+    def close(self):
+        self._connection.close()
+        return
@@ -0,0 +1,133 @@
+import queue
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .videoIO import VideoReader
+
+# How often (in seconds) a blocked decoder checks whether it should stop
+STOP_POLL_INTERVAL = 0.1
+
+
+class SharedFrameRing:
+
+    def __init__(self,
+                 num_slots,
+                 frame_height, frame_width,
+                 shared_memory_name=None,
+                 num_channels=3):
+
+        # ----------------------------------------------------------------------
+        # A ring of frame slots in shared memory, for handing frames from one
+        # decoder process to analysis processes without pickling or copying
+        # them: frames are decoded straight into a slot, and only the slot
+        # index crosses the process boundary. Which slots are free, and when,
+        # is up to the processes that share the ring.
+        #
+        # Without <shared_memory_name>, a new ring is created (and removed by
+        # close()); with it, an existing ring is attached to. Slots are uint8;
+        # with <num_channels> = 1 they are 2-D (e.g. for binarised frames)
+        # ----------------------------------------------------------------------
+        if (not isinstance(num_slots, int)) or (num_slots < 1):
+            raise Exception("Number of shared frame slots ({}) should be a positive integer".format(num_slots))
+
+        self.num_slots = num_slots
+        self.frame_height = frame_height
+        self.frame_width = frame_width
+        self.num_channels = num_channels
+        self.num_bytes = num_slots * frame_height * frame_width * num_channels
+
+        self.is_owner = shared_memory_name is None
+        self._shared_memory = shared_memory.SharedMemory(name=shared_memory_name,
+                                                         create=self.is_owner,
+                                                         size=self.num_bytes if self.is_owner else 0)
+
+        slot_shape = (frame_height, frame_width) if num_channels == 1 else (frame_height, frame_width, num_channels)
+        self.slots = np.ndarray((num_slots,) + slot_shape, dtype="uint8",
+                                buffer=self._shared_memory.buf)
+
+        return
+
+    def get_spec(self):
+
+        # All that another process needs to attach to this ring
+        return (self._shared_memory.name, self.num_slots, self.frame_height, self.frame_width, self.num_channels)
+
+    @classmethod
+    def attach(cls, ring_spec):
+        shared_memory_name, num_slots, frame_height, frame_width, num_channels = ring_spec
+        return cls(num_slots, frame_height, frame_width,
+                   shared_memory_name=shared_memory_name,
+                   num_channels=num_channels)
+
+    def close(self):
+
+        # Views of the slots must not outlive the ring
+        self.slots = None
+        self._shared_memory.close()
+        if self.is_owner:
+            self._shared_memory.unlink()
+        return
+
+
+def _get_free_slot(free_slot_queue, stop_event):
+    while not stop_event.is_set():
+        try:
+            return free_slot_queue.get(timeout=STOP_POLL_INTERVAL)
+        except queue.Empty:
+            pass
+    return None
+
+
+def run_frame_decoder(ring_spec,
+                      video_source,
+                      frame_indices,
+                      free_slot_queue,
+                      event_queue,
+                      stop_event,
+                      scale_factor=1,
+                      use_timestamp_index=False):
+
+    # --------------------------------------------------------------------------
+    # Body of the decoder process. Decodes the given frames in order, each one
+    # into a free slot of the ring (taken from <free_slot_queue>), and
+    # announces it on <event_queue> as ("frame", position, frame_index, slot).
+    # Then sends ("end", num_frames), or ("error", message) if anything fails,
+    # and always ("done", "decoder") last. Stops early once <stop_event> is set
+    # --------------------------------------------------------------------------
+    frame_ring = None
+    vid_reader = None
+    try:
+        frame_ring = SharedFrameRing.attach(ring_spec)
+
+        # The reader's own ring buffer is not used, so keep it to one slot
+        vid_reader = VideoReader(video_source, use_ring_buffer=True, ring_buffer_size=1,
+                                 scale_factor=scale_factor,
+                                 use_timestamp_index=use_timestamp_index)
+
+        num_frames = 0
+        for position, frame_index in enumerate(frame_indices):
+            slot = _get_free_slot(free_slot_queue, stop_event)
+            if slot is None:
+                break
+
+            if not vid_reader.frame_source.get_frame_into(int(frame_index), frame_ring.slots[slot]):
+                raise Exception("Could not read frame {} of the video".format(frame_index))
+
+            event_queue.put(("frame", position, int(frame_index), slot))
+            num_frames += 1
+
+        event_queue.put(("end", num_frames))
+
+    except Exception:
+        event_queue.put(("error", traceback.format_exc()))
+
+    finally:
+        if vid_reader is not None:
+            vid_reader.close_reader()
+        if frame_ring is not None:
+            frame_ring.close()
+        event_queue.put(("done", "decoder"))
+
+    return
@@ -0,0 +1,315 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+DEFAULT_MAX_QUEUED_FRAMES = 8
+
+# How often (in seconds) a blocked decoder checks whether it should stop
+STOP_POLL_INTERVAL = 0.1
+
+# Queued after a consumer's last frame
+_END_OF_FRAMES = object()
+
+
+class TeeConsumer:
+
+    def __init__(self,
+                 frame_indices,
+                 crop_bounds,
+                 frame_size,
+                 max_queued_frames,
+                 memory_budget,
+                 name):
+
+        # ----------------------------------------------------------------------
+        # One analysis fed by a TeeFrameSource: iterating over it gives its
+        # frames (cropped to <crop_bounds>, of <frame_size> = (height, width))
+        # in ascending frame order, with curr_frame_index set to the index of
+        # the last one. The frames are the consumer's own copies.
+        #
+        # It can stand in for a VideoSampler with a frame array schedule, for
+        # the analyses that read their schedule once, front to back (e.g.
+        # find_vertical_shift_rate() without a result cache, checkpoints or a
+        # resolution scale, and extract_key_activity()); bounds given to them
+        # are then within the crop. It cannot seek or be rewound
+        # ----------------------------------------------------------------------
+        self.frame_indices = np.unique(np.asarray(frame_indices, dtype="int64"))
+        self.name = name
+
+        top_bound, bottom_bound, left_bound, right_bound = crop_bounds
+        self._crop_slices = (slice(top_bound, bottom_bound), slice(left_bound, right_bound))
+
+        self._frame_queue = queue.Queue(maxsize=max_queued_frames)
+        self._closed_event = threading.Event()
+        self._is_exhausted = False
+
+        # The VideoSampler interface
+        self.frame_height, self.frame_width = frame_size
+        self.memory_budget = memory_budget
+        self.is_sampling_generated = True
+        self.num_samples = len(self.frame_indices)
+        self._num_read_samples = 0
+
+        self.curr_frame_index = -1
+
+        return
+
+    @property
+    def curr_sample_index(self):
+        return (self._num_read_samples - 1) if self._num_read_samples > 0 else None
+
+    @curr_sample_index.setter
+    def curr_sample_index(self, sample_index):
+
+        # Analyses reset the index to read from the start, which only a
+        # consumer that has not been read from already is at
+        if sample_index != self.curr_sample_index:
+            raise Exception("Tee consumer {} is at sample {}, and cannot be moved to sample {}".format(self.name,
+                                                                                                       self.curr_sample_index,
+                                                                                                       sample_index))
+        return
+
+    def get_schedule_frame_indices(self):
+        return self.frame_indices.copy()
+
+    def get_sampling_state(self):
+
+        # Same layout as VideoSampler.get_sampling_state()
+        sampling_state = {"start_frame": int(self.frame_indices[0]) if self.num_samples > 0 else None,
+                          "end_frame": int(self.frame_indices[-1]) if self.num_samples > 0 else None,
+                          "sample_step": None,
+                          "num_samples": self.num_samples,
+                          "curr_sample_index": self.curr_sample_index,
+                          "sample_frame_indices": self.frame_indices.tolist()}
+
+        return sampling_state
+
+    def _put(self, item, stop_event):
+
+        # Blocks while the queue is full (back-pressure), but never for a
+        # consumer that is gone
+        while not (self._closed_event.is_set() or stop_event.is_set()):
+            try:
+                self._frame_queue.put(item, timeout=STOP_POLL_INTERVAL)
+                return
+            except queue.Full:
+                pass
+        return
+
+    def _put_frame(self, frame_index, frame, stop_event):
+        self._put((frame_index, np.array(frame[self._crop_slices])), stop_event)
+        return
+
+    def is_closed(self):
+        return self._closed_event.is_set()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+
+        if self._is_exhausted or self.is_closed():
+            raise StopIteration
+
+        # (Closing the consumer from another thread also ends the wait)
+        while True:
+            try:
+                item = self._frame_queue.get(timeout=STOP_POLL_INTERVAL)
+                break
+            except queue.Empty:
+                if self.is_closed():
+                    raise StopIteration
+
+        if item is _END_OF_FRAMES:
+            self._is_exhausted = True
+            raise StopIteration
+        if isinstance(item, BaseException):
+            self._is_exhausted = True
+            raise item
+
+        self.curr_frame_index, frame = item
+        self._num_read_samples += 1
+
+        return frame
+
+    def close(self):
+
+        # ----------------------------------------------------------------------
+        # For analyses that are done before their schedule is: the source stops
+        # decoding for (and waiting on) this consumer. Queued frames are dropped
+        # ----------------------------------------------------------------------
+        self._closed_event.set()
+        while True:
+            try:
+                self._frame_queue.get_nowait()
+            except queue.Empty:
+                break
+        return
+
+
+class TeeFrameSource:
+
+    def __init__(self,
+                 vid_reader,
+                 max_queued_frames=DEFAULT_MAX_QUEUED_FRAMES):
+
+        # ----------------------------------------------------------------------
+        # Several analyses of the same video, fed by a single decode: every
+        # consumer registers its own frame schedule and crop, and the source
+        # decodes the union of all the schedules once, in ascending order, on
+        # its own thread, handing every frame to each consumer that wants it.
+        #
+        # Every consumer has a queue of at most <max_queued_frames> frames; the
+        # decoder waits whenever a consumer's queue is full, so memory stays
+        # bounded, but the consumers must then be read concurrently (e.g. with
+        # run_tee_consumers()), not one after the other. Closed consumers are
+        # skipped, and decoding stops once every consumer is closed.
+        #
+        # <vid_reader> is a VideoReader (ideally in ring buffer mode, since
+        # consumers get copies anyway); it is NOT closed, it belongs to the
+        # caller
+        # ----------------------------------------------------------------------
+        if (not isinstance(max_queued_frames, int)) or (max_queued_frames < 1):
+            raise Exception("Maximum number of queued frames ({}) should be a positive integer".format(max_queued_frames))
+
+        self.vid_reader = vid_reader
+        self.max_queued_frames = max_queued_frames
+
+        self.consumers = []
+        self.num_decoded_frames = 0
+
+        self._decoder_thread = None
+        self._stop_event = threading.Event()
+
+        return
+
+    def add_consumer(self,
+                     frame_indices,
+                     top_bound=None, bottom_bound=None,
+                     left_bound=None, right_bound=None,
+                     name=None):
+
+        # <frame_indices>, e.g. from VideoSampler.get_schedule_frame_indices()
+        if self._decoder_thread is not None:
+            raise Exception("Consumers cannot be added once the tee frame source has started")
+
+        frame_indices = np.asarray(frame_indices)
+        if (frame_indices.size > 0) and ((frame_indices.min() < 0) or (frame_indices.max() >= self.vid_reader.vid_num_frames)):
+            raise Exception("Frame indices should be in [0, {}]".format(self.vid_reader.vid_num_frames - 1))
+
+        frame_size = (len(range(self.vid_reader.frame_height)[top_bound: bottom_bound]),
+                      len(range(self.vid_reader.frame_width)[left_bound: right_bound]))
+
+        consumer = TeeConsumer(frame_indices,
+                               (top_bound, bottom_bound, left_bound, right_bound),
+                               frame_size,
+                               self.max_queued_frames,
+                               self.vid_reader.memory_budget,
+                               name if name is not None else "consumer_{}".format(len(self.consumers)))
+        self.consumers.append(consumer)
+
+        return consumer
+
+    def _run_decoder(self):
+
+        # The union of the schedules, and where every consumer is in its own
+        next_positions = [0] * len(self.consumers)
+        end_item = _END_OF_FRAMES
+
+        try:
+            union_frame_indices = np.unique(np.concatenate([consumer.frame_indices for consumer in self.consumers]))
+
+            for frame_index in union_frame_indices:
+                wanting_consumers = []
+                for consumer_index, consumer in enumerate(self.consumers):
+                    position = next_positions[consumer_index]
+                    if (position < len(consumer.frame_indices)) and (consumer.frame_indices[position] == frame_index):
+                        next_positions[consumer_index] += 1
+                        if not consumer.is_closed():
+                            wanting_consumers.append(consumer)
+
+                if self._stop_event.is_set() or all(consumer.is_closed() for consumer in self.consumers):
+                    break
+                if not wanting_consumers:
+                    continue
+
+                success, frame = self.vid_reader.get_frame_by_index(int(frame_index))
+                if not success:
+                    raise Exception("Could not read frame {} of {}".format(frame_index, self.vid_reader.video_filename))
+                self.num_decoded_frames += 1
+
+                for consumer in wanting_consumers:
+                    consumer._put_frame(int(frame_index), frame, self._stop_event)
+
+        except Exception as error:
+            # Every consumer sees the failure, in place of its next frame
+            end_item = error
+
+        finally:
+            for consumer in self.consumers:
+                consumer._put(end_item, self._stop_event)
+
+        return
+
+    def start(self):
+        if self._decoder_thread is None:
+            self._decoder_thread = threading.Thread(target=self._run_decoder, daemon=True)
+            self._decoder_thread.start()
+        return
+
+    def close(self):
+
+        # Stops decoding, and closes every consumer
+        self._stop_event.set()
+        for consumer in self.consumers:
+            consumer.close()
+        if self._decoder_thread is not None:
+            self._decoder_thread.join()
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+        return
+
+
+def _run_consumer_function(consumer, consumer_function):
+
+    # A consumer that is done (or failed) no longer holds the decoder back
+    try:
+        return consumer_function(consumer)
+    finally:
+        consumer.close()
+
+
+def run_tee_consumers(tee_source, consumer_functions):
+
+    # --------------------------------------------------------------------------
+    # Runs consumer_functions[i](tee_source.consumers[i]) for every consumer,
+    # each on its own thread, over a single decode. Returns their results, in
+    # the same order. If any of them fails, the others are stopped and the
+    # error is raised
+    # --------------------------------------------------------------------------
+    if len(consumer_functions) != len(tee_source.consumers):
+        raise Exception("Expected {} consumer functions, got {}".format(len(tee_source.consumers), len(consumer_functions)))
+
+    tee_source.start()
+    try:
+        with ThreadPoolExecutor(max_workers=len(consumer_functions)) as consumer_executor:
+            futures = [consumer_executor.submit(_run_consumer_function, consumer, consumer_function)
+                       for consumer, consumer_function in zip(tee_source.consumers, consumer_functions)]
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception:
+                    tee_source.close()
+                    raise
+    finally:
+        tee_source.close()
+
+    return results
@@ -0,0 +1,199 @@
+import os
+import tempfile
+import subprocess
+
+import numpy as np
+import imageio_ffmpeg
+
+from .inMemoryVideo import start_video_data_feeder
+from .resultCache import calc_video_fingerprint
+
+DEFAULT_THUMBNAIL_WIDTH = 64
+DEFAULT_THUMBNAIL_HEIGHT = 36
+DEFAULT_THUMBNAIL_FRAME_STEP = 10
+
+# In-memory videos have nowhere "next to them" to keep their index
+DEFAULT_THUMBNAIL_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "scanthesia", "thumbnails")
+
+# Thumbnails are read from ffmpeg this many frame steps at a time
+NUM_STEPS_PER_READ = 64
+
+
+def _is_file_video(vid_reader):
+    return (vid_reader.video_data is None) and (vid_reader._temp_video_filename is None)
+
+
+def _make_thumbnail_filename(vid_reader, frame_step, thumbnail_width, thumbnail_height,
+                             cache_dir=None):
+
+    # Next to the video file, or (by content) in <cache_dir> if given, and in
+    # the default cache directory for videos that only exist in memory or in
+    # a temporary file
+    index_suffix = "thumbs-{}x{}-step{}.npy".format(thumbnail_width, thumbnail_height, frame_step)
+    if (cache_dir is None) and _is_file_video(vid_reader):
+        return "{}.{}".format(vid_reader.video_filename, index_suffix)
+
+    return os.path.join(cache_dir if cache_dir is not None else DEFAULT_THUMBNAIL_CACHE_DIR,
+                        "{}.{}".format(calc_video_fingerprint(vid_reader.video_source), index_suffix))
+
+
+def _read_into(ffmpeg_stdout, buffer):
+
+    # Returns the number of bytes read; fewer than asked for only at the end
+    buffer_bytes = memoryview(buffer).cast("B")
+    num_bytes_read = 0
+    while num_bytes_read < len(buffer_bytes):
+        n = ffmpeg_stdout.readinto(buffer_bytes[num_bytes_read:])
+        if not n:
+            break
+        num_bytes_read += n
+
+    return num_bytes_read
+
+
+def build_thumbnail_index(vid_reader,
+                          thumbnail_filename,
+                          frame_step=DEFAULT_THUMBNAIL_FRAME_STEP,
+                          thumbnail_width=DEFAULT_THUMBNAIL_WIDTH,
+                          thumbnail_height=DEFAULT_THUMBNAIL_HEIGHT):
+
+    # --------------------------------------------------------------------------
+    # One pass of ffmpeg over the whole video: every frame is shrunk to a tiny
+    # grayscale thumbnail (area averaging) by ffmpeg itself, right after it is
+    # decoded, so only the thumbnails cross the pipe. Frames are numbered the
+    # same way as those of <vid_reader>, and every <frame_step>-th one is kept.
+    #
+    # The thumbnails are written as a (num_thumbnails, height, width) uint8
+    # .npy file, which is then loaded memory-mapped
+    # --------------------------------------------------------------------------
+    if (not isinstance(frame_step, int)) or (frame_step < 1):
+        raise Exception("Thumbnail frame step ({}) should be a positive integer".format(frame_step))
+
+    cmd = [imageio_ffmpeg.get_ffmpeg_exe(), "-loglevel", "error",
+           "-i", vid_reader.video_filename if vid_reader.video_data is None else "pipe:0",
+           "-map", "0:v:0",
+           "-vf", "scale={}:{}:flags=area,format=gray".format(thumbnail_width, thumbnail_height)]
+    if vid_reader.frame_timestamps is not None:
+        cmd += ["-fps_mode", "passthrough"]
+    cmd += ["-pix_fmt", "gray", "-vcodec", "rawvideo", "-f", "image2pipe", "-"]
+
+    # ffmpeg's errors go to a temporary file: a stderr pipe that nobody reads
+    # until stdout ends could fill up and block ffmpeg (and so this pass)
+    ffmpeg_stderr_file = tempfile.TemporaryFile()
+    try:
+        ffmpeg_process = subprocess.Popen(cmd,
+                                          stdin=subprocess.DEVNULL if vid_reader.video_data is None else subprocess.PIPE,
+                                          stdout=subprocess.PIPE,
+                                          stderr=ffmpeg_stderr_file,
+                                          bufsize=0)
+    except Exception:
+        ffmpeg_stderr_file.close()
+        raise
+    if vid_reader.video_data is not None:
+        start_video_data_feeder(ffmpeg_process, vid_reader.video_data)
+
+    # ----------------------------------------------------------------------
+    # The exact number of frames is only known at the end of the pass, so
+    # the kept thumbnails go to a raw file first, and become an .npy after
+    # ----------------------------------------------------------------------
+    thumbnail_num_bytes = thumbnail_width * thumbnail_height
+    read_buffer = np.empty((NUM_STEPS_PER_READ * frame_step, thumbnail_height, thumbnail_width), dtype="uint8")
+
+    raw_filename = thumbnail_filename + ".raw.tmp"
+    num_thumbnails = 0
+    try:
+        with open(raw_filename, "wb") as raw_file:
+            while True:
+                num_bytes_read = _read_into(ffmpeg_process.stdout, read_buffer)
+                num_frames_read = num_bytes_read // thumbnail_num_bytes
+
+                # Every read starts at a multiple of frame_step
+                kept_thumbnails = read_buffer[: num_frames_read: frame_step]
+                raw_file.write(kept_thumbnails.tobytes())
+                num_thumbnails += len(kept_thumbnails)
+
+                if num_bytes_read < read_buffer.nbytes:
+                    break
+
+        ffmpeg_process.stdout.close()
+        if ffmpeg_process.wait() != 0:
+            ffmpeg_stderr_file.seek(0)
+            ffmpeg_stderr = ffmpeg_stderr_file.read()
+            raise Exception("Could not build the thumbnail index of {}: {}".format(vid_reader.video_filename,
+                                                                                   ffmpeg_stderr.decode(errors="ignore").strip()))
+        if num_thumbnails == 0:
+            raise Exception("Could not read any frame to build the thumbnail index of {}".format(vid_reader.video_filename))
+
+        # Written to a temporary name and then moved, so that concurrent
+        # readers never load a partially written index
+        tmp_thumbnail_filename = thumbnail_filename + ".tmp.npy"
+        thumbnails = np.lib.format.open_memmap(tmp_thumbnail_filename, mode="w+", dtype="uint8",
+                                               shape=(num_thumbnails, thumbnail_height, thumbnail_width))
+        thumbnails[:] = np.fromfile(raw_filename, dtype="uint8").reshape(thumbnails.shape)
+        thumbnails.flush()
+        del thumbnails
+        os.replace(tmp_thumbnail_filename, thumbnail_filename)
+
+    finally:
+        if ffmpeg_process.poll() is None:
+            ffmpeg_process.kill()
+            ffmpeg_process.wait()
+        ffmpeg_stderr_file.close()
+        if os.path.isfile(raw_filename):
+            os.remove(raw_filename)
+
+    return
+
+
+def load_thumbnail_index(vid_reader,
+                         frame_step=DEFAULT_THUMBNAIL_FRAME_STEP,
+                         thumbnail_width=DEFAULT_THUMBNAIL_WIDTH,
+                         thumbnail_height=DEFAULT_THUMBNAIL_HEIGHT,
+                         thumbnail_filename=None,
+                         cache_dir=None):
+
+    # --------------------------------------------------------------------------
+    # Returns (frame_indices, thumbnails): the frame index of every thumbnail,
+    # and the (num_thumbnails, height, width) memory-mapped thumbnails.
+    #
+    # The index is built once (see build_thumbnail_index()), and rebuilt only
+    # if the video file is newer than it. It is kept next to the video file,
+    # or in <cache_dir> if given; if the video's directory cannot be written
+    # to (read-only or network storage), it goes to the default cache
+    # directory instead. Indexes in a cache directory are by content, so that
+    # of an in-memory video can never be stale
+    # --------------------------------------------------------------------------
+    is_next_to_video = (thumbnail_filename is None) and (cache_dir is None) and _is_file_video(vid_reader)
+    if thumbnail_filename is None:
+        thumbnail_filename = _make_thumbnail_filename(vid_reader, frame_step, thumbnail_width, thumbnail_height,
+                                                      cache_dir=cache_dir)
+
+    is_index_stale = not os.path.isfile(thumbnail_filename)
+    if (not is_index_stale) and _is_file_video(vid_reader):
+        is_index_stale = os.path.getmtime(thumbnail_filename) < os.path.getmtime(vid_reader.video_filename)
+
+    if is_index_stale:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(thumbnail_filename)), exist_ok=True)
+            build_thumbnail_index(vid_reader, thumbnail_filename,
+                                  frame_step=frame_step,
+                                  thumbnail_width=thumbnail_width,
+                                  thumbnail_height=thumbnail_height)
+        except OSError:
+            if not is_next_to_video:
+                raise
+            return load_thumbnail_index(vid_reader,
+                                        frame_step=frame_step,
+                                        thumbnail_width=thumbnail_width,
+                                        thumbnail_height=thumbnail_height,
+                                        cache_dir=DEFAULT_THUMBNAIL_CACHE_DIR)
+
+    thumbnails = np.load(thumbnail_filename, mmap_mode="r")
+    if thumbnails.shape[1:] != (thumbnail_height, thumbnail_width):
+        raise Exception("Thumbnail index {} holds {}x{} thumbnails, expected {}x{}".format(thumbnail_filename,
+                                                                                           thumbnails.shape[2], thumbnails.shape[1],
+                                                                                           thumbnail_width, thumbnail_height))
+
+    frame_indices = np.arange(len(thumbnails), dtype="int64") * frame_step
+
+    return frame_indices, thumbnails
@@ -0,0 +1,101 @@
+import os
+import subprocess
+from fractions import Fraction
+
+import numpy as np
+import imageio_ffmpeg
+
+from .resultCache import calc_video_fingerprint
+
+DEFAULT_TIMESTAMP_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "scanthesia", "timestamps")
+
+# AV_PKT_FLAG_DISCARD, in the "F=" field of framecrc lines
+PACKET_FLAG_DISCARD = 0x4
+
+
+def _parse_framecrc_timestamps(framecrc_text):
+
+    # --------------------------------------------------------------------------
+    # framecrc lines are "stream, dts, pts, duration, size, checksum[, F=flags]", with
+    # the time base in a "#tb 0: num/den" header line. Packets come in decode
+    # order; with B-frames that differs from presentation order, hence the sort
+    # --------------------------------------------------------------------------
+    time_base = None
+    packet_pts = []
+    for line in framecrc_text.splitlines():
+        if line.startswith("#tb 0:"):
+            time_base = Fraction(line.split(":", 1)[1].strip())
+        elif line and not line.startswith("#"):
+            packet_fields = [field.strip() for field in line.split(",")]
+
+            # Packets flagged as discarded (e.g. trimmed by an MP4 edit list)
+            # are never presented, so they are not frames of the video
+            packet_flags = [int(field[2:], 16) for field in packet_fields[6:] if field.startswith("F=")]
+            if packet_flags and (packet_flags[0] & PACKET_FLAG_DISCARD):
+                continue
+
+            packet_pts.append(int(packet_fields[2]))
+
+    if (time_base is None) or (len(packet_pts) == 0):
+        raise Exception("Could not read any video frame timestamps")
+
+    packet_pts = np.sort(np.array(packet_pts, dtype="int64"))
+
+    # Relative to the first frame, the same way ffmpeg seeks
+    return (packet_pts - packet_pts[0]) * float(time_base)
+
+
+def build_frame_timestamps(video_source):
+
+    # --------------------------------------------------------------------------
+    # Presentation timestamps (in seconds) of every frame of the video, in one
+    # pass over the packets: they are copied to the frame checksum muxer, not
+    # decoded. <video_source> is a filename, or in-memory video data
+    # --------------------------------------------------------------------------
+    is_filename = isinstance(video_source, (str, os.PathLike))
+
+    cmd = [imageio_ffmpeg.get_ffmpeg_exe(), "-loglevel", "error",
+           "-i", video_source if is_filename else "pipe:0",
+           "-map", "0:v:0", "-c", "copy", "-f", "framecrc", "-"]
+
+    framecrc_process = subprocess.run(cmd,
+                                      input=None if is_filename else video_source,
+                                      stdin=subprocess.DEVNULL if is_filename else None,
+                                      stdout=subprocess.PIPE,
+                                      stderr=subprocess.PIPE)
+    if framecrc_process.returncode != 0:
+        raise Exception("Could not index the frame timestamps of the video: {}".format(framecrc_process.stderr.decode(errors="ignore").strip()))
+
+    return _parse_framecrc_timestamps(framecrc_process.stdout.decode(errors="ignore"))
+
+
+def load_frame_timestamps(video_source,
+                          cache_dir=DEFAULT_TIMESTAMP_CACHE_DIR):
+
+    # Built once per video content, and then loaded from a .npy cache file
+    if cache_dir is None:
+        return build_frame_timestamps(video_source)
+
+    cache_filename = os.path.join(cache_dir, calc_video_fingerprint(video_source) + ".npy")
+    if os.path.isfile(cache_filename):
+        return np.load(cache_filename)
+
+    frame_timestamps = build_frame_timestamps(video_source)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_cache_filename = cache_filename + ".tmp.npy"
+    np.save(tmp_cache_filename, frame_timestamps)
+    os.replace(tmp_cache_filename, cache_filename)
+
+    return frame_timestamps
+
+
+def calc_frame_index_by_time(frame_timestamps, target_time):
+
+    # The frame on screen at <target_time>: the last one that starts at or
+    # before it. O(log n), by binary search
+    return int(np.searchsorted(frame_timestamps, target_time, side="right")) - 1
+
+
+def calc_frame_indices_by_times(frame_timestamps, target_times):
+    return np.searchsorted(frame_timestamps, target_times, side="right").astype("int64") - 1
@@ -1,25 +1,144 @@
+import os
 import sys
 import math
 import warnings
 
 
 import imageio
+import numpy as np
+
+from .rawFrameSource import RawFrameSource, DEFAULT_NUM_SLOTS
+from .memoryBudget import make_consumer_name
+from .timestampIndex import (load_frame_timestamps,
+                             calc_frame_index_by_time,
+                             calc_frame_indices_by_times,
+                             DEFAULT_TIMESTAMP_CACHE_DIR)
+from .inMemoryVideo import (is_in_memory_video,
+                            read_video_data,
+                            is_pipeable_video_data,
+                            probe_video_data,
+                            write_temp_video_file)
+
+VALID_SCALE_FACTORS = (1, 2, 4, 8)
 
 
 class VideoReader:
 
     def __init__(self,
-                 video_filename):
+                 video_filename,
+                 use_ring_buffer=False,
+                 ring_buffer_size=DEFAULT_NUM_SLOTS,
+                 copy_frames=False,
+                 scale_factor=1,
+                 memory_budget=None,
+                 use_timestamp_index=False,
+                 timestamp_cache_dir=DEFAULT_TIMESTAMP_CACHE_DIR):
+
+        # ----------------------------------------------------------------------
+        # With a scale factor > 1, ffmpeg itself downscales every frame by that
+        # factor (area averaging) before it is piped out, so all the decoded
+        # frames and the frame size metadata are at the reduced resolution
+        # ----------------------------------------------------------------------
+        if scale_factor not in VALID_SCALE_FACTORS:
+            raise Exception("Scale factor ({}) should be one of {}".format(scale_factor, VALID_SCALE_FACTORS))
+        self.scale_factor = scale_factor
 
-        # Open an ImageIO Reader object for the given video file
-        try:
-            self.video_filename = video_filename
-            self.video_reader = imageio.get_reader(self.video_filename, format="ffmpeg")
-        except Exception:
-            raise sys.exc_info()
+        self._decoder_output_params = []
+        if self.scale_factor != 1:
+            self._decoder_output_params = ["-vf", "scale=iw/{0}:ih/{0}:flags=area".format(self.scale_factor)]
 
-        # Extract and store metadata related to the video
-        self._extract_video_metadata()
+        # ----------------------------------------------------------------------
+        # <video_filename> may also be an in-memory video: bytes, a memoryview
+        # or a readable (binary) file-like object. It is piped into ffmpeg
+        # directly, unless the container cannot be read through a pipe, in
+        # which case it is written to a temporary file (removed on close)
+        # ----------------------------------------------------------------------
+        self.video_data = None
+        self._temp_video_filename = None
+        if is_in_memory_video(video_filename):
+            video_data = read_video_data(video_filename)
+            if is_pipeable_video_data(video_data):
+                self.video_data = video_data
+                video_filename = None
+            else:
+                self._temp_video_filename = write_temp_video_file(video_data)
+                video_filename = self._temp_video_filename
+
+        self.video_filename = video_filename
+
+        # What to open another reader of the same video with
+        self.video_source = self.video_filename if self.video_data is None else self.video_data
+
+        if self.video_data is None:
+            # Open an ImageIO Reader object for the given video file
+            try:
+                self.video_reader = imageio.get_reader(self.video_filename, format="ffmpeg",
+                                                       output_params=list(self._decoder_output_params))
+            except Exception:
+                self._remove_temp_video_file()
+                raise sys.exc_info()
+
+            # Extract and store metadata related to the video
+            self._extract_video_metadata()
+
+        else:
+            # Piped videos are always decoded by a RawFrameSource (see below)
+            self.video_reader = None
+            self._extract_piped_video_metadata()
+
+        # ----------------------------------------------------------------------
+        # With a timestamp index, frame indices are those of the frames as they
+        # are in the stream (not resampled to a constant frame rate), and time
+        # <-> index conversions use their actual presentation timestamps. This
+        # is what variable frame rate videos (e.g. screen recordings) need
+        # ----------------------------------------------------------------------
+        self.timestamp_cache_dir = timestamp_cache_dir
+        self.frame_timestamps = None
+        if use_timestamp_index:
+            self.frame_timestamps = load_frame_timestamps(self.video_source, cache_dir=timestamp_cache_dir)
+            self.vid_num_frames = len(self.frame_timestamps)
+
+        # ----------------------------------------------------------------------
+        # In ring buffer mode, frames are decoded by a RawFrameSource straight
+        # into a preallocated ring buffer, and returned as views that are only
+        # valid for the next <ring_buffer_size - 1> reads. Set copy_frames to
+        # get frames that are safe to keep for longer
+        # ----------------------------------------------------------------------
+        self.use_ring_buffer = use_ring_buffer
+        self.ring_buffer_size = ring_buffer_size
+        self.copy_frames = copy_frames
+        self.frame_source = None
+
+        # Optional per-job MemoryBudget, which the ring buffer and bulk frame
+        # fetches draw from
+        self.memory_budget = memory_budget
+        self._consumer_name = make_consumer_name(self)
+
+        if self.use_ring_buffer or (self.video_data is not None) or (self.frame_timestamps is not None):
+            self.frame_source = RawFrameSource(self.video_filename,
+                                               self.frame_width, self.frame_height,
+                                               self.vid_fps,
+                                               num_slots=ring_buffer_size,
+                                               output_params=list(self._decoder_output_params),
+                                               video_data=self.video_data,
+                                               memory_budget=self.memory_budget,
+                                               frame_timestamps=self.frame_timestamps)
+
+        # ----------------------------------------------------------------------
+        # Otherwise the imageio reader decodes every frame into a new array of
+        # its own, so one decoded frame is held for as long as the reader is
+        # open
+        # ----------------------------------------------------------------------
+        self._num_decoder_bytes = 0
+        if (self.memory_budget is not None) and (self.frame_source is None):
+            num_decoder_bytes = self.frame_height * self.frame_width * 3
+            try:
+                self.memory_budget.reserve_or_raise(num_decoder_bytes, self._consumer_name)
+            except Exception:
+                self.video_reader.close()
+                self._remove_temp_video_file()
+                raise
+            self._num_decoder_bytes = num_decoder_bytes
 
         self.curr_frame_index = -1       # Implies video has not been read yet
         self.curr_time_instant = -1.0    # Implies video has not been read yet
@@ -56,6 +175,35 @@ class VideoReader:
 
         return
 
+    def _extract_piped_video_metadata(self):
+
+        self.vid_metadata = probe_video_data(self.video_data)
+
+        # ffmpeg truncates the scaled size, the same way for the imageio reader
+        source_width, source_height = self.vid_metadata["source_size"]
+        self.vid_metadata["size"] = (source_width // self.scale_factor,
+                                     source_height // self.scale_factor)
+
+        self.frame_width, self.frame_height = self.vid_metadata["size"]
+        self.vid_fps = self.vid_metadata["fps"]
+        self.vid_duration_time = self.vid_metadata["duration"]
+        self.vid_num_frames = self.vid_metadata["nframes"]
+
+        if self.vid_num_frames == 0:
+            raise Exception("Could not extract number of frames in the in-memory video")
+
+        return
+
+    def _calc_frame_index_by_time(self, target_time):
+        if self.frame_timestamps is None:
+            return math.floor(target_time * self.vid_fps)
+        return calc_frame_index_by_time(self.frame_timestamps, target_time)
+
+    def _calc_time_by_frame_index(self, frame_index):
+        if self.frame_timestamps is None:
+            return float(frame_index) / self.vid_fps
+        return float(self.frame_timestamps[frame_index])
+
     def get_frame_by_index(self, frame_index):
         frame = None
         success = False
@@ -67,11 +215,20 @@ class VideoReader:
         if (frame_index < 0) or (frame_index >= self.vid_num_frames):
             warnings.warn("Trying to get frame {}, but index should be in [0, {}]".format(frame_index, self.vid_num_frames))
         else:
-            frame = self.video_reader.get_data(frame_index)
+            if self.frame_source is not None:
+                success, frame = self.frame_source.get_frame_by_index(frame_index)
 
-            self.curr_frame_index = self.video_reader._pos
-            self.curr_time_instant = float(self.curr_frame_index) / self.vid_fps
-            success = True
+                # Outside ring buffer mode (i.e. piped or indexed videos), frames are
+                # always handed out as copies, like those of the imageio reader
+                if success and (self.copy_frames or (not self.use_ring_buffer)):
+                    frame = frame.copy()
+            else:
+                frame = self.video_reader.get_data(frame_index)
+                success = True
+
+            if success:
+                self.curr_frame_index = frame_index
+                self.curr_time_instant = self._calc_time_by_frame_index(self.curr_frame_index)
 
         return success, frame
 
@@ -82,7 +239,7 @@ class VideoReader:
         if (target_time < 0.0) or (target_time >= self.vid_duration_time):
             warnings.warn("Trying to get frame at time {}, but video time is limited to [0, {}]".format(target_time, self.vid_duration_time))
         else:
-            target_frame_index = math.floor(target_time * self.vid_fps)
+            target_frame_index = self._calc_frame_index_by_time(target_time)
             success, frame = self.get_frame_by_index(target_frame_index)
 
         return success, frame
@@ -95,16 +252,81 @@ class VideoReader:
         success, frame = self.get_frame_by_time(self.curr_time_instant + increment)
         return success, frame
 
+    def get_frames(self, frame_indices):
+
+        # ----------------------------------------------------------------------
+        # Bulk fetch: the requested frames are decoded in ascending order, in a
+        # single forward pass over the video (each frame decoded once, however
+        # many times it is requested), and returned as one stacked array in the
+        # order of <frame_indices>
+        # ----------------------------------------------------------------------
+        frame_indices = np.asarray(frame_indices)
+        if (frame_indices.ndim != 1) or (not np.issubdtype(frame_indices.dtype, np.integer)):
+            raise Exception("Frame indices should be a 1-D array of integers")
+        if (frame_indices.size > 0) and ((frame_indices.min() < 0) or (frame_indices.max() >= self.vid_num_frames)):
+            raise Exception("Frame indices should be in [0, {}]".format(self.vid_num_frames - 1))
+
+        unique_frame_indices, inverse_indices = np.unique(frame_indices, return_inverse=True)
+
+        # Positions in the output for every unique frame index
+        output_positions = np.split(np.argsort(inverse_indices, kind="stable"),
+                                    np.cumsum(np.bincount(inverse_indices, minlength=len(unique_frame_indices)))[:-1])
+
+        # The stacked frames are handed over to the caller, so their share of
+        # the memory budget is only given back once they are freed
+        num_frames_bytes = len(frame_indices) * self.frame_height * self.frame_width * 3
+        if self.memory_budget is not None:
+            self.memory_budget.reserve_or_raise(num_frames_bytes, self._consumer_name)
+
+        frames = np.empty((len(frame_indices), self.frame_height, self.frame_width, 3), dtype="uint8")
+        if self.memory_budget is not None:
+            self.memory_budget.release_when_freed(frames, num_frames_bytes, self._consumer_name)
+
+        for frame_index, positions in zip(unique_frame_indices, output_positions):
+            success, frame = self.get_frame_by_index(int(frame_index))
+            if not success:
+                raise Exception("Could not read frame {} of {}".format(frame_index, self.video_filename))
+            frames[positions] = frame
+
+        return frames
+
+    def _remove_temp_video_file(self):
+        if self._temp_video_filename is not None:
+            os.remove(self._temp_video_filename)
+            self._temp_video_filename = None
+        return
+
     def close_reader(self):
-        self.video_reader.close()
+        if self.video_reader is not None:
+            self.video_reader.close()
+        if self.frame_source is not None:
+            self.frame_source.close()
+        if self._num_decoder_bytes > 0:
+            self.memory_budget.release(self._num_decoder_bytes, self._consumer_name)
+            self._num_decoder_bytes = 0
+        self._remove_temp_video_file()
         return
 
 
 class VideoSampler(VideoReader):
 
     def __init__(self,
-                 video_filename):
-        super().__init__(video_filename)
+                 video_filename,
+                 use_ring_buffer=False,
+                 ring_buffer_size=DEFAULT_NUM_SLOTS,
+                 copy_frames=False,
+                 scale_factor=1,
+                 memory_budget=None,
+                 use_timestamp_index=False,
+                 timestamp_cache_dir=DEFAULT_TIMESTAMP_CACHE_DIR):
+        super().__init__(video_filename,
+                         use_ring_buffer=use_ring_buffer,
+                         ring_buffer_size=ring_buffer_size,
+                         copy_frames=copy_frames,
+                         scale_factor=scale_factor,
+                         memory_budget=memory_budget,
+                         use_timestamp_index=use_timestamp_index,
+                         timestamp_cache_dir=timestamp_cache_dir)
 
         # Flag to determine whether a sampling has been generated or not
         self.is_sampling_generated = False
@@ -119,6 +341,10 @@ class VideoSampler(VideoReader):
         self.sample_time_diff = None
         self.num_samples = None
         self.curr_sample_index = None
+
+        # Explicit frame indices of every sample, for non-uniform schedules.
+        # `None` implies a uniform schedule, defined by start_frame and sample_step
+        self.sample_frame_indices = None
         return
 
     def gen_sampling_schedule_using_frame_indices(self,
@@ -138,7 +364,7 @@ class VideoSampler(VideoReader):
                 raise Exception("Start Frame index ({}) should be lesser than the total number of video frames ({})".format(start_frame, self.vid_num_frames))
 
         self.start_frame = start_frame
-        self.start_time = float(self.start_frame) / self.vid_fps
+        self.start_time = self._calc_time_by_frame_index(self.start_frame)
 
 
         if not (isinstance(samples_per_second, int)) or (isinstance(samples_per_second, float)):
@@ -169,8 +395,9 @@ class VideoSampler(VideoReader):
         # the input end_frame. Hence, it is set by "calculating" the last frame
         self.end_frame = self.start_frame + ((self.num_samples-1) * self.sample_step)
 
-        self.start_time = float(self.start_frame) / self.vid_fps
-        self.end_time = float(self.end_frame) / self.vid_fps
+        self.start_time = self._calc_time_by_frame_index(self.start_frame)
+        self.end_time = self._calc_time_by_frame_index(self.end_frame)
+        self.sample_frame_indices = None
 
         if reset_sample_index:
             self.curr_sample_index = None     # `None` implies video has not been sampled yet
@@ -180,6 +407,47 @@ class VideoSampler(VideoReader):
         self.is_sampling_generated = True
 
 
+    def gen_sampling_schedule_using_frame_array(self,
+                                                frame_indices,
+                                                reset_sample_index=True):
+
+        # ----------------------------------------------------------------------
+        # A schedule given as explicit frame indices, which need not be evenly
+        # spaced (e.g. clustered around regions of interest). They must be
+        # strictly increasing, so that samples stay in playback order
+        # ----------------------------------------------------------------------
+        frame_indices = np.asarray(frame_indices)
+
+        if (frame_indices.ndim != 1) or (frame_indices.size == 0):
+            raise Exception("Frame indices should be a non-empty 1-D array")
+        if not np.issubdtype(frame_indices.dtype, np.integer):
+            raise Exception("Frame indices ({}) should be integers".format(frame_indices.dtype))
+        if np.any(np.diff(frame_indices) <= 0):
+            raise Exception("Frame indices should be strictly increasing")
+        if (frame_indices[0] < 0) or (frame_indices[-1] >= self.vid_num_frames):
+            raise Exception("Frame indices should be in [0, {}]".format(self.vid_num_frames - 1))
+
+        self.sample_frame_indices = frame_indices.astype("int64")
+
+        self.start_frame = int(self.sample_frame_indices[0])
+        self.end_frame = int(self.sample_frame_indices[-1])
+        self.start_time = self._calc_time_by_frame_index(self.start_frame)
+        self.end_time = self._calc_time_by_frame_index(self.end_frame)
+
+        # There is no single step between samples anymore
+        self.sample_step = None
+        self.sample_time_diff = None
+        self.num_samples = len(self.sample_frame_indices)
+
+        if reset_sample_index:
+            self.curr_sample_index = None     # `None` implies video has not been sampled yet
+        else:
+            self.curr_sample_index = self._calc_sample_index_by_frame(self.curr_frame_index)
+
+        self.is_sampling_generated = True
+
+        return
+
 
     def gen_sampling_schedule_using_time(self,
                                          start_time=None,
@@ -210,6 +478,22 @@ class VideoSampler(VideoReader):
             if end_time >= self.vid_duration_time:
                 raise Exception("End Time ({}) should be lesser than the total video duration ({})".format(end_time, self.vid_duration_time))
 
+        # ----------------------------------------------------------------------
+        # With a timestamp index, samples are evenly spaced in time rather than
+        # in frames (which is not the same at a variable frame rate), and each
+        # one is the frame on screen at its sample time
+        # ----------------------------------------------------------------------
+        if self.frame_timestamps is not None:
+            if samples_per_second <= 0:
+                raise Exception("Samples per second ({}) should be greater than 0".format(samples_per_second))
+
+            num_sample_times = math.floor((end_time - start_time) * samples_per_second) + 1
+            sample_times = start_time + (np.arange(num_sample_times) / float(samples_per_second))
+            frame_indices = np.unique(calc_frame_indices_by_times(self.frame_timestamps, sample_times))
+
+            self.gen_sampling_schedule_using_frame_array(frame_indices, reset_sample_index)
+            return
+
         start_frame = math.floor(start_time * self.vid_fps)
         end_frame = math.floor(end_time * self.vid_fps)
 
@@ -220,16 +504,101 @@ class VideoSampler(VideoReader):
         return
 
 
+    def get_sampling_state(self):
+
+        # ----------------------------------------------------------------------
+        # A plain (JSON-serialisable) snapshot of the sampling schedule and the
+        # current position in it. Times are not stored, since they are derived
+        # from the frame indices and the video FPS
+        # ----------------------------------------------------------------------
+        if not self.is_sampling_generated:
+            raise Exception("Requesting sampling state, but a sampling subset has not been initialised!")
+
+        sampling_state = {"start_frame": self.start_frame,
+                          "end_frame": self.end_frame,
+                          "sample_step": self.sample_step,
+                          "num_samples": self.num_samples,
+                          "curr_sample_index": self.curr_sample_index,
+                          "sample_frame_indices": None}
 
+        if self.sample_frame_indices is not None:
+            sampling_state["sample_frame_indices"] = self.sample_frame_indices.tolist()
 
+        return sampling_state
 
 
+    def set_sampling_state(self, sampling_state):
+
+        if (sampling_state["start_frame"] < 0) or (sampling_state["end_frame"] >= self.vid_num_frames):
+            raise Exception("Sampling state [{}, {}] does not fit in the total number of video frames ({})".format(sampling_state["start_frame"],
+                                                                                                              sampling_state["end_frame"],
+                                                                                                              self.vid_num_frames))
+
+        self.start_frame = sampling_state["start_frame"]
+        self.end_frame = sampling_state["end_frame"]
+        self.sample_step = sampling_state["sample_step"]
+        self.num_samples = sampling_state["num_samples"]
+        self.curr_sample_index = sampling_state["curr_sample_index"]
+
+        self.start_time = self._calc_time_by_frame_index(self.start_frame)
+        self.end_time = self._calc_time_by_frame_index(self.end_frame)
+
+        if sampling_state.get("sample_frame_indices") is None:
+            self.sample_frame_indices = None
+            self.sample_time_diff = float(self.sample_step) / self.vid_fps
+        else:
+            self.sample_frame_indices = np.array(sampling_state["sample_frame_indices"], dtype="int64")
+            self.sample_time_diff = None
+
+        self.is_sampling_generated = True
+
+        return
+
+
+    def clone(self, scale_factor=None):
+
+        # ----------------------------------------------------------------------
+        # A new sampler on the same video, with the same reader options (ring
+        # buffer, in-memory source, timestamp index, memory budget) and the same
+        # sampling schedule and position, optionally at another scale factor.
+        # Frame indices are those of the original, at any scale. (An in-memory
+        # video written to a temporary file is read from that file, so close
+        # the clone before the original)
+        # ----------------------------------------------------------------------
+        cloned_sampler = VideoSampler(self.video_source,
+                                      use_ring_buffer=self.use_ring_buffer,
+                                      ring_buffer_size=self.ring_buffer_size,
+                                      copy_frames=self.copy_frames,
+                                      scale_factor=self.scale_factor if scale_factor is None else scale_factor,
+                                      memory_budget=self.memory_budget,
+                                      use_timestamp_index=self.frame_timestamps is not None,
+                                      timestamp_cache_dir=self.timestamp_cache_dir)
+
+        if self.is_sampling_generated:
+            cloned_sampler.set_sampling_state(self.get_sampling_state())
+
+        return cloned_sampler
+
 
     def _calc_frame_by_sample_index(self, sample_index):
-        return math.floor(self.start_frame + (sample_index * self.sample_step))
+        if self.sample_frame_indices is None:
+            return math.floor(self.start_frame + (sample_index * self.sample_step))
+
+        # For explicit schedules, a non-integer sample index lies (linearly)
+        # between the frames of its neighbouring samples
+        lower_sample_index = math.floor(sample_index)
+        lower_frame = int(self.sample_frame_indices[lower_sample_index])
+        if sample_index == lower_sample_index:
+            return lower_frame
+
+        upper_frame = int(self.sample_frame_indices[lower_sample_index + 1])
+        return math.floor(lower_frame + ((sample_index - lower_sample_index) * (upper_frame - lower_frame)))
 
     def _calc_sample_index_by_frame(self, frame_index):
-        sample_index = float(frame_index - self.start_frame) / self.sample_step
+        if self.sample_frame_indices is None:
+            sample_index = float(frame_index - self.start_frame) / self.sample_step
+        else:
+            sample_index = self._calc_sample_index_by_frame_in_array(frame_index)
 
         # Check if the calculated value is actually an integer or not, and
         # return appropriately
@@ -239,6 +608,64 @@ class VideoSampler(VideoReader):
             return sample_index
 
 
+    def _calc_sample_index_by_frame_in_array(self, frame_index):
+
+        # ----------------------------------------------------------------------
+        # Inverse of _calc_frame_by_sample_index() for explicit schedules.
+        # Frames outside the schedule are extrapolated using the spacing of
+        # the nearest pair of samples (or 1, if there is only one sample)
+        # ----------------------------------------------------------------------
+        sample_frames = self.sample_frame_indices
+        num_samples = len(sample_frames)
+
+        if frame_index <= sample_frames[0]:
+            spacing = int(sample_frames[1] - sample_frames[0]) if num_samples > 1 else 1
+            return float(frame_index - sample_frames[0]) / spacing
+
+        if frame_index >= sample_frames[-1]:
+            spacing = int(sample_frames[-1] - sample_frames[-2]) if num_samples > 1 else 1
+            return (num_samples - 1) + float(frame_index - sample_frames[-1]) / spacing
+
+        lower_sample_index = int(np.searchsorted(sample_frames, frame_index, side="right")) - 1
+        lower_frame = int(sample_frames[lower_sample_index])
+        upper_frame = int(sample_frames[lower_sample_index + 1])
+
+        return lower_sample_index + float(frame_index - lower_frame) / (upper_frame - lower_frame)
+
+
+    def get_schedule_frame_indices(self):
+
+        # Frame index of every sample of the schedule
+        if not self.is_sampling_generated:
+            raise Exception("Requesting the sampled frames, but a sampling subset has not been initialised!")
+
+        return np.array([self._calc_frame_by_sample_index(sample_index)
+                         for sample_index in range(self.num_samples)], dtype="int64")
+
+
+    def get_samples(self, sample_indices,
+                    update_curr_sample_index=True):
+
+        # Bulk version of get_sample_by_index(), for integer sample indices
+        if not self.is_sampling_generated:
+            raise Exception("Requesting samples, but a sampling subset has not been initialised!")
+
+        sample_indices = np.asarray(sample_indices)
+        if (sample_indices.size > 0) and ((sample_indices.min() < 0) or (sample_indices.max() >= self.num_samples)):
+            raise Exception("Sample indices should be in [0, {}]".format(self.num_samples - 1))
+
+        frame_indices = np.array([self._calc_frame_by_sample_index(int(sample_index))
+                                  for sample_index in sample_indices], dtype="int64")
+
+        # Restore the sample index afterwards, if it should not be updated
+        prev_sample_index = self.curr_sample_index
+        frames = self.get_frames(frame_indices)
+        if not update_curr_sample_index:
+            self.curr_sample_index = prev_sample_index
+
+        return frames
+
+
     def get_next_sample(self,
                         update_curr_sample_index=True):
 
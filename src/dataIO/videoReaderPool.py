@@ -0,0 +1,196 @@
+import math
+import threading
+
+from .videoIO import VideoReader
+from .memoryBudget import make_consumer_name
+
+DEFAULT_NUM_READERS = 4
+
+# The imageio ffmpeg reader decodes (and discards) frames to move forward by up
+# to this many frames; any other move restarts ffmpeg with a seek
+MAX_FORWARD_DECODE_FRAMES = 100
+
+
+class VideoReaderPool:
+
+    def __init__(self,
+                 video_filename,
+                 num_readers=DEFAULT_NUM_READERS,
+                 memory_budget=None):
+
+        if (not isinstance(num_readers, int)) or (num_readers < 1):
+            raise Exception("Number of readers ({}) should be a positive integer".format(num_readers))
+
+        # ----------------------------------------------------------------------
+        # The pool is warm: all <num_readers> decoder handles are opened up
+        # front, so requests never wait for ffmpeg to start. Every handle is
+        # given the memory budget, and accounts for its own decoded frame; with
+        # a budget, only as many handles are opened as it can hold (at least
+        # one, for the metadata). Idle handles are evicted when the budget runs
+        # short, and closed slots are reopened lazily, when every open handle
+        # is busy or would have to seek, and the budget has room again
+        # ----------------------------------------------------------------------
+        self.video_filename = video_filename
+        self.memory_budget = memory_budget
+        self._consumer_name = make_consumer_name(self)
+
+        self.video_readers = [None] * num_readers
+        self.video_readers[0] = VideoReader(video_filename, memory_budget=self.memory_budget)
+
+        # Every handle is on the same video, so the metadata of the first one
+        # is the metadata of the pool
+        self.frame_width = self.video_readers[0].frame_width
+        self.frame_height = self.video_readers[0].frame_height
+        self.vid_fps = self.video_readers[0].vid_fps
+        self.vid_duration_time = self.video_readers[0].vid_duration_time
+        self.vid_num_frames = self.video_readers[0].vid_num_frames
+
+        self._reader_bytes = self.frame_height * self.frame_width * 3
+
+        # Indices of open handles that are not serving a request right now,
+        # and of handles that are being opened
+        self._idle_reader_indices = [0]
+        self._opening_reader_indices = set()
+        self._pool_condition = threading.Condition()
+
+        for reader_index in range(1, num_readers):
+            if not self._can_open_reader():
+                break
+            self.video_readers[reader_index] = VideoReader(video_filename, memory_budget=self.memory_budget)
+            self._idle_reader_indices.append(reader_index)
+
+        if self.memory_budget is not None:
+            self.memory_budget.register_shrinkable(self._consumer_name, self._evict_idle_readers)
+
+        return
+
+    def _evict_reader(self, reader_index):
+
+        # (The handle gives its bytes back to the budget as it closes)
+        self.video_readers[reader_index].close_reader()
+        self.video_readers[reader_index] = None
+        self._idle_reader_indices.remove(reader_index)
+        return
+
+    def _evict_idle_readers(self, num_bytes):
+
+        # Always keep at least one handle, so that requests can be served
+        with self._pool_condition:
+            num_open_readers = sum(1 for vid_reader in self.video_readers if vid_reader is not None)
+            num_evictions = min(len(self._idle_reader_indices), num_open_readers - 1,
+                                -(-num_bytes // self._reader_bytes))
+
+            # Evict the handles that were idle the longest first
+            for reader_index in list(self._idle_reader_indices[:max(0, num_evictions)]):
+                self._evict_reader(reader_index)
+
+        return
+
+    def _can_open_reader(self):
+
+        # Checked without holding the pool lock, since the budget calls back
+        # into the pool (with its own lock held) when it shrinks
+        return (self.memory_budget is None) or (self.memory_budget.get_available_bytes() >= self._reader_bytes)
+
+    @staticmethod
+    def _calc_seek_cost(vid_reader, frame_index):
+
+        # ----------------------------------------------------------------------
+        # Approximate number of frames the handle has to decode to reach
+        # <frame_index>: re-reading the current frame is free, moving forward a
+        # little decodes the frames in between, and anything else is a full
+        # seek, which is always costlier than the longest forward decode
+        # ----------------------------------------------------------------------
+        curr_frame_index = vid_reader.curr_frame_index
+
+        if frame_index == curr_frame_index:
+            seek_cost = 0
+        elif curr_frame_index < frame_index <= (curr_frame_index + MAX_FORWARD_DECODE_FRAMES):
+            seek_cost = frame_index - curr_frame_index
+        else:
+            seek_cost = MAX_FORWARD_DECODE_FRAMES + 1
+
+        return seek_cost
+
+    def _acquire_reader(self, frame_index):
+
+        while True:
+            can_open_reader = self._can_open_reader()
+
+            with self._pool_condition:
+                # (Among equally costly handles, an unused one is preferred,
+                # which leaves the others where they are for later requests)
+                best_reader_index = None
+                if self._idle_reader_indices:
+                    best_reader_index = min(self._idle_reader_indices,
+                                            key=lambda i: (self._calc_seek_cost(self.video_readers[i], frame_index),
+                                                           self.video_readers[i].curr_frame_index >= 0))
+
+                # An idle handle close enough is always used. Otherwise, a new
+                # handle costs no more than a seek, and leaves the idle handles
+                # where they are for later requests
+                if ((best_reader_index is not None) and
+                        (self._calc_seek_cost(self.video_readers[best_reader_index], frame_index) <= MAX_FORWARD_DECODE_FRAMES)):
+                    self._idle_reader_indices.remove(best_reader_index)
+                    return best_reader_index
+
+                closed_reader_indices = [i for i, vid_reader in enumerate(self.video_readers)
+                                         if (vid_reader is None) and (i not in self._opening_reader_indices)]
+                if can_open_reader and closed_reader_indices:
+                    reader_index = closed_reader_indices[0]
+                    self._opening_reader_indices.add(reader_index)
+                    break
+
+                if best_reader_index is not None:
+                    self._idle_reader_indices.remove(best_reader_index)
+                    return best_reader_index
+
+                self._pool_condition.wait()
+
+        # Opened outside the lock, so that the other handles keep serving
+        try:
+            vid_reader = VideoReader(self.video_filename, memory_budget=self.memory_budget)
+        except Exception:
+            with self._pool_condition:
+                self._opening_reader_indices.discard(reader_index)
+                self._pool_condition.notify()
+            raise
+
+        with self._pool_condition:
+            self._opening_reader_indices.discard(reader_index)
+            self.video_readers[reader_index] = vid_reader
+
+        return reader_index
+
+    def _release_reader(self, reader_index):
+
+        with self._pool_condition:
+            if self.video_readers[reader_index] is not None:
+                self._idle_reader_indices.append(reader_index)
+            self._pool_condition.notify()
+
+        return
+
+    def get_frame_by_index(self, frame_index):
+
+        # The chosen handle is used exclusively by this thread until released
+        reader_index = self._acquire_reader(frame_index)
+        try:
+            success, frame = self.video_readers[reader_index].get_frame_by_index(frame_index)
+        finally:
+            self._release_reader(reader_index)
+
+        return success, frame
+
+    def get_frame_by_time(self, target_time):
+        target_frame_index = math.floor(target_time * self.vid_fps)
+        success, frame = self.get_frame_by_index(target_frame_index)
+        return success, frame
+
+    def close_pool(self):
+        if self.memory_budget is not None:
+            self.memory_budget.unregister_shrinkable(self._consumer_name)
+        for vid_reader in self.video_readers:
+            if vid_reader is not None:
+                vid_reader.close_reader()
+        return
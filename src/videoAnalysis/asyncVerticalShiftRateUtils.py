@@ -0,0 +1,69 @@
+import asyncio
+
+from ..dataIO.asyncVideoIO import AsyncVideoSampler, DEFAULT_READ_AHEAD
+from .verticalShiftRateUtils import (_get_bin_cropped_frame,
+                                     calc_shift,
+                                     ShiftRateTracker,
+                                     DEFAULT_BINARY_THRESH,
+                                     DEFAULT_NUM_SHIFT_COUNT_THRESHOLD)
+
+
+def _calc_shift_with_next_frame(bin_cropped_frame_prev, full_frame_curr,
+                                top_bound, bottom_bound,
+                                left_bound, right_bound,
+                                bin_thresh):
+
+    # All the numpy work of one iteration, bundled so that it is a single
+    # executor call
+    bin_cropped_frame_curr = _get_bin_cropped_frame(full_frame_curr,
+                                                    top_bound=top_bound, bottom_bound=bottom_bound,
+                                                    left_bound=left_bound, right_bound=right_bound,
+                                                    bin_thresh=bin_thresh)
+
+    curr_shift = calc_shift(bin_cropped_frame_prev, bin_cropped_frame_curr)
+
+    return curr_shift, bin_cropped_frame_curr
+
+
+async def async_find_vertical_shift_rate(vid_sampler,
+                                         top_bound, bottom_bound,
+                                         left_bound, right_bound,
+                                         bin_thresh=DEFAULT_BINARY_THRESH,
+                                         num_shift_count_threshold=DEFAULT_NUM_SHIFT_COUNT_THRESHOLD,
+                                         read_ahead=DEFAULT_READ_AHEAD,
+                                         executor=None):
+
+    # --------------------------------------------------------------------------
+    # Same algorithm as find_vertical_shift_rate(), but decoding runs on the
+    # sampler's own thread (with read-ahead) and the crop / binarise /
+    # calc_shift work runs in <executor> (the loop's default one if None).
+    # The event loop is never blocked, and cancelling the awaiting task stops
+    # the analysis at the next frame
+    # --------------------------------------------------------------------------
+    loop = asyncio.get_running_loop()
+    shift_tracker = ShiftRateTracker(num_shift_count_threshold)
+
+    async with AsyncVideoSampler(vid_sampler, read_ahead=read_ahead) as async_sampler:
+
+        # Get the first frame from the sampling and crop, binarise it
+        full_frame_prev = await async_sampler.__anext__()
+        bin_cropped_frame_prev = await loop.run_in_executor(executor, _get_bin_cropped_frame,
+                                                            full_frame_prev,
+                                                            top_bound, bottom_bound,
+                                                            left_bound, right_bound,
+                                                            bin_thresh)
+
+        async for full_frame_curr in async_sampler:
+
+            curr_shift, bin_cropped_frame_curr = await loop.run_in_executor(executor, _calc_shift_with_next_frame,
+                                                                            bin_cropped_frame_prev, full_frame_curr,
+                                                                            top_bound, bottom_bound,
+                                                                            left_bound, right_bound,
+                                                                            bin_thresh)
+
+            if shift_tracker.update(curr_shift):
+                break
+
+            bin_cropped_frame_prev = bin_cropped_frame_curr
+
+    return shift_tracker.get_best_shift()
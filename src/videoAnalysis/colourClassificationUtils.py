@@ -0,0 +1,104 @@
+import numpy as np
+
+from .frameProcessingUtils import crop_frame
+from .noteActivityUtils import (calc_key_column_edges,
+                                DEFAULT_NUM_KEYS)
+
+DEFAULT_BINS_PER_CHANNEL = 32
+DEFAULT_MAX_COLOUR_DISTANCE = 80.0
+
+BACKGROUND_CLASS_ID = 0
+
+
+def build_colour_lut(class_colours,
+                     bins_per_channel=DEFAULT_BINS_PER_CHANNEL,
+                     max_colour_distance=DEFAULT_MAX_COLOUR_DISTANCE):
+
+    # --------------------------------------------------------------------------
+    # class_colours: sequence of (R, G, B) reference colours, one per class
+    #                (e.g. left hand, right hand). Class IDs start at 1, in the
+    #                order of the sequence; 0 is the background
+    #
+    # Precomputes, for every bin of a quantised RGB cube, the class of the
+    # nearest reference colour, or the background if none is within
+    # <max_colour_distance>. The (float) distances are thus computed only once
+    # per bin, instead of once per pixel of every frame
+    # --------------------------------------------------------------------------
+    class_colours = np.asarray(class_colours, dtype="float64")
+    if (class_colours.ndim != 2) or (class_colours.shape[1] != 3):
+        raise Exception("Class colours should be a sequence of (R, G, B) triples")
+    if not (1 <= len(class_colours) <= 255):
+        raise Exception("Number of classes ({}) should be in [1, 255]".format(len(class_colours)))
+    if (bins_per_channel not in (2, 4, 8, 16, 32, 64, 128, 256)):
+        raise Exception("Bins per channel ({}) should be a power of 2, up to 256".format(bins_per_channel))
+
+    # Centre colour of every bin, along each channel
+    bin_width = 256 // bins_per_channel
+    bin_centres = np.arange(bins_per_channel) * bin_width + (bin_width - 1) / 2.0
+
+    r, g, b = np.meshgrid(bin_centres, bin_centres, bin_centres, indexing="ij")
+    bin_colours = np.stack((r, g, b), axis=-1).reshape(-1, 1, 3)
+
+    sq_distances = np.sum((bin_colours - class_colours[np.newaxis, :, :]) ** 2, axis=-1)
+    nearest_class = np.argmin(sq_distances, axis=1)
+    nearest_sq_distance = sq_distances[np.arange(len(nearest_class)), nearest_class]
+
+    colour_lut = (nearest_class + 1).astype("uint8")
+    colour_lut[nearest_sq_distance > max_colour_distance ** 2] = BACKGROUND_CLASS_ID
+
+    return colour_lut.reshape(bins_per_channel, bins_per_channel, bins_per_channel)
+
+
+def classify_frame_colours(frame, colour_lut):
+
+    # --------------------------------------------------------------------------
+    # Converts a uint8 RGB frame into an image of class IDs, by quantising
+    # every pixel to its bin and looking the bin up, in one indexing operation.
+    # (label_image != BACKGROUND_CLASS_ID) can stand in for a binarised frame
+    # --------------------------------------------------------------------------
+    if (frame.ndim != 3) or (frame.shape[2] != 3) or (frame.dtype != np.uint8):
+        raise Exception("Colour classification needs a uint8 RGB frame, got {} of shape {}".format(frame.dtype, frame.shape))
+
+    bin_shift = 8 - int(np.log2(colour_lut.shape[0]))
+    bin_frame = frame >> bin_shift
+
+    return colour_lut[bin_frame[..., 0], bin_frame[..., 1], bin_frame[..., 2]]
+
+
+def calc_key_class_activity(full_frame,
+                            top_bound, bottom_bound,
+                            left_bound, right_bound,
+                            colour_lut,
+                            num_classes,
+                            num_keys=DEFAULT_NUM_KEYS):
+
+    # --------------------------------------------------------------------------
+    # Per-class version of calc_key_activity(): returns a (num_classes, num_keys)
+    # array with the fraction of each key's column group that is of each class
+    # (e.g. row 0 for the left hand and row 1 for the right hand).
+    #
+    # <num_classes> is the number of class colours the LUT was built from. It
+    # cannot be told from the LUT itself, since a class may not win any bin,
+    # and its row is then all zeros
+    # --------------------------------------------------------------------------
+    if int(colour_lut.max()) > num_classes:
+        raise Exception("Colour LUT has class {}, but only {} classes were given".format(int(colour_lut.max()), num_classes))
+
+    cropped_frame = crop_frame(full_frame,
+                               top_row=top_bound, bottom_row=bottom_bound,
+                               left_col=left_bound, right_col=right_bound)
+    label_frame = classify_frame_colours(cropped_frame, colour_lut)
+
+    num_rows, num_cols = label_frame.shape
+
+    # Count every (class, column) pair at once
+    col_ids = np.broadcast_to(np.arange(num_cols), label_frame.shape)
+    class_col_counts = np.bincount((label_frame.astype("int64") * num_cols + col_ids).ravel(),
+                                   minlength=(num_classes + 1) * num_cols)
+    class_col_counts = class_col_counts.reshape(num_classes + 1, num_cols)[1:]
+
+    col_edges = calc_key_column_edges(num_cols, num_keys)
+    class_key_counts = np.add.reduceat(class_col_counts, col_edges[:-1], axis=1)
+    key_num_pixels = num_rows * np.diff(col_edges)
+
+    return (class_key_counts / key_num_pixels).astype("float32")
@@ -1,4 +1,5 @@
 import sys
+import hashlib
 
 import numpy as np
 from skimage.color import rgb2gray
@@ -83,3 +84,18 @@ def binarise_frame(frame,
         gray_frame = frame
 
     return gray_frame > thresh
+
+
+def calc_frame_signature(bin_frame):
+
+    # --------------------------------------------------------------------------
+    # A short digest of a binary frame, packed to 1 bit per pixel first. Two
+    # frames have the same signature only if they are identical (barring hash
+    # collisions), which makes it a cheap test for static or duplicated frames
+    # --------------------------------------------------------------------------
+    packed_frame = np.packbits(bin_frame, axis=None)
+
+    frame_signature = hashlib.blake2b(packed_frame.tobytes(), digest_size=16)
+    frame_signature.update(np.array(bin_frame.shape, dtype="int64").tobytes())
+
+    return frame_signature.digest()
@@ -0,0 +1,109 @@
+import numpy as np
+
+from .frameProcessingUtils import (crop_frame,
+                                   binarise_frame)
+
+DEFAULT_NUM_KEYS = 88
+
+# Activity stored as uint8 is the lit fraction scaled to [0, UINT8_ACTIVITY_SCALE]
+UINT8_ACTIVITY_SCALE = 255
+
+
+def calc_key_column_edges(num_cols, num_keys=DEFAULT_NUM_KEYS):
+
+    # Splits <num_cols> columns into <num_keys> (nearly) equal groups, and
+    # returns the num_keys + 1 column edges between them
+    if num_cols < num_keys:
+        raise Exception("Cannot split {} columns into {} keys".format(num_cols, num_keys))
+
+    return np.linspace(0, num_cols, num_keys + 1).astype("int64")
+
+
+def calc_key_activity(full_frame,
+                      top_bound, bottom_bound,
+                      left_bound, right_bound,
+                      bin_thresh,
+                      num_keys=DEFAULT_NUM_KEYS):
+
+    # --------------------------------------------------------------------------
+    # Returns, for every key, the fraction of "lit" pixels in its column group
+    # of the given band (e.g. a thin band of rows just above the keyboard)
+    # --------------------------------------------------------------------------
+    cropped_frame = crop_frame(full_frame,
+                               top_row=top_bound, bottom_row=bottom_bound,
+                               left_col=left_bound, right_col=right_bound)
+    bin_frame = binarise_frame(cropped_frame, bin_thresh)
+
+    col_edges = calc_key_column_edges(bin_frame.shape[1], num_keys)
+    col_counts = np.count_nonzero(bin_frame, axis=0)
+
+    key_counts = np.add.reduceat(col_counts, col_edges[:-1])
+    key_num_pixels = bin_frame.shape[0] * np.diff(col_edges)
+
+    return (key_counts / key_num_pixels).astype("float32")
+
+
+def extract_key_activity(vid_sampler,
+                         top_bound, bottom_bound,
+                         left_bound, right_bound,
+                         bin_thresh,
+                         num_keys=DEFAULT_NUM_KEYS,
+                         dtype="float32",
+                         output_filename=None):
+
+    # --------------------------------------------------------------------------
+    # Streams every sample of the sampler's schedule once, and reduces each
+    # one to the lit fractions of its keys (see calc_key_activity()) in the
+    # given band, right away, so that no frame is held any longer than it is
+    # needed. Returns (frame_indices, activity_matrix), the latter of shape
+    # (num_samples, num_keys). With an <output_filename>, the matrix is a
+    # memory-mapped .npy file, so that it need not fit in memory either.
+    #
+    # dtype "uint8" stores the fractions scaled to [0, 255] instead
+    # --------------------------------------------------------------------------
+    if not vid_sampler.is_sampling_generated:
+        raise Exception("Extracting key activity, but a sampling subset has not been initialised!")
+    if dtype not in ("float32", "uint8"):
+        raise Exception("Key activity dtype ({}) should be float32 or uint8".format(dtype))
+
+    num_samples = vid_sampler.num_samples
+    if output_filename is None:
+        activity_matrix = np.empty((num_samples, num_keys), dtype=dtype)
+    else:
+        activity_matrix = np.lib.format.open_memmap(output_filename, mode="w+",
+                                                    dtype=dtype, shape=(num_samples, num_keys))
+    frame_indices = np.empty(num_samples, dtype="int64")
+
+    # The band and its column groups are the same for every frame, so the
+    # scale from lit pixel counts to activities is computed only once
+    key_scale = None
+    full_activity = float(UINT8_ACTIVITY_SCALE) if dtype == "uint8" else 1.0
+
+    vid_sampler.curr_sample_index = None     # Always the whole schedule
+    num_read_samples = 0
+    for full_frame in vid_sampler:
+        bin_band = binarise_frame(crop_frame(full_frame,
+                                             top_row=top_bound, bottom_row=bottom_bound,
+                                             left_col=left_bound, right_col=right_bound),
+                                  bin_thresh)
+
+        if key_scale is None:
+            col_edges = calc_key_column_edges(bin_band.shape[1], num_keys)
+            key_scale = (full_activity / (bin_band.shape[0] * np.diff(col_edges))).astype("float32")
+
+        key_counts = np.add.reduceat(np.count_nonzero(bin_band, axis=0), col_edges[:-1])
+        key_activity = key_counts * key_scale
+        if dtype == "uint8":
+            key_activity = np.rint(key_activity)
+
+        activity_matrix[num_read_samples] = key_activity
+        frame_indices[num_read_samples] = vid_sampler.curr_frame_index
+        num_read_samples += 1
+
+    if num_read_samples != num_samples:
+        raise Exception("Only {} of the {} samples could be read".format(num_read_samples, num_samples))
+
+    if output_filename is not None:
+        activity_matrix.flush()
+
+    return frame_indices, activity_matrix
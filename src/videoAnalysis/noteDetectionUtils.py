@@ -0,0 +1,269 @@
+import numpy as np
+
+from .noteActivityUtils import (DEFAULT_NUM_KEYS,
+                                UINT8_ACTIVITY_SCALE)
+
+DEFAULT_ON_THRESH = 0.5
+DEFAULT_OFF_THRESH = 0.3
+DEFAULT_MIN_DURATION_FRAMES = 2
+
+MIN_VELOCITY = 1
+MAX_VELOCITY = 127
+
+
+def _calc_segment_peaks(activity_matrix, keys, start_frames, end_frames):
+
+    # --------------------------------------------------------------------------
+    # Peak activity of every [start_frame, end_frame) segment of the given
+    # keys, with a single maximum.reduceat over the key-major flattened matrix.
+    # Empty segments get -inf
+    # --------------------------------------------------------------------------
+    num_frames = activity_matrix.shape[0]
+    if len(keys) == 0:
+        return np.empty(0, dtype="float32")
+
+    # A trailing sentinel keeps every segment end a valid reduceat index
+    flat_activity = np.append(activity_matrix.T.astype("float32").ravel(), np.float32(-np.inf))
+    segment_bounds = np.empty(2 * len(keys), dtype="int64")
+    segment_bounds[0::2] = keys * num_frames + start_frames
+    segment_bounds[1::2] = keys * num_frames + end_frames
+
+    segment_peaks = np.maximum.reduceat(flat_activity, segment_bounds)[0::2]
+    segment_peaks[end_frames <= start_frames] = -np.inf
+
+    return segment_peaks
+
+
+class NoteEventDetector:
+
+    def __init__(self,
+                 num_keys=DEFAULT_NUM_KEYS,
+                 on_thresh=DEFAULT_ON_THRESH,
+                 off_thresh=DEFAULT_OFF_THRESH,
+                 min_duration_frames=DEFAULT_MIN_DURATION_FRAMES,
+                 activity_scale=1.0):
+
+        # ----------------------------------------------------------------------
+        # Hysteresis: a key turns on when its activity reaches <on_thresh>, and
+        # stays on until it drops below <off_thresh>, so that flicker around a
+        # single threshold does not split one note into many. Notes shorter
+        # than <min_duration_frames> are dropped.
+        #
+        # Activity matrices may be fed in consecutive chunks (of any length);
+        # keys that are on at the end of a chunk are carried over to the next.
+        # Thresholds are fractions; <activity_scale> is the activity of a
+        # fully lit key (e.g. 255 for uint8 matrices)
+        # ----------------------------------------------------------------------
+        if off_thresh > on_thresh:
+            raise Exception("Off threshold ({}) should not be above the on threshold ({})".format(off_thresh, on_thresh))
+        if min_duration_frames < 1:
+            raise Exception("Minimum note duration ({}) should be at least 1 frame".format(min_duration_frames))
+
+        self.num_keys = num_keys
+        self.on_thresh = on_thresh * activity_scale
+        self.off_thresh = off_thresh * activity_scale
+        self.min_duration_frames = min_duration_frames
+        self.activity_scale = activity_scale
+
+        # Carry-over state, per key
+        self.is_key_on = np.zeros(num_keys, dtype="bool")
+        self.open_onset_frames = np.zeros(num_keys, dtype="int64")
+        self.open_peak_activity = np.full(num_keys, -np.inf, dtype="float32")
+        self.num_frames_seen = 0
+
+        return
+
+    def _calc_velocities(self, peak_activity):
+        return np.clip(np.rint(peak_activity / self.activity_scale * MAX_VELOCITY),
+                       MIN_VELOCITY, MAX_VELOCITY).astype("uint8")
+
+    def _finish_notes(self, note_keys, onset_frames, offset_frames, peak_activity):
+
+        # Minimum duration filter, and ordering by key and then onset
+        is_long_enough = (offset_frames - onset_frames) >= self.min_duration_frames
+        note_keys = note_keys[is_long_enough]
+        onset_frames = onset_frames[is_long_enough]
+        offset_frames = offset_frames[is_long_enough]
+        velocities = self._calc_velocities(peak_activity[is_long_enough])
+
+        order = np.lexsort((onset_frames, note_keys))
+
+        return note_keys[order], onset_frames[order], offset_frames[order], velocities[order]
+
+    def process_chunk(self, activity_chunk):
+
+        # --------------------------------------------------------------------------
+        # activity_chunk: (num_frames, num_keys), the frames following those of
+        # the previous chunk
+        #
+        # Returns (keys, onset_frames, offset_frames, velocities) of the notes
+        # that ended within this chunk; frames are counted from the first chunk
+        # --------------------------------------------------------------------------
+        activity_chunk = np.asarray(activity_chunk)
+        num_frames = activity_chunk.shape[0]
+        if (activity_chunk.ndim != 2) or (activity_chunk.shape[1] != self.num_keys):
+            raise Exception("Activity chunk should be of shape (num_frames, {}), got {}".format(self.num_keys, activity_chunk.shape))
+
+        # ----------------------------------------------------------------------
+        # Hysteresis, vectorised: every frame is an "on" trigger (+1), an "off"
+        # trigger (-1) or neither (0). The state of a key at a frame is that of
+        # its latest trigger, found with a running maximum over the trigger
+        # positions. Row 0 holds the carried-over state
+        # ----------------------------------------------------------------------
+        triggers = np.zeros((num_frames + 1, self.num_keys), dtype="int8")
+        triggers[0] = np.where(self.is_key_on, 1, -1)
+        triggers[1:][activity_chunk >= self.on_thresh] = 1
+        triggers[1:][activity_chunk < self.off_thresh] = -1
+
+        trigger_positions = np.where(triggers != 0, np.arange(num_frames + 1)[:, np.newaxis], 0)
+        latest_trigger_positions = np.maximum.accumulate(trigger_positions, axis=0)
+        key_states = np.take_along_axis(triggers, latest_trigger_positions, axis=0) == 1
+
+        # Rising edge at row t: on from chunk frame t. Falling: off from frame t
+        edges = np.diff(key_states.astype("int8"), axis=0)
+        onset_keys, onset_local_frames = np.nonzero(edges.T == 1)
+        offset_keys, offset_local_frames = np.nonzero(edges.T == -1)
+
+        # ----------------------------------------------------------------------
+        # Pair onsets with offsets: notes carried over get a virtual onset at
+        # frame -1, and notes still on at the end of the chunk are left
+        # unpaired. Then, per key, the sorted onsets and offsets alternate
+        # ----------------------------------------------------------------------
+        carried_keys = np.flatnonzero(self.is_key_on)
+        onset_keys = np.concatenate((carried_keys, onset_keys))
+        onset_local_frames = np.concatenate((np.full(len(carried_keys), -1), onset_local_frames))
+        onset_order = np.lexsort((onset_local_frames, onset_keys))
+        onset_keys = onset_keys[onset_order]
+        onset_local_frames = onset_local_frames[onset_order]
+
+        is_on_at_end = key_states[-1]
+        is_last_onset_of_key = np.append(onset_keys[1:] != onset_keys[:-1], True) if len(onset_keys) else np.zeros(0, dtype="bool")
+        is_open_onset = is_last_onset_of_key & is_on_at_end[onset_keys]
+
+        closed_keys = onset_keys[~is_open_onset]
+        closed_onset_local_frames = onset_local_frames[~is_open_onset]
+
+        # Peaks within this chunk, combined with what was carried over
+        is_carried = closed_onset_local_frames < 0
+        peak_activity = _calc_segment_peaks(activity_chunk, closed_keys,
+                                            np.maximum(closed_onset_local_frames, 0), offset_local_frames)
+        peak_activity[is_carried] = np.maximum(peak_activity[is_carried], self.open_peak_activity[closed_keys[is_carried]])
+
+        onset_frames = np.where(is_carried,
+                                self.open_onset_frames[closed_keys],
+                                closed_onset_local_frames + self.num_frames_seen)
+        offset_frames = offset_local_frames + self.num_frames_seen
+
+        # ----------------------------------------------------------------------
+        # Update the carry-over state with the notes that are still on
+        # ----------------------------------------------------------------------
+        open_keys = onset_keys[is_open_onset]
+        open_onset_local_frames = onset_local_frames[is_open_onset]
+        open_peak_activity = _calc_segment_peaks(activity_chunk, open_keys,
+                                                 np.maximum(open_onset_local_frames, 0),
+                                                 np.full(len(open_keys), num_frames))
+
+        is_open_carried = open_onset_local_frames < 0
+        new_open_peak_activity = np.full(self.num_keys, -np.inf, dtype="float32")
+        new_open_peak_activity[open_keys] = np.where(is_open_carried,
+                                                     np.maximum(open_peak_activity, self.open_peak_activity[open_keys]),
+                                                     open_peak_activity)
+        new_open_onset_frames = np.zeros(self.num_keys, dtype="int64")
+        new_open_onset_frames[open_keys] = np.where(is_open_carried,
+                                                    self.open_onset_frames[open_keys],
+                                                    open_onset_local_frames + self.num_frames_seen)
+
+        self.is_key_on = is_on_at_end.copy()
+        self.open_peak_activity = new_open_peak_activity
+        self.open_onset_frames = new_open_onset_frames
+        self.num_frames_seen += num_frames
+
+        return self._finish_notes(closed_keys, onset_frames, offset_frames, peak_activity)
+
+    def flush(self):
+
+        # End of the stream: every key that is still on ends here
+        open_keys = np.flatnonzero(self.is_key_on)
+        notes = self._finish_notes(open_keys,
+                                   self.open_onset_frames[open_keys],
+                                   np.full(len(open_keys), self.num_frames_seen, dtype="int64"),
+                                   self.open_peak_activity[open_keys])
+
+        self.is_key_on[:] = False
+        self.open_peak_activity[:] = -np.inf
+
+        return notes
+
+
+def detect_note_events_in_chunks(activity_chunks,
+                                 num_keys=DEFAULT_NUM_KEYS,
+                                 on_thresh=DEFAULT_ON_THRESH,
+                                 off_thresh=DEFAULT_OFF_THRESH,
+                                 min_duration_frames=DEFAULT_MIN_DURATION_FRAMES,
+                                 activity_scale=1.0):
+
+    # --------------------------------------------------------------------------
+    # All the notes of an activity matrix given as consecutive chunks (any
+    # iterable of them, e.g. one per shard of a video), with a single
+    # NoteEventDetector, so that notes crossing chunk boundaries are neither
+    # split nor duplicated. Same output as detect_note_events()
+    # --------------------------------------------------------------------------
+    note_detector = NoteEventDetector(num_keys=num_keys,
+                                      on_thresh=on_thresh,
+                                      off_thresh=off_thresh,
+                                      min_duration_frames=min_duration_frames,
+                                      activity_scale=activity_scale)
+
+    chunk_notes = [note_detector.process_chunk(activity_chunk) for activity_chunk in activity_chunks]
+    chunk_notes.append(note_detector.flush())
+
+    note_keys, onset_frames, offset_frames, velocities = [np.concatenate(chunk_arrays)
+                                                          for chunk_arrays in zip(*chunk_notes)]
+    order = np.lexsort((onset_frames, note_keys))
+
+    return note_keys[order], onset_frames[order], offset_frames[order], velocities[order]
+
+
+def detect_note_events(activity_matrix,
+                       on_thresh=DEFAULT_ON_THRESH,
+                       off_thresh=DEFAULT_OFF_THRESH,
+                       min_duration_frames=DEFAULT_MIN_DURATION_FRAMES,
+                       activity_scale=None):
+
+    # --------------------------------------------------------------------------
+    # All the notes of a whole activity matrix (see extract_key_activity()),
+    # as (keys, onset_frames, offset_frames, velocities), ordered by key and
+    # then by onset. Offsets are exclusive, and the velocity is the peak
+    # activity of the note, scaled to [1, 127]
+    # --------------------------------------------------------------------------
+    activity_matrix = np.asarray(activity_matrix)
+    if activity_scale is None:
+        activity_scale = float(UINT8_ACTIVITY_SCALE) if activity_matrix.dtype == np.uint8 else 1.0
+
+    return detect_note_events_in_chunks([activity_matrix],
+                                        num_keys=activity_matrix.shape[1],
+                                        on_thresh=on_thresh,
+                                        off_thresh=off_thresh,
+                                        min_duration_frames=min_duration_frames,
+                                        activity_scale=activity_scale)
+
+
+def find_note_runs(activity_matrix,
+                   activity_thresh=DEFAULT_ON_THRESH):
+
+    # --------------------------------------------------------------------------
+    # activity_matrix: (num_frames, num_keys)
+    #
+    # A note is a run of consecutive frames in which a key's activity is at
+    # least <activity_thresh> (i.e. detect_note_events() without hysteresis
+    # or a minimum duration, with an absolute threshold). Returns the key, the
+    # onset frame and the offset frame (exclusive) of every note, ordered by
+    # key and then by onset
+    # --------------------------------------------------------------------------
+    note_keys, onset_frames, offset_frames, _ = detect_note_events(activity_matrix,
+                                                                   on_thresh=activity_thresh,
+                                                                   off_thresh=activity_thresh,
+                                                                   min_duration_frames=1,
+                                                                   activity_scale=1.0)
+
+    return note_keys, onset_frames, offset_frames
@@ -0,0 +1,327 @@
+import os
+import queue
+import traceback
+import collections
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+from ..dataIO.sharedFrameRing import SharedFrameRing, run_frame_decoder
+from ..dataIO.memoryBudget import make_consumer_name
+from .verticalShiftRateUtils import (_get_bin_cropped_frame,
+                                     _check_shift_threads,
+                                     calc_shift,
+                                     calc_shift_by_row_hash,
+                                     ShiftRateTracker,
+                                     DEFAULT_BINARY_THRESH,
+                                     DEFAULT_NUM_SHIFT_COUNT_THRESHOLD)
+
+# Every worker binarises or matches from a few slots, while the next frame
+# decodes
+NUM_SLOTS_PER_WORKER = 3
+
+# How often (in seconds) the coordinator checks that no process has crashed
+PROCESS_POLL_INTERVAL = 1.0
+
+
+def _run_shift_worker(frame_ring_spec,
+                      bin_ring_spec,
+                      work_queue,
+                      event_queue,
+                      stop_event,
+                      top_bound, bottom_bound,
+                      left_bound, right_bound,
+                      bin_thresh,
+                      num_shift_threads,
+                      prune_shifts,
+                      use_row_hash):
+
+    # --------------------------------------------------------------------------
+    # Body of an analysis worker process. Takes work items from <work_queue>
+    # until it gets None:
+    #   ("binarise", position, frame_slot, bin_slot): crops and binarises a
+    #       decoded frame, from the frame ring into the binarised frame ring,
+    #       and answers ("binarised", position, frame_slot, bin_slot)
+    #   ("pair", pair_index, prev_bin_slot, curr_bin_slot): matches a pair of
+    #       binarised frames in place, and answers ("shift", pair_index, shift)
+    # Sends ("error", message) if anything fails, and always ("done", "worker")
+    # last
+    # --------------------------------------------------------------------------
+    frame_ring = None
+    bin_ring = None
+    shift_thread_pool = None
+    try:
+        frame_ring = SharedFrameRing.attach(frame_ring_spec)
+        bin_ring = SharedFrameRing.attach(bin_ring_spec)
+
+        shift_engine = calc_shift_by_row_hash if use_row_hash else calc_shift
+        if num_shift_threads > 1:
+            shift_thread_pool = ThreadPoolExecutor(max_workers=num_shift_threads)
+
+        while True:
+            work_item = work_queue.get()
+            if work_item is None:
+                break
+
+            # The analysis is over; what is left in the queue is not needed
+            if stop_event.is_set():
+                continue
+
+            if work_item[0] == "binarise":
+                _, position, frame_slot, bin_slot = work_item
+                bin_ring.slots[bin_slot] = _get_bin_cropped_frame(frame_ring.slots[frame_slot],
+                                                                  top_bound=top_bound, bottom_bound=bottom_bound,
+                                                                  left_bound=left_bound, right_bound=right_bound,
+                                                                  bin_thresh=bin_thresh)
+                event_queue.put(("binarised", position, frame_slot, bin_slot))
+
+            else:
+                _, pair_index, prev_bin_slot, curr_bin_slot = work_item
+                curr_shift = shift_engine(bin_ring.slots[prev_bin_slot].view("bool"),
+                                          bin_ring.slots[curr_bin_slot].view("bool"),
+                                          num_threads=num_shift_threads,
+                                          prune_shifts=prune_shifts,
+                                          thread_pool=shift_thread_pool)
+                event_queue.put(("shift", pair_index, int(curr_shift)))
+
+    except Exception:
+        event_queue.put(("error", traceback.format_exc()))
+
+    finally:
+        if shift_thread_pool is not None:
+            shift_thread_pool.shutdown()
+        if bin_ring is not None:
+            bin_ring.close()
+        if frame_ring is not None:
+            frame_ring.close()
+        event_queue.put(("done", "worker"))
+
+    return
+
+
+def parallel_find_vertical_shift_rate(vid_sampler,
+                                      top_bound, bottom_bound,
+                                      left_bound, right_bound,
+                                      bin_thresh=DEFAULT_BINARY_THRESH,
+                                      num_shift_count_threshold=DEFAULT_NUM_SHIFT_COUNT_THRESHOLD,
+                                      num_workers=None,
+                                      num_slots=None,
+                                      num_shift_threads=1,
+                                      prune_shifts=False,
+                                      use_row_hash=False):
+
+    # --------------------------------------------------------------------------
+    # Same algorithm as find_vertical_shift_rate(), over the rest of the
+    # sampler's schedule, but with one decoder process and <num_workers>
+    # analysis processes sharing two rings of <num_slots> slots: decoded
+    # frames, and binarised crops. The decoder fills free frame slots; every
+    # frame is binarised once, into a binarised slot, by whichever worker is
+    # free (which frees its frame slot); and every pair of consecutive
+    # binarised frames is then matched by whichever worker is free. This
+    # (coordinating) process hands out the work and feeds the shifts to the
+    # tracker in sample order, so the result is the same as the serial one.
+    # Only slot indices and sample positions go through the queues.
+    #
+    # A binarised slot is freed once both pairs that use it are done, so the
+    # rings also bound how far decoding runs ahead of the analysis. On
+    # return, the sampler is left at the last sample used, as by the serial
+    # function
+    # --------------------------------------------------------------------------
+    if not vid_sampler.is_sampling_generated:
+        raise Exception("Finding the vertical shift rate needs a sampling schedule, but none has been generated")
+    _check_shift_threads(num_shift_threads, prune_shifts)
+
+    if num_workers is None:
+        num_workers = os.cpu_count()
+    if num_slots is None:
+        num_slots = NUM_SLOTS_PER_WORKER * num_workers
+    if num_slots < 2:
+        raise Exception("Pairs of frames need at least 2 shared frame slots, got {}".format(num_slots))
+
+    first_sample_index = 0 if vid_sampler.curr_sample_index is None else vid_sampler.curr_sample_index + 1
+    frame_indices = [vid_sampler._calc_frame_by_sample_index(sample_index)
+                     for sample_index in range(first_sample_index, vid_sampler.num_samples)]
+
+    # ----------------------------------------------------------------------
+    # Shared rings, queues and processes
+    # ----------------------------------------------------------------------
+    crop_height = len(range(vid_sampler.frame_height)[top_bound: bottom_bound])
+    crop_width = len(range(vid_sampler.frame_width)[left_bound: right_bound])
+
+    consumer_name = make_consumer_name(vid_sampler) + ".shared_frame_ring"
+    frame_ring = SharedFrameRing(num_slots, vid_sampler.frame_height, vid_sampler.frame_width)
+    bin_ring = SharedFrameRing(num_slots, crop_height, crop_width, num_channels=1)
+    num_ring_bytes = frame_ring.num_bytes + bin_ring.num_bytes
+    if vid_sampler.memory_budget is not None:
+        try:
+            vid_sampler.memory_budget.reserve_or_raise(num_ring_bytes, consumer_name)
+        except Exception:
+            frame_ring.close()
+            bin_ring.close()
+            raise
+
+    free_slot_queue = multiprocessing.Queue()
+    for slot in range(num_slots):
+        free_slot_queue.put(slot)
+    work_queue = multiprocessing.Queue()
+    event_queue = multiprocessing.Queue()
+    stop_event = multiprocessing.Event()
+
+    decoder_process = multiprocessing.Process(target=run_frame_decoder,
+                                              args=(frame_ring.get_spec(), vid_sampler.video_source, frame_indices,
+                                                    free_slot_queue, event_queue, stop_event),
+                                              kwargs={"scale_factor": vid_sampler.scale_factor,
+                                                      "use_timestamp_index": vid_sampler.frame_timestamps is not None})
+    worker_processes = [multiprocessing.Process(target=_run_shift_worker,
+                                                args=(frame_ring.get_spec(), bin_ring.get_spec(),
+                                                      work_queue, event_queue, stop_event,
+                                                      top_bound, bottom_bound, left_bound, right_bound,
+                                                      bin_thresh,
+                                                      num_shift_threads, prune_shifts, use_row_hash))
+                        for _ in range(num_workers)]
+    all_processes = [decoder_process] + worker_processes
+
+    # ----------------------------------------------------------------------
+    # Coordination, until every process is done
+    # ----------------------------------------------------------------------
+    shift_tracker = ShiftRateTracker(num_shift_count_threshold)
+
+    free_bin_slots = list(range(num_slots))
+    pending_binarisations = collections.deque()     # (position, frame_slot) waiting for a binarised slot
+    position_bin_slots = {}                         # Binarised slot of every binarised frame in use
+    position_num_pairs_left = {}                    # Number of pairs yet to use every binarised frame
+    pending_shifts = {}                             # Shifts that arrived ahead of an earlier pair's
+    next_pair_index = 0
+    num_frames = None
+
+    num_work_items_in_flight = [0]
+    is_decoder_done = False
+    are_workers_stopped = False
+
+    num_processes_done = 0
+    error_message = None
+
+    def dispatch_binarisations():
+        # Binarised slots are handed out in frame order, so that the oldest
+        # pair can always be completed
+        while pending_binarisations and free_bin_slots:
+            position, frame_slot = pending_binarisations.popleft()
+            work_queue.put(("binarise", position, frame_slot, free_bin_slots.pop()))
+            num_work_items_in_flight[0] += 1
+        return
+
+    def release_position(position):
+        position_num_pairs_left[position] -= 1
+        if position_num_pairs_left[position] == 0:
+            del position_num_pairs_left[position]
+            free_bin_slots.append(position_bin_slots.pop(position))
+            dispatch_binarisations()
+        return
+
+    def issue_pair(pair_index):
+        work_queue.put(("pair", pair_index, position_bin_slots[pair_index], position_bin_slots[pair_index + 1]))
+        num_work_items_in_flight[0] += 1
+        return
+
+    try:
+        for process in all_processes:
+            process.start()
+
+        while num_processes_done < len(all_processes):
+            try:
+                event = event_queue.get(timeout=PROCESS_POLL_INTERVAL)
+            except queue.Empty:
+                if any(process.exitcode not in (None, 0) for process in all_processes):
+                    raise Exception("A frame decoder or shift worker process exited unexpectedly")
+                continue
+
+            if event[0] == "frame":
+                _, position, _, frame_slot = event
+                pending_binarisations.append((position, frame_slot))
+                dispatch_binarisations()
+
+            elif event[0] == "binarised":
+                _, position, frame_slot, bin_slot = event
+                num_work_items_in_flight[0] -= 1
+
+                # The decoded frame is no longer needed
+                free_slot_queue.put(frame_slot)
+
+                # Used by the pairs before and after it (the first frame has
+                # none before it, and the last none after it)
+                position_bin_slots[position] = bin_slot
+                position_num_pairs_left[position] = (int(position > 0) +
+                                                     int((num_frames is None) or (position < num_frames - 1)))
+                if (position - 1) in position_bin_slots:
+                    issue_pair(position - 1)
+                if (position + 1) in position_bin_slots:
+                    issue_pair(position)
+                if position_num_pairs_left[position] == 0:
+                    position_num_pairs_left[position] = 1
+                    release_position(position)
+
+            elif event[0] == "end":
+                # The last frame has no pair after it
+                num_frames = event[1]
+                if (num_frames - 1) in position_num_pairs_left:
+                    release_position(num_frames - 1)
+
+            elif event[0] == "shift":
+                _, pair_index, curr_shift = event
+                num_work_items_in_flight[0] -= 1
+                release_position(pair_index)
+                release_position(pair_index + 1)
+
+                pending_shifts[pair_index] = curr_shift
+                while (next_pair_index in pending_shifts) and (not stop_event.is_set()):
+                    # If the running best shift has occured <threshold> times,
+                    # It is definitely the constant rate of shift! Hence, stop
+                    if shift_tracker.update(pending_shifts.pop(next_pair_index)):
+                        stop_event.set()
+                    next_pair_index += 1
+
+            elif event[0] == "error":
+                if error_message is None:
+                    error_message = event[1]
+                stop_event.set()
+
+            elif event[0] == "done":
+                num_processes_done += 1
+                if event[1] == "decoder":
+                    is_decoder_done = True
+
+            # ------------------------------------------------------------------
+            # Once the decoder is done and no work is left (or the analysis has
+            # stopped, in which case workers skip what is left), the workers
+            # are told to stop
+            # ------------------------------------------------------------------
+            if (is_decoder_done and (not are_workers_stopped) and
+                    (stop_event.is_set() or ((num_work_items_in_flight[0] == 0) and (not pending_binarisations)))):
+                for _ in worker_processes:
+                    work_queue.put(None)
+                are_workers_stopped = True
+
+    finally:
+        stop_event.set()
+        for process in all_processes:
+            if process.is_alive() and (num_processes_done < len(all_processes)):
+                process.terminate()
+            if process.pid is not None:
+                process.join()
+
+        frame_ring.close()
+        bin_ring.close()
+        if vid_sampler.memory_budget is not None:
+            vid_sampler.memory_budget.release(num_ring_bytes, consumer_name)
+
+    if error_message is not None:
+        raise Exception("Parallel shift rate analysis failed:\n{}".format(error_message))
+
+    # The last sample used is the second frame of the last pair fed to the
+    # tracker (or the first frame, if there was no pair)
+    if frame_indices:
+        last_position = min(next_pair_index, len(frame_indices) - 1)
+        vid_sampler.curr_sample_index = first_sample_index + last_position
+        vid_sampler.curr_frame_index = int(frame_indices[last_position])
+        vid_sampler.curr_time_instant = vid_sampler._calc_time_by_frame_index(vid_sampler.curr_frame_index)
+
+    return shift_tracker.get_best_shift()
@@ -0,0 +1,161 @@
+import os
+import math
+
+import numpy as np
+
+from ..dataIO.videoIO import VideoReader
+from ..dataIO.inMemoryVideo import is_in_memory_video
+from .frameProcessingUtils import convert_frame_to_grayscale
+
+DEFAULT_NUM_ROI_FRAMES = 8
+DEFAULT_ROI_SCALE_FACTOR = 4
+DEFAULT_ACTIVITY_THRESH_RATIO = 0.25
+DEFAULT_EDGE_THRESH_RATIO = 0.25
+
+# The row profiles are smoothed over (1 / ROW_SMOOTHING_DIVISOR) of the height
+ROW_SMOOTHING_DIVISOR = 64
+
+# Detected ROIs, keyed by the video file identity and the detection parameters
+_roi_cache = {}
+
+
+def _find_longest_true_run(mask):
+
+    # Returns [start, end) of the longest run of True values in a 1-D mask
+    padded_mask = np.concatenate(([False], mask, [False])).astype("int8")
+    run_edges = np.flatnonzero(np.diff(padded_mask))
+    run_starts, run_ends = run_edges[0::2], run_edges[1::2]
+
+    if len(run_starts) == 0:
+        return None, None
+
+    longest_run = np.argmax(run_ends - run_starts)
+
+    return int(run_starts[longest_run]), int(run_ends[longest_run])
+
+
+def calc_falling_notes_roi(gray_frames,
+                           activity_thresh_ratio=DEFAULT_ACTIVITY_THRESH_RATIO,
+                           edge_thresh_ratio=DEFAULT_EDGE_THRESH_RATIO):
+
+    # --------------------------------------------------------------------------
+    # gray_frames: (num_frames, rows, cols) stack of frames, spread over time
+    #
+    # Falling notes keep moving, so their pixels have a high temporal variance.
+    # The keyboard also changes (lit keys), but a key lights up uniformly along
+    # its length: unlike the note heads and tails, it has no horizontal edges
+    # that move from frame to frame. Logos and backgrounds have neither.
+    # --------------------------------------------------------------------------
+    gray_frames = np.asarray(gray_frames, dtype="float32")
+    if (gray_frames.ndim != 3) or (gray_frames.shape[0] < 2):
+        raise Exception("ROI detection needs a stack of at least 2 grayscale frames, got shape {}".format(gray_frames.shape))
+
+    temporal_std = gray_frames.std(axis=0)
+    row_activity = temporal_std.mean(axis=1)
+
+    # Temporal variation of the vertical gradient, i.e. of horizontal edges.
+    # (The last row has no gradient of its own, so it reuses the one above)
+    moving_edges = np.diff(gray_frames, axis=1).std(axis=0).mean(axis=1)
+    row_moving_edges = np.append(moving_edges, moving_edges[-1])
+
+    # Only a few frames are sampled, so a single row may by chance see no note
+    # edge at all. Smooth along the rows to get a profile of the regions
+    num_rows = gray_frames.shape[1]
+    smoothing_window = np.ones(max(1, num_rows // ROW_SMOOTHING_DIVISOR))
+    smoothing_window /= smoothing_window.size
+    row_moving_edges = np.convolve(row_moving_edges, smoothing_window, mode="same")
+
+    if row_activity.max() == 0:
+        raise Exception("ROI detection failed: the sampled frames do not change at all")
+
+    is_active_row = row_activity >= activity_thresh_ratio * row_activity.max()
+    typical_moving_edges = np.median(row_moving_edges[is_active_row])
+    is_note_row = is_active_row & (row_moving_edges >= edge_thresh_ratio * typical_moving_edges)
+
+    top_row, bottom_row = _find_longest_true_run(is_note_row)
+    if top_row is None:
+        raise Exception("ROI detection failed: no rows with falling notes found")
+
+    # Smoothing bleeds the note region into its neighbours by half a window;
+    # take that back (except at the frame borders, where nothing can bleed)
+    bleed_rows = smoothing_window.size // 2
+    if top_row > 0:
+        top_row += bleed_rows
+    if bottom_row < num_rows:
+        bottom_row -= bleed_rows
+    if bottom_row <= top_row:
+        raise Exception("ROI detection failed: the region of falling notes is too thin")
+
+    # Within the note rows, keep the span of columns that see any activity
+    col_activity = temporal_std[top_row: bottom_row].mean(axis=0)
+    active_cols = np.flatnonzero(col_activity >= activity_thresh_ratio * col_activity.max())
+    left_col = int(active_cols[0])
+    right_col = int(active_cols[-1]) + 1
+
+    return top_row, bottom_row, left_col, right_col
+
+
+def detect_falling_notes_roi(video_filename,
+                             num_frames=DEFAULT_NUM_ROI_FRAMES,
+                             scale_factor=DEFAULT_ROI_SCALE_FACTOR,
+                             activity_thresh_ratio=DEFAULT_ACTIVITY_THRESH_RATIO,
+                             edge_thresh_ratio=DEFAULT_EDGE_THRESH_RATIO,
+                             use_cache=True):
+
+    # --------------------------------------------------------------------------
+    # Returns (top_row, bottom_row, left_col, right_col) of the scrolling notes
+    # in full resolution pixels, ready to be passed on as crop_frame() bounds
+    # --------------------------------------------------------------------------
+    # In-memory videos have no file identity to cache the ROI by
+    if is_in_memory_video(video_filename):
+        use_cache = False
+
+    if use_cache:
+        file_stat = os.stat(video_filename)
+        cache_key = (os.path.abspath(video_filename), file_stat.st_size, file_stat.st_mtime,
+                     num_frames, scale_factor, activity_thresh_ratio, edge_thresh_ratio)
+        if cache_key in _roi_cache:
+            return _roi_cache[cache_key]
+
+    # The ROI only needs to be roughly placed, so decode at a reduced size.
+    # Skip the first and last 10% of the video, where title cards usually are
+    vid_reader = VideoReader(video_filename, scale_factor=scale_factor)
+    try:
+        frame_indices = np.linspace(0.1 * (vid_reader.vid_num_frames - 1),
+                                    0.9 * (vid_reader.vid_num_frames - 1),
+                                    num_frames).astype("int")
+
+        gray_frames = []
+        for frame_index in frame_indices:
+            success, frame = vid_reader.get_frame_by_index(int(frame_index))
+            if success:
+                gray_frames.append(convert_frame_to_grayscale(frame))
+
+        scaled_roi = calc_falling_notes_roi(gray_frames,
+                                            activity_thresh_ratio=activity_thresh_ratio,
+                                            edge_thresh_ratio=edge_thresh_ratio)
+
+        full_frame_height = vid_reader.vid_metadata["source_size"][1]
+        full_frame_width = vid_reader.vid_metadata["source_size"][0]
+        row_scale_ratio = float(full_frame_height) / vid_reader.frame_height
+        col_scale_ratio = float(full_frame_width) / vid_reader.frame_width
+    finally:
+        vid_reader.close_reader()
+
+    # Scale back up to full resolution, rounding the ROI inwards so that no
+    # pixel from outside the detected region slips in
+    top_row, bottom_row, left_col, right_col = scaled_roi
+    roi = (min(int(math.ceil(top_row * row_scale_ratio)), full_frame_height - 1),
+           min(int(math.floor(bottom_row * row_scale_ratio)), full_frame_height),
+           min(int(math.ceil(left_col * col_scale_ratio)), full_frame_width - 1),
+           min(int(math.floor(right_col * col_scale_ratio)), full_frame_width))
+
+    if use_cache:
+        _roi_cache[cache_key] = roi
+
+    return roi
+
+
+def clear_roi_cache():
+    _roi_cache.clear()
+    return
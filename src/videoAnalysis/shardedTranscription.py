@@ -0,0 +1,106 @@
+import os
+import multiprocessing
+
+import numpy as np
+
+from ..dataIO.videoIO import VideoSampler
+from .noteActivityUtils import (extract_key_activity,
+                                DEFAULT_NUM_KEYS)
+from .noteDetectionUtils import (detect_note_events_in_chunks,
+                                 DEFAULT_ON_THRESH,
+                                 DEFAULT_OFF_THRESH,
+                                 DEFAULT_MIN_DURATION_FRAMES)
+from .verticalShiftRateUtils import DEFAULT_BINARY_THRESH
+
+
+def split_into_shards(start_frame, end_frame, num_shards):
+
+    # --------------------------------------------------------------------------
+    # Splits frames [start_frame, end_frame) into <num_shards> contiguous,
+    # non-empty [shard_start, shard_end) ranges of (nearly) equal length
+    # --------------------------------------------------------------------------
+    if (num_shards < 1) or (num_shards > (end_frame - start_frame)):
+        raise Exception("Frames [{}, {}) cannot be split into {} shards".format(start_frame, end_frame, num_shards))
+
+    shard_edges = np.linspace(start_frame, end_frame, num_shards + 1).astype("int64")
+
+    return [(int(shard_start), int(shard_end)) for shard_start, shard_end in zip(shard_edges[:-1], shard_edges[1:])]
+
+
+def _extract_shard_activity(job):
+
+    # --------------------------------------------------------------------------
+    # Runs in a worker process, with its own VideoSampler. Reduces every frame
+    # of the shard to its key activity, exactly as extract_key_activity() does
+    # for a whole video (frames are reduced right away, so ring buffer views
+    # suffice)
+    # --------------------------------------------------------------------------
+    video_filename, shard, band_bounds, bin_thresh, num_keys = job
+    shard_start, shard_end = shard
+    top_bound, bottom_bound, left_bound, right_bound = band_bounds
+
+    vid_sampler = VideoSampler(video_filename, use_ring_buffer=True, ring_buffer_size=2)
+    try:
+        vid_sampler.gen_sampling_schedule_using_frame_array(np.arange(shard_start, shard_end))
+        _, activity_matrix = extract_key_activity(vid_sampler,
+                                                  top_bound, bottom_bound,
+                                                  left_bound, right_bound,
+                                                  bin_thresh,
+                                                  num_keys=num_keys)
+    finally:
+        vid_sampler.close_sampler()
+
+    return activity_matrix
+
+
+def transcribe_video_sharded(video_filename,
+                             top_bound, bottom_bound,
+                             left_bound, right_bound,
+                             bin_thresh=DEFAULT_BINARY_THRESH,
+                             on_thresh=DEFAULT_ON_THRESH,
+                             off_thresh=DEFAULT_OFF_THRESH,
+                             min_duration_frames=DEFAULT_MIN_DURATION_FRAMES,
+                             num_keys=DEFAULT_NUM_KEYS,
+                             start_frame=0,
+                             end_frame=None,
+                             num_shards=None,
+                             num_workers=None):
+
+    # --------------------------------------------------------------------------
+    # Splits frames [start_frame, end_frame) of the video into shards by time,
+    # and extracts the key activity of every shard (the decoding, i.e. nearly
+    # all of the work) in its own worker process. The shards are then stitched
+    # by a single NoteEventDetector, fed with them in order: its carry-over
+    # state joins notes crossing shard boundaries, so they are neither split
+    # nor duplicated, and the notes are exactly those of detect_note_events()
+    # on the activity matrix of the whole range. The bounds are those of the
+    # band in which notes are detected.
+    #
+    # Returns (keys, onset_frames, offset_frames, velocities), ordered like
+    # detect_note_events(), with frame indices of the video
+    # --------------------------------------------------------------------------
+    if num_workers is None:
+        num_workers = os.cpu_count()
+    if num_shards is None:
+        num_shards = num_workers
+
+    if end_frame is None:
+        vid_sampler = VideoSampler(video_filename)
+        end_frame = vid_sampler.vid_num_frames
+        vid_sampler.close_sampler()
+
+    # Never more shards than frames
+    shards = split_into_shards(start_frame, end_frame, max(1, min(num_shards, end_frame - start_frame)))
+
+    band_bounds = (top_bound, bottom_bound, left_bound, right_bound)
+    jobs = [(video_filename, shard, band_bounds, bin_thresh, num_keys) for shard in shards]
+
+    # Shards come back in order, and each is detected on as soon as it does
+    with multiprocessing.Pool(processes=min(num_workers, len(shards))) as pool:
+        note_keys, onset_frames, offset_frames, velocities = detect_note_events_in_chunks(pool.imap(_extract_shard_activity, jobs),
+                                                                                          num_keys=num_keys,
+                                                                                          on_thresh=on_thresh,
+                                                                                          off_thresh=off_thresh,
+                                                                                          min_duration_frames=min_duration_frames)
+
+    return note_keys, onset_frames + start_frame, offset_frames + start_frame, velocities
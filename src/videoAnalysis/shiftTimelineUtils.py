@@ -0,0 +1,213 @@
+import math
+
+from .verticalShiftRateUtils import (_get_bin_cropped_frame,
+                                     calc_shift,
+                                     DEFAULT_BINARY_THRESH)
+
+DEFAULT_SAMPLES_PER_SECOND = 2
+DEFAULT_PROBE_INTERVAL_SECONDS = 5.0
+DEFAULT_SHIFT_TOLERANCE = 1
+DEFAULT_NUM_CONFIRM_PROBES = 2
+
+
+def _get_mode_shift(shift_count_dict):
+
+    # Most frequent shift; ties go to the smaller shift
+    return max(sorted(shift_count_dict), key=lambda shift: shift_count_dict[shift])
+
+
+class ShiftChangeDetector:
+
+    def __init__(self,
+                 shift_tolerance=DEFAULT_SHIFT_TOLERANCE,
+                 num_confirm_probes=DEFAULT_NUM_CONFIRM_PROBES):
+
+        # ----------------------------------------------------------------------
+        # Streaming change-point test on the shifts of probe pairs, fed in
+        # frame order. The shift of the current segment is the most frequent
+        # shift seen in it. A probe within <shift_tolerance> pixels of it
+        # belongs to the segment; a change is only confirmed once
+        # <num_confirm_probes> consecutive probes agree with each other but not
+        # with the segment. Shorter runs of disagreeing probes (e.g. pairs with
+        # too few notes to match) are dropped as outliers
+        # ----------------------------------------------------------------------
+        self.shift_tolerance = shift_tolerance
+        self.num_confirm_probes = num_confirm_probes
+
+        self.segment_shift_counts = {}
+        self.last_segment_frame = None     # Frame of the last probe in the segment
+        self.candidate_probes = []         # [(frame_index, shift)] that disagree with the segment
+
+        return
+
+    def get_segment_shift(self):
+        if not self.segment_shift_counts:
+            return None
+        return _get_mode_shift(self.segment_shift_counts)
+
+    def update(self, frame_index, curr_shift):
+
+        # ----------------------------------------------------------------------
+        # Returns None, or (last_segment_frame, first_new_frame, old_shift,
+        # new_shift) when a change is confirmed: the change happened after
+        # the first of these frames, and at or before the second. The new
+        # segment then starts with the confirming probes
+        # ----------------------------------------------------------------------
+        segment_shift = self.get_segment_shift()
+
+        if (segment_shift is None) or (abs(curr_shift - segment_shift) <= self.shift_tolerance):
+            self.segment_shift_counts[curr_shift] = self.segment_shift_counts.get(curr_shift, 0) + 1
+            self.last_segment_frame = frame_index
+            self.candidate_probes = []
+            return None
+
+        if self.candidate_probes and (abs(curr_shift - self.candidate_probes[0][1]) > self.shift_tolerance):
+            self.candidate_probes = []
+        self.candidate_probes.append((frame_index, curr_shift))
+
+        if len(self.candidate_probes) < self.num_confirm_probes:
+            return None
+
+        new_shift_counts = {}
+        for _, candidate_shift in self.candidate_probes:
+            new_shift_counts[candidate_shift] = new_shift_counts.get(candidate_shift, 0) + 1
+
+        change = (self.last_segment_frame, self.candidate_probes[0][0],
+                  segment_shift, _get_mode_shift(new_shift_counts))
+
+        self.segment_shift_counts = new_shift_counts
+        self.last_segment_frame = self.candidate_probes[-1][0]
+        self.candidate_probes = []
+
+        return change
+
+
+def _refine_change_frame(calc_pair_shift,
+                         last_old_frame, first_new_frame,
+                         old_shift, new_shift,
+                         frame_resolution):
+
+    # --------------------------------------------------------------------------
+    # Bisection between the two probes around a change: every extra pair is
+    # placed halfway, and whichever of the two shifts it is closer to tells on
+    # which side the change lies. Returns the first frame of the new segment,
+    # to within <frame_resolution> frames
+    # --------------------------------------------------------------------------
+    while (first_new_frame - last_old_frame) > frame_resolution:
+        mid_frame = (last_old_frame + first_new_frame) // 2
+        mid_shift = calc_pair_shift(mid_frame)
+
+        if abs(mid_shift - new_shift) < abs(mid_shift - old_shift):
+            first_new_frame = mid_frame
+        else:
+            last_old_frame = mid_frame
+
+    return first_new_frame
+
+
+def build_shift_timeline(calc_pair_shift,
+                         start_frame, end_frame,
+                         probe_step,
+                         frame_resolution,
+                         shift_tolerance=DEFAULT_SHIFT_TOLERANCE,
+                         num_confirm_probes=DEFAULT_NUM_CONFIRM_PROBES):
+
+    # --------------------------------------------------------------------------
+    # calc_pair_shift(frame_index): the shift of the pair of samples that
+    # starts at <frame_index>, for probe pairs starting in [start_frame,
+    # end_frame)
+    #
+    # Probes every <probe_step> frames, and only probes densely (by bisection)
+    # around the changes the ShiftChangeDetector confirms. Returns the
+    # piecewise-constant timeline, as a list of {"start_frame", "end_frame",
+    # "shift"} segments covering [start_frame, end_frame)
+    # --------------------------------------------------------------------------
+    change_detector = ShiftChangeDetector(shift_tolerance, num_confirm_probes)
+
+    timeline = []
+    segment_start_frame = start_frame
+
+    for probe_frame in range(start_frame, end_frame, probe_step):
+        change = change_detector.update(probe_frame, calc_pair_shift(probe_frame))
+        if change is None:
+            continue
+
+        last_old_frame, first_new_frame, old_shift, new_shift = change
+        change_frame = _refine_change_frame(calc_pair_shift,
+                                            last_old_frame, first_new_frame,
+                                            old_shift, new_shift,
+                                            frame_resolution)
+
+        timeline.append({"start_frame": segment_start_frame, "end_frame": change_frame, "shift": old_shift})
+        segment_start_frame = change_frame
+
+    timeline.append({"start_frame": segment_start_frame, "end_frame": end_frame,
+                     "shift": change_detector.get_segment_shift()})
+
+    return timeline
+
+
+def find_shift_timeline(vid_reader,
+                        top_bound, bottom_bound,
+                        left_bound, right_bound,
+                        bin_thresh=DEFAULT_BINARY_THRESH,
+                        samples_per_second=DEFAULT_SAMPLES_PER_SECOND,
+                        probe_interval_seconds=DEFAULT_PROBE_INTERVAL_SECONDS,
+                        shift_tolerance=DEFAULT_SHIFT_TOLERANCE,
+                        num_confirm_probes=DEFAULT_NUM_CONFIRM_PROBES,
+                        start_frame=0,
+                        end_frame=None,
+                        return_num_decoded_frames=False):
+
+    # --------------------------------------------------------------------------
+    # For videos whose scroll speed changes (e.g. tempo changes), instead of
+    # the single shift of find_vertical_shift_rate(). Shifts are measured
+    # between pairs of frames <samples_per_second> apart, i.e. in the same
+    # units as find_vertical_shift_rate() with the same sampling rate, but
+    # only one such pair is decoded every <probe_interval_seconds>, plus a few
+    # around every change. Change frames are placed to within one pair step.
+    #
+    # Returns the timeline of build_shift_timeline(), over frames
+    # [start_frame, end_frame)
+    # --------------------------------------------------------------------------
+    if end_frame is None:
+        end_frame = vid_reader.vid_num_frames
+    if samples_per_second > vid_reader.vid_fps:
+        raise Exception("Samples per second ({}) should be less than the video FPS ({})".format(samples_per_second, vid_reader.vid_fps))
+
+    pair_step = math.floor(float(vid_reader.vid_fps) / samples_per_second)
+    probe_step = max(pair_step, int(round(probe_interval_seconds * vid_reader.vid_fps)))
+    if end_frame - pair_step <= start_frame:
+        raise Exception("Frames [{}, {}) are too few for pairs {} frames apart".format(start_frame, end_frame, pair_step))
+
+    num_decoded_frames = [0]
+
+    def get_bin_cropped_frame(frame_index):
+        success, frame = vid_reader.get_frame_by_index(int(frame_index))
+        if not success:
+            raise Exception("Could not read frame {} of {}".format(frame_index, vid_reader.video_filename))
+        num_decoded_frames[0] += 1
+        return _get_bin_cropped_frame(frame,
+                                      top_bound=top_bound, bottom_bound=bottom_bound,
+                                      left_bound=left_bound, right_bound=right_bound,
+                                      bin_thresh=bin_thresh)
+
+    def calc_pair_shift(frame_index):
+        bin_cropped_frame_prev = get_bin_cropped_frame(frame_index)
+        bin_cropped_frame_curr = get_bin_cropped_frame(frame_index + pair_step)
+        return calc_shift(bin_cropped_frame_prev, bin_cropped_frame_curr, prune_shifts=True)
+
+    timeline = build_shift_timeline(calc_pair_shift,
+                                    start_frame, end_frame - pair_step,
+                                    probe_step=probe_step,
+                                    frame_resolution=pair_step,
+                                    shift_tolerance=shift_tolerance,
+                                    num_confirm_probes=num_confirm_probes)
+
+    # The pairs that start before end_frame - pair_step cover the rest
+    timeline[-1]["end_frame"] = end_frame
+
+    if return_num_decoded_frames:
+        return timeline, num_decoded_frames[0]
+
+    return timeline
@@ -1,13 +1,38 @@
+import os
+import sys
+import json
+import math
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 
+from ..dataIO.resultCache import calc_video_fingerprint
+from ..dataIO.memoryBudget import make_consumer_name
+
 from .frameProcessingUtils import (crop_frame,
                                    convert_frame_to_grayscale,
-                                   binarise_frame)
+                                   binarise_frame,
+                                   calc_frame_signature)
+from .roiDetectionUtils import detect_falling_notes_roi
 
 DEFAULT_BINARY_THRESH = 90
 DEFAULT_NUM_SHIFT_COUNT_THRESHOLD = 10
+DEFAULT_CHECKPOINT_INTERVAL = 10
+DEFAULT_NUM_REFINE_PAIRS = 3
+
+# Row-hash matching: a row transition seen more often than this in a frame is
+# too common to tell shifts apart, and is not voted with
+MAX_ROW_TRANSITION_REPEATS = 4
+DEFAULT_MIN_ROW_MATCH_RATIO = 0.95
+
+# Working memory of a pair of frames, per pixel of the cropped region: the two
+# binarised crops (1 byte each), and the float grayscale (8 bytes), uint8
+# grayscale and intersection map (1 byte each) of the frame being processed
+PAIR_BUFFER_BYTES_PER_PIXEL = 12
+
+# Name of this analysis in a ResultCache
+RESULT_CACHE_ANALYSIS_NAME = "vertical_shift_rate"
 
 
 def _get_bin_cropped_frame(full_frame,
@@ -29,13 +54,172 @@ def _get_bin_cropped_frame(full_frame,
     return bin_frame
 
 
-def calc_shift(prev_frame, curr_frame):
+def _reserve_pair_buffers(vid_sampler,
+                          top_bound, bottom_bound,
+                          left_bound, right_bound):
+
+    # --------------------------------------------------------------------------
+    # With a memory budget, the working memory of the pair of frames being
+    # matched is reserved up front, so an analysis that cannot fit fails before
+    # decoding anything. Returns what _release_pair_buffers() needs
+    # --------------------------------------------------------------------------
+    if vid_sampler.memory_budget is None:
+        return None
+
+    num_rows = len(range(vid_sampler.frame_height)[top_bound: bottom_bound])
+    num_cols = len(range(vid_sampler.frame_width)[left_bound: right_bound])
+    num_bytes = num_rows * num_cols * PAIR_BUFFER_BYTES_PER_PIXEL
+    consumer_name = make_consumer_name(vid_sampler) + ".shift_pair_buffers"
+
+    vid_sampler.memory_budget.reserve_or_raise(num_bytes, consumer_name)
+
+    return num_bytes, consumer_name
+
+
+def _release_pair_buffers(vid_sampler, pair_buffer_reservation):
+    if pair_buffer_reservation is not None:
+        vid_sampler.memory_budget.release(*pair_buffer_reservation)
+    return
+
+
+def _split_column_bands(frame_width, num_bands):
+
+    # Contiguous column bands [band_start, band_end) of (almost) equal width,
+    # which cover the frame exactly; never more bands than columns
+    band_edges = np.linspace(0, frame_width, min(num_bands, frame_width) + 1).round().astype("int64")
+
+    return [(int(band_start), int(band_end)) for band_start, band_end in zip(band_edges[:-1], band_edges[1:])]
+
+
+def _calc_intersect_counts(prev_frame, curr_frame, start_index, end_index):
+
+    # Intersection counts of the full frames, for every shift in the range
+    intersect_counts = np.empty(end_index - start_index, dtype="int64")
+    for i in range(start_index, end_index):
+        intersect_counts[i - start_index] = np.count_nonzero(np.logical_and(prev_frame[:-i, :],
+                                                                            curr_frame[i:, :]))
+    return intersect_counts
+
+
+def _calc_band_intersect_counts(prev_frame, curr_frame,
+                                band_start, band_end,
+                                start_index, end_index):
+
+    # The band is copied out first, so that every shifted row of it is one
+    # contiguous run of memory
+    return _calc_intersect_counts(np.ascontiguousarray(prev_frame[:, band_start: band_end]),
+                                  np.ascontiguousarray(curr_frame[:, band_start: band_end]),
+                                  start_index, end_index)
+
+
+def _calc_parallel_intersect_counts(prev_frame, curr_frame,
+                                    start_index, end_index,
+                                    num_threads,
+                                    thread_pool=None):
+
+    # --------------------------------------------------------------------------
+    # The frames are split into <num_threads> vertical column bands, and every
+    # band is counted, for all the shifts, on its own thread (one task per
+    # band, so every task is a large piece of work). A pixel lies in exactly
+    # one band, so the counts of the bands add up to those of the full frames.
+    # numpy releases the GIL inside logical_and / count_nonzero, so the
+    # threads mostly run numpy code rather than wait on each other.
+    #
+    # <thread_pool>, if given, is used (and left open) for the bands;
+    # otherwise a pool is created for this call only
+    # --------------------------------------------------------------------------
+    column_bands = _split_column_bands(prev_frame.shape[1], num_threads)
+
+    if thread_pool is None:
+        with ThreadPoolExecutor(max_workers=num_threads) as call_thread_pool:
+            return _calc_parallel_intersect_counts(prev_frame, curr_frame,
+                                                   start_index, end_index,
+                                                   num_threads,
+                                                   thread_pool=call_thread_pool)
+
+    band_futures = [thread_pool.submit(_calc_band_intersect_counts,
+                                       prev_frame, curr_frame,
+                                       band_start, band_end,
+                                       start_index, end_index)
+                    for band_start, band_end in column_bands]
+
+    return np.sum([band_future.result() for band_future in band_futures], axis=0)
+
+
+def _calc_shift_by_branch_and_bound(prev_frame, curr_frame,
+                                    start_index, end_index,
+                                    cumul_count_prev, cumul_count_curr):
+
+    # --------------------------------------------------------------------------
+    # At shift i, the intersection is at most m = min(cumul_count_prev[i],
+    # cumul_count_curr[i]) pixels, and the union at least M = max(...), so the
+    # IoU is at most m / (M + 1). Shifts are visited in descending order of
+    # that bound, and the search stops as soon as the bound of the next shift
+    # is below the best IoU found: no shift left can beat it. The bound of a
+    # shift equals its IoU (bit for bit) when the intersection is m, and is
+    # larger otherwise, so no better shift is ever skipped.
+    #
+    # Shifts whose bound equals the best IoU are still visited, and ties go to
+    # the smaller shift, as in the exhaustive search
+    # --------------------------------------------------------------------------
+    shifts = np.arange(start_index, end_index)
+    min_counts = np.minimum(cumul_count_prev[shifts], cumul_count_curr[shifts])
+    max_counts = np.maximum(cumul_count_prev[shifts], cumul_count_curr[shifts])
+    iou_bounds = min_counts / (max_counts + 1)
+
+    best_match_val = None
+    best_match_pos = None
+
+    for k in np.lexsort((shifts, -iou_bounds)):
+        if (best_match_val is not None) and (iou_bounds[k] < best_match_val):
+            break
+
+        i = int(shifts[k])
+        intersect_count = np.count_nonzero(np.logical_and(prev_frame[:-i, :],
+                                                          curr_frame[i:, :]))
+        union_count = cumul_count_prev[i] + cumul_count_curr[i] - intersect_count
+        ratio_match_pixels = float(intersect_count) / (union_count + 1)
+
+        if ((best_match_val is None) or (ratio_match_pixels > best_match_val) or
+                ((ratio_match_pixels == best_match_val) and (i < best_match_pos))):
+            best_match_val = ratio_match_pixels
+            best_match_pos = i
+
+    return best_match_pos
+
+
+def _calc_shift_search_range(frame_height, min_shift, max_shift):
 
     # Decide the shift limits
-    frame_height = prev_frame.shape[0]
     start_index = 1                     # Minimum shift = 1
     end_index = frame_height            # Maximum shift = Full height of frame
 
+    # Optionally, only search a sub-range of the shifts
+    if min_shift is not None:
+        start_index = max(start_index, min_shift)
+    if max_shift is not None:
+        end_index = min(end_index, max_shift + 1)
+    if start_index >= end_index:
+        raise Exception("Shift range [{}, {}] is empty for a frame of height {}".format(min_shift, max_shift, frame_height))
+
+    return start_index, end_index
+
+
+def _check_shift_threads(num_threads, prune_shifts):
+    if prune_shifts and (num_threads > 1):
+        raise Exception("Shift pruning visits shifts one at a time, and cannot be combined with {} threads".format(num_threads))
+    return
+
+
+def calc_shift(prev_frame, curr_frame,
+               min_shift=None, max_shift=None,
+               num_threads=1,
+               prune_shifts=False,
+               thread_pool=None):
+
+    _check_shift_threads(num_threads, prune_shifts)
+    start_index, end_index = _calc_shift_search_range(prev_frame.shape[0], min_shift, max_shift)
+
     first_match_val = None
     best_match_val = None
     best_match_pos = None
@@ -46,15 +230,37 @@ def calc_shift(prev_frame, curr_frame):
     # --> cumul_count_curr[i] = np.count_nonzero(curr_frame[i: end, :])
     cumul_count_curr = np.cumsum(np.count_nonzero(curr_frame, axis=1)[::-1])[::-1]
 
+    # Exact search that skips the shifts which cannot be the best (see above)
+    if prune_shifts:
+        return _calc_shift_by_branch_and_bound(prev_frame, curr_frame,
+                                               start_index, end_index,
+                                               cumul_count_prev, cumul_count_curr)
+
+    # With more than one thread, the intersection counts of all the shifts are
+    # computed up front, a column band per thread (see above); the IoU and
+    # the choice of the best shift below are then exactly those of the serial
+    # loop. Pass a <thread_pool> (of at least <num_threads> threads) to reuse
+    # it across calls
+    parallel_intersect_counts = None
+    if num_threads > 1:
+        parallel_intersect_counts = _calc_parallel_intersect_counts(prev_frame, curr_frame,
+                                                                    start_index, end_index,
+                                                                    num_threads,
+                                                                    thread_pool=thread_pool)
+
     # Looping over each valid shift value ...
     for i in range(start_index, end_index):
 
-        # Find the intersection of the shifted prev frame with the curr frame
-        intersect_map = np.logical_and(prev_frame[:-i, :],
-                                       curr_frame[i:, :])
+        # Find the intersection of the shifted prev frame with the curr frame,
+        # and the intersection count
+        if parallel_intersect_counts is None:
+            intersect_map = np.logical_and(prev_frame[:-i, :],
+                                           curr_frame[i:, :])
+            intersect_count = np.count_nonzero(intersect_map)
+        else:
+            intersect_count = parallel_intersect_counts[i - start_index]
 
-        # Find the intersection and the union count
-        intersect_count = np.count_nonzero(intersect_map)
+        # Find the union count
         union_count = cumul_count_prev[i] + cumul_count_curr[i] - intersect_count
 
         # Compute Intersection-over-Union (with care to prevent divide-by-0)
@@ -76,77 +282,623 @@ def calc_shift(prev_frame, curr_frame):
     return best_shift
 
 
-def find_vertical_shift_rate(vid_sampler,
-                             top_bound, bottom_bound,
-                             left_bound, right_bound,
-                             bin_thresh=DEFAULT_BINARY_THRESH,
-                             num_shift_count_threshold=DEFAULT_NUM_SHIFT_COUNT_THRESHOLD):
+def _calc_row_ids(prev_frame, curr_frame):
 
+    # --------------------------------------------------------------------------
+    # Every row of both frames is packed into bytes, and every distinct packed
+    # row gets an integer id, so that comparing rows is comparing ids. (Ids
+    # come from np.unique, which is exact: there are no collisions to check)
+    # --------------------------------------------------------------------------
+    packed_rows = np.packbits(np.concatenate((prev_frame, curr_frame)), axis=1)
+    row_dtype = np.dtype((np.void, packed_rows.shape[1]))
+    unique_rows, row_ids = np.unique(np.ascontiguousarray(packed_rows).view(row_dtype).ravel(), return_inverse=True)
 
-    # Get the first frame from the sampling and crop, binarise it
-    full_frame_prev = next(vid_sampler)
-    bin_cropped_frame_prev = _get_bin_cropped_frame(full_frame_prev,
-                                                    top_bound=top_bound, bottom_bound=bottom_bound,
-                                                    left_bound=left_bound, right_bound=right_bound,
-                                                    bin_thresh=bin_thresh)
+    # Id of the blank row (or -1, if there is none)
+    blank_rows = np.flatnonzero(~packed_rows.any(axis=1))
+    blank_row_id = row_ids[blank_rows[0]] if len(blank_rows) else -1
 
-    shift_count_dict = {}           # Dict to hold  how many times a shift value was found
-    absolute_best_shift = None      # The best shift (determined)
-    running_best_shift = None       # The best shift as of <this iteration>
-    count_running_best_shift = 0    # Number of times running_best_shift has been found
-    is_best_shift_found = False     # Flag to say whether the best shift was "surely" found
+    frame_height = prev_frame.shape[0]
 
+    return row_ids[:frame_height], row_ids[frame_height:], len(unique_rows), blank_row_id
 
-    for full_frame_curr in vid_sampler:
 
-        # Get the next frame from the sampling and crop, binarise it
-        bin_cropped_frame_curr = _get_bin_cropped_frame(full_frame_curr,
-                                                        top_bound=top_bound, bottom_bound=bottom_bound,
-                                                        left_bound=left_bound, right_bound=right_bound,
-                                                        bin_thresh=bin_thresh)
+def _find_row_transitions(row_ids, num_row_ids):
+
+    # Positions where a row differs from the one above it, keyed by the pair
+    # of (above, below) row ids. Keys that repeat too often are dropped
+    positions = np.flatnonzero(row_ids[1:] != row_ids[:-1]) + 1
+    keys = row_ids[positions - 1].astype("int64") * num_row_ids + row_ids[positions]
+
+    unique_keys, key_inverse, key_counts = np.unique(keys, return_inverse=True, return_counts=True)
+    is_distinctive = key_counts[key_inverse] <= MAX_ROW_TRANSITION_REPEATS
+
+    return positions[is_distinctive], keys[is_distinctive]
+
+
+def calc_shift_by_row_hash(prev_frame, curr_frame,
+                           min_shift=None, max_shift=None,
+                           num_threads=1,
+                           prune_shifts=False,
+                           min_match_ratio=DEFAULT_MIN_ROW_MATCH_RATIO,
+                           thread_pool=None):
+
+    # --------------------------------------------------------------------------
+    # When the notes scroll by a whole number of pixels and the frames are
+    # clean, every row of curr_frame is an exact copy of the row <shift> rows
+    # above it in prev_frame. Then, matching rows (by their ids) is enough:
+    # every row transition that appears in both frames votes for the offset
+    # between its positions, in time linear in the number of rows, instead of
+    # an IoU for every shift.
+    #
+    # The winning offset is accepted only if at least <min_match_ratio> of
+    # the overlapping (non-blank) rows then match exactly. Otherwise (noise,
+    # sub-pixel scrolling, too few transitions), it falls back to calc_shift()
+    # --------------------------------------------------------------------------
+    start_index, end_index = _calc_shift_search_range(prev_frame.shape[0], min_shift, max_shift)
+
+    prev_row_ids, curr_row_ids, num_row_ids, blank_row_id = _calc_row_ids(prev_frame, curr_frame)
+    prev_positions, prev_keys = _find_row_transitions(prev_row_ids, num_row_ids)
+    curr_positions, curr_keys = _find_row_transitions(curr_row_ids, num_row_ids)
+
+    # ----------------------------------------------------------------------
+    # Every (prev, curr) pair of equal transitions votes for curr - prev.
+    # Keys repeat at most MAX_ROW_TRANSITION_REPEATS times, which bounds the
+    # number of pairs
+    # ----------------------------------------------------------------------
+    curr_order = np.argsort(curr_keys, kind="stable")
+    sorted_curr_keys = curr_keys[curr_order]
+    match_starts = np.searchsorted(sorted_curr_keys, prev_keys, side="left")
+    match_ends = np.searchsorted(sorted_curr_keys, prev_keys, side="right")
+    num_matches = match_ends - match_starts
+
+    voter_prev_positions = np.repeat(prev_positions, num_matches)
+    match_offsets = np.arange(num_matches.sum()) - np.repeat(np.cumsum(num_matches) - num_matches, num_matches)
+    voter_curr_positions = curr_positions[curr_order[np.repeat(match_starts, num_matches) + match_offsets]]
 
-        # Calculate the best shift for this pair of frames
-        curr_shift = calc_shift(bin_cropped_frame_prev, bin_cropped_frame_curr)
+    voted_shifts = voter_curr_positions - voter_prev_positions
+    voted_shifts = voted_shifts[(voted_shifts >= start_index) & (voted_shifts < end_index)]
+
+    if len(voted_shifts) > 0:
+        # (argmax: ties go to the smaller shift)
+        best_shift = start_index + int(np.argmax(np.bincount(voted_shifts - start_index)))
+
+        is_matched_row = prev_row_ids[:-best_shift] == curr_row_ids[best_shift:]
+        is_blank_pair = (prev_row_ids[:-best_shift] == blank_row_id) & (curr_row_ids[best_shift:] == blank_row_id)
+        if np.any(~is_blank_pair) and (np.mean(is_matched_row[~is_blank_pair]) >= min_match_ratio):
+            return best_shift
+
+    return calc_shift(prev_frame, curr_frame,
+                      min_shift=min_shift, max_shift=max_shift,
+                      num_threads=num_threads,
+                      prune_shifts=prune_shifts,
+                      thread_pool=thread_pool)
+
+
+class ShiftRateTracker:
+
+    def __init__(self,
+                 num_shift_count_threshold=DEFAULT_NUM_SHIFT_COUNT_THRESHOLD):
+
+        self.num_shift_count_threshold = num_shift_count_threshold
+
+        self.shift_count_dict = {}           # Dict to hold  how many times a shift value was found
+        self.running_best_shift = None       # The best shift as of <this iteration>
+        self.count_running_best_shift = 0    # Number of times running_best_shift has been found
+        self.is_best_shift_found = False     # Flag to say whether the best shift was "surely" found
+
+        self.skipped_spans = []              # [start_frame, end_frame] spans of skipped static samples
+
+        return
+
+    def update(self, curr_shift):
 
         # Update the count for this value of shift
-        if curr_shift not in shift_count_dict:
-            shift_count_dict[curr_shift] = 0
-        shift_count_dict[curr_shift] += 1
+        if curr_shift not in self.shift_count_dict:
+            self.shift_count_dict[curr_shift] = 0
+        self.shift_count_dict[curr_shift] += 1
 
         # Update the running_best_shift and associated values
-        if curr_shift == running_best_shift:
-            count_running_best_shift += 1
+        if curr_shift == self.running_best_shift:
+            self.count_running_best_shift += 1
         else:
-            if shift_count_dict[curr_shift] > count_running_best_shift:
-                running_best_shift = curr_shift
-                count_running_best_shift = shift_count_dict[curr_shift]
+            if self.shift_count_dict[curr_shift] > self.count_running_best_shift:
+                self.running_best_shift = curr_shift
+                self.count_running_best_shift = self.shift_count_dict[curr_shift]
 
         # If running_best_shift has occured <threshold> times,
         # It is definitely the constant rate of shift!
-        # Hence, break after setting the flag
-        if count_running_best_shift >= num_shift_count_threshold:
-            absolute_best_shift = running_best_shift
-            is_best_shift_found = True
-            break
+        if self.count_running_best_shift >= self.num_shift_count_threshold:
+            self.is_best_shift_found = True
 
-        # Replace prev frame with current frame, to continue onto next iteration
-        bin_cropped_frame_prev = bin_cropped_frame_curr
+        return self.is_best_shift_found
 
+    def add_skipped_pair(self, prev_frame_index, curr_frame_index):
 
-    # If flag is set, that means the best shift rate was definitely found
-    if is_best_shift_found:
-        best_shift = absolute_best_shift
+        # Extend the last span if this pair continues it, else start a new one
+        if self.skipped_spans and (self.skipped_spans[-1][1] == prev_frame_index):
+            self.skipped_spans[-1][1] = curr_frame_index
+        else:
+            self.skipped_spans.append([prev_frame_index, curr_frame_index])
 
-    # Else, the loop ran through all samples, but was unable to definitely
-    # determine the best shift rate. In this case, display a warning and
-    # return the best candidate.
-    else:
-        warnings.warn("Unable to determine the undisputed best shift rate.\n"
-                      "The closest contender for best shift rate:\n"
-                      "Shift: {}, occurred {} times".format(running_best_shift,
-                                                            count_running_best_shift))
+        return
+
+    def get_best_shift(self):
+
+        # If flag is set, that means the best shift rate was definitely found
+        # Else, all the samples were seen, but it was unable to definitely
+        # determine the best shift rate. In this case, display a warning and
+        # return the best candidate.
+        if not self.is_best_shift_found:
+            warnings.warn("Unable to determine the undisputed best shift rate.\n"
+                          "The closest contender for best shift rate:\n"
+                          "Shift: {}, occurred {} times".format(self.running_best_shift,
+                                                                self.count_running_best_shift))
+
+        return self.running_best_shift
+
+    def get_state(self):
+
+        # JSON object keys have to be strings, hence the shift counts are
+        # stored as a list of [shift, count] pairs instead
+        tracker_state = {"shift_counts": [[shift, count] for shift, count in self.shift_count_dict.items()],
+                         "running_best_shift": self.running_best_shift,
+                         "count_running_best_shift": self.count_running_best_shift,
+                         "is_best_shift_found": self.is_best_shift_found,
+                         "skipped_spans": self.skipped_spans}
+
+        return tracker_state
+
+    def set_state(self, tracker_state):
+
+        self.shift_count_dict = {shift: count for shift, count in tracker_state["shift_counts"]}
+        self.running_best_shift = tracker_state["running_best_shift"]
+        self.count_running_best_shift = tracker_state["count_running_best_shift"]
+        self.is_best_shift_found = tracker_state["is_best_shift_found"]
+        self.skipped_spans = [list(span) for span in tracker_state["skipped_spans"]]
+
+        return
+
+
+def _get_cached_warning(warning_entry):
+
+    # --------------------------------------------------------------------------
+    # (category, message) of a warning stored in a ResultCache, as
+    # {"category_module", "category", "message"}. The category is looked up
+    # among the modules already loaded (nothing is imported); if it cannot be
+    # found, or for entries stored as plain messages, it is a UserWarning
+    # --------------------------------------------------------------------------
+    if isinstance(warning_entry, str):
+        return UserWarning, warning_entry
+
+    category_module = sys.modules.get(warning_entry["category_module"])
+    category = getattr(category_module, warning_entry["category"], None)
+    if not (isinstance(category, type) and issubclass(category, Warning)):
+        category = UserWarning
+
+    return category, warning_entry["message"]
+
+
+def _write_checkpoint(checkpoint_filename, checkpoint):
+
+    # Write to a temporary file first and then swap it in, so that a job dying
+    # mid-write never leaves a corrupt checkpoint behind
+    tmp_checkpoint_filename = checkpoint_filename + ".tmp"
+    with open(tmp_checkpoint_filename, "w") as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(tmp_checkpoint_filename, checkpoint_filename)
+
+    return
+
+
+def _calc_sampler_roi(vid_sampler):
 
-        best_shift = running_best_shift
+    # --------------------------------------------------------------------------
+    # The detected ROI is in source video pixels, while bounds are applied to
+    # the frames the sampler decodes; for a scaled sampler, it is scaled down
+    # to those, rounding inwards (as detect_falling_notes_roi() does)
+    # --------------------------------------------------------------------------
+    top_row, bottom_row, left_col, right_col = detect_falling_notes_roi(vid_sampler.video_source)
+
+    source_width, source_height = vid_sampler.vid_metadata["source_size"]
+    row_scale_ratio = float(source_height) / vid_sampler.frame_height
+    col_scale_ratio = float(source_width) / vid_sampler.frame_width
+
+    sampler_roi = (min(int(math.ceil(top_row / row_scale_ratio)), vid_sampler.frame_height - 1),
+                   min(int(math.floor(bottom_row / row_scale_ratio)), vid_sampler.frame_height),
+                   min(int(math.ceil(left_col / col_scale_ratio)), vid_sampler.frame_width - 1),
+                   min(int(math.floor(right_col / col_scale_ratio)), vid_sampler.frame_width))
+
+    return sampler_roi
+
+
+def _make_checkpoint_params(vid_sampler,
+                            top_bound, bottom_bound,
+                            left_bound, right_bound,
+                            bin_thresh,
+                            num_shift_count_threshold,
+                            skip_static_frames,
+                            use_row_hash):
+
+    # --------------------------------------------------------------------------
+    # Everything a checkpoint has to agree with before it is resumed: the video
+    # content, the parameters, the decoded frames and the sampling schedule.
+    # (A reduced-scale analysis checkpoints its coarse pass, which runs on a
+    # sampler decoding at 1/<resolution_scale>, hence its scale factor.) A
+    # sampler without a schedule takes that of the checkpoint
+    # --------------------------------------------------------------------------
+    sample_schedule = None
+    if vid_sampler.is_sampling_generated:
+        sampling_state = vid_sampler.get_sampling_state()
+        sample_schedule = {"start_frame": sampling_state["start_frame"],
+                           "end_frame": sampling_state["end_frame"],
+                           "sample_step": sampling_state["sample_step"],
+                           "num_samples": sampling_state["num_samples"],
+                           "sample_frame_indices": sampling_state["sample_frame_indices"]}
+
+    analysis_params = {"video_fingerprint": calc_video_fingerprint(vid_sampler.video_source),
+                       "top_bound": top_bound, "bottom_bound": bottom_bound,
+                       "left_bound": left_bound, "right_bound": right_bound,
+                       "bin_thresh": bin_thresh,
+                       "num_shift_count_threshold": num_shift_count_threshold,
+                       "skip_static_frames": skip_static_frames,
+                       "use_row_hash": use_row_hash,
+                       "scale_factor": vid_sampler.scale_factor,
+                       "use_timestamp_index": vid_sampler.frame_timestamps is not None,
+                       "sample_schedule": sample_schedule}
+
+    return analysis_params
+
+
+def _read_checkpoint(checkpoint_filename, analysis_params):
+
+    with open(checkpoint_filename, "r") as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+
+    if analysis_params["sample_schedule"] is None:
+        analysis_params = dict(analysis_params, sample_schedule=checkpoint["analysis_params"].get("sample_schedule"))
+
+    mismatched_params = sorted(param_name for param_name in set(analysis_params) | set(checkpoint["analysis_params"])
+                               if checkpoint["analysis_params"].get(param_name) != analysis_params.get(param_name))
+    if mismatched_params:
+        raise Exception("Checkpoint {} was written with different analysis parameters: {}".format(checkpoint_filename,
+                                                                                                 ", ".join(mismatched_params)))
+
+    return checkpoint
+
+
+def find_vertical_shift_rate(vid_sampler,
+                             top_bound, bottom_bound,
+                             left_bound, right_bound,
+                             bin_thresh=DEFAULT_BINARY_THRESH,
+                             num_shift_count_threshold=DEFAULT_NUM_SHIFT_COUNT_THRESHOLD,
+                             checkpoint_filename=None,
+                             checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+                             resume=False,
+                             resolution_scale=1,
+                             num_refine_pairs=DEFAULT_NUM_REFINE_PAIRS,
+                             skip_static_frames=False,
+                             return_skipped_spans=False,
+                             auto_roi=False,
+                             result_cache=None,
+                             num_shift_threads=1,
+                             prune_shifts=False,
+                             use_row_hash=False):
+
+    # Before anything is decoded
+    _check_shift_threads(num_shift_threads, prune_shifts)
+
+    # --------------------------------------------------------------------------
+    # With a ResultCache, a previous run on the same video content, with the
+    # same parameters, sampling schedule and decoded frames (the sampler's
+    # scale factor and frame numbering), is returned right away (and the
+    # sampler is not read at all). Otherwise the analysis runs as usual and
+    # its result is stored, along with any warnings, which are re-issued on
+    # every cache hit
+    # --------------------------------------------------------------------------
+    if result_cache is not None:
+        sampling_state = vid_sampler.get_sampling_state()
+        cache_params = {"top_bound": top_bound, "bottom_bound": bottom_bound,
+                        "left_bound": left_bound, "right_bound": right_bound,
+                        "auto_roi": auto_roi,
+                        "bin_thresh": bin_thresh,
+                        "num_shift_count_threshold": num_shift_count_threshold,
+                        "resolution_scale": resolution_scale,
+                        "num_refine_pairs": num_refine_pairs,
+                        "skip_static_frames": skip_static_frames,
+                        "use_row_hash": use_row_hash,
+                        "scale_factor": vid_sampler.scale_factor,
+                        "use_timestamp_index": vid_sampler.frame_timestamps is not None,
+                        "start_frame": sampling_state["start_frame"],
+                        "end_frame": sampling_state["end_frame"],
+                        "sample_step": sampling_state["sample_step"],
+                        "sample_frame_indices": sampling_state["sample_frame_indices"]}
+        fingerprint = calc_video_fingerprint(vid_sampler.video_source)
+
+        is_cached, cached_result = result_cache.get_result(fingerprint, RESULT_CACHE_ANALYSIS_NAME, cache_params)
+        if not is_cached:
+            with warnings.catch_warnings(record=True) as warn_list:
+                warnings.simplefilter("always")
+                best_shift, skipped_spans = find_vertical_shift_rate(vid_sampler,
+                                                                     top_bound, bottom_bound,
+                                                                     left_bound, right_bound,
+                                                                     bin_thresh=bin_thresh,
+                                                                     num_shift_count_threshold=num_shift_count_threshold,
+                                                                     checkpoint_filename=checkpoint_filename,
+                                                                     checkpoint_interval=checkpoint_interval,
+                                                                     resume=resume,
+                                                                     resolution_scale=resolution_scale,
+                                                                     num_refine_pairs=num_refine_pairs,
+                                                                     skip_static_frames=skip_static_frames,
+                                                                     return_skipped_spans=True,
+                                                                     auto_roi=auto_roi,
+                                                                     num_shift_threads=num_shift_threads,
+                                                                     prune_shifts=prune_shifts,
+                                                                     use_row_hash=use_row_hash)
+            cached_result = {"best_shift": best_shift,
+                             "skipped_spans": [list(span) for span in skipped_spans],
+                             "warnings": [{"category_module": w.category.__module__,
+                                           "category": w.category.__qualname__,
+                                           "message": str(w.message)} for w in warn_list]}
+            result_cache.put_result(fingerprint, RESULT_CACHE_ANALYSIS_NAME, cache_params, cached_result)
+
+        for warning_entry in cached_result["warnings"]:
+            warning_category, warning_message = _get_cached_warning(warning_entry)
+            warnings.warn(warning_message, warning_category)
+
+        if return_skipped_spans:
+            return cached_result["best_shift"], [tuple(span) for span in cached_result["skipped_spans"]]
+        return cached_result["best_shift"]
+
+    # Replace the given bounds by the detected region of falling notes
+    if auto_roi:
+        top_bound, bottom_bound, left_bound, right_bound = _calc_sampler_roi(vid_sampler)
+
+    if resolution_scale != 1:
+        return _find_vertical_shift_rate_at_reduced_scale(vid_sampler,
+                                                          top_bound, bottom_bound,
+                                                          left_bound, right_bound,
+                                                          bin_thresh=bin_thresh,
+                                                          num_shift_count_threshold=num_shift_count_threshold,
+                                                          checkpoint_filename=checkpoint_filename,
+                                                          checkpoint_interval=checkpoint_interval,
+                                                          resume=resume,
+                                                          resolution_scale=resolution_scale,
+                                                          num_refine_pairs=num_refine_pairs,
+                                                          skip_static_frames=skip_static_frames,
+                                                          return_skipped_spans=return_skipped_spans,
+                                                          num_shift_threads=num_shift_threads,
+                                                          prune_shifts=prune_shifts,
+                                                          use_row_hash=use_row_hash)
+
+    analysis_params = None
+    if checkpoint_filename is not None:
+        analysis_params = _make_checkpoint_params(vid_sampler,
+                                                  top_bound, bottom_bound,
+                                                  left_bound, right_bound,
+                                                  bin_thresh,
+                                                  num_shift_count_threshold,
+                                                  skip_static_frames,
+                                                  use_row_hash)
+
+    shift_tracker = ShiftRateTracker(num_shift_count_threshold)
+
+    # Exact row matching first, falling back to the IoU search (see
+    # calc_shift_by_row_hash()), or the IoU search right away
+    shift_engine = calc_shift_by_row_hash if use_row_hash else calc_shift
+
+    pair_buffer_reservation = _reserve_pair_buffers(vid_sampler,
+                                                    top_bound, bottom_bound,
+                                                    left_bound, right_bound)
+
+    # One pool of shift threads for the whole analysis, shut down with it
+    shift_thread_pool = ThreadPoolExecutor(max_workers=num_shift_threads) if num_shift_threads > 1 else None
+    try:
+        # ----------------------------------------------------------------------
+        # When resuming, restore the sampler position and the shift counts, and
+        # re-read the sample at which the checkpoint was taken: it is the "prev"
+        # frame of the next pair. Otherwise, start from the first sample
+        # ----------------------------------------------------------------------
+        if resume and (checkpoint_filename is not None) and os.path.isfile(checkpoint_filename):
+            checkpoint = _read_checkpoint(checkpoint_filename, analysis_params)
+            analysis_params = checkpoint["analysis_params"]
+            vid_sampler.set_sampling_state(checkpoint["sampling_state"])
+            shift_tracker.set_state(checkpoint["tracker_state"])
+
+            _, full_frame_prev = vid_sampler.get_sample_by_index(vid_sampler.curr_sample_index)
+        else:
+            full_frame_prev = next(vid_sampler)
+
+        # Crop, binarise the first frame of the sampling
+        bin_cropped_frame_prev = _get_bin_cropped_frame(full_frame_prev,
+                                                        top_bound=top_bound, bottom_bound=bottom_bound,
+                                                        left_bound=left_bound, right_bound=right_bound,
+                                                        bin_thresh=bin_thresh)
+        signature_prev = calc_frame_signature(bin_cropped_frame_prev) if skip_static_frames else None
+        frame_index_prev = vid_sampler.curr_frame_index
+
+        num_pairs_since_checkpoint = 0
+
+        for full_frame_curr in vid_sampler:
+
+            # Get the next frame from the sampling and crop, binarise it
+            bin_cropped_frame_curr = _get_bin_cropped_frame(full_frame_curr,
+                                                            top_bound=top_bound, bottom_bound=bottom_bound,
+                                                            left_bound=left_bound, right_bound=right_bound,
+                                                            bin_thresh=bin_thresh)
+
+            # ------------------------------------------------------------------
+            # A pair of identical frames (static title cards, or duplicated frames
+            # in re-encoded videos) has no meaningful shift, and voting for one
+            # would only mislead the tracker. Hence, such pairs are skipped before
+            # matching, and recorded as skipped spans instead
+            # ------------------------------------------------------------------
+            frame_index_curr = vid_sampler.curr_frame_index
+            signature_curr = calc_frame_signature(bin_cropped_frame_curr) if skip_static_frames else None
+
+            if skip_static_frames and (signature_curr == signature_prev):
+                shift_tracker.add_skipped_pair(frame_index_prev, frame_index_curr)
+            else:
+                # Calculate the best shift for this pair of frames
+                curr_shift = shift_engine(bin_cropped_frame_prev, bin_cropped_frame_curr,
+                                          num_threads=num_shift_threads,
+                                          prune_shifts=prune_shifts,
+                                          thread_pool=shift_thread_pool)
+
+                # If the running best shift has occured <threshold> times,
+                # It is definitely the constant rate of shift! Hence, break
+                if shift_tracker.update(curr_shift):
+                    break
+
+            # Replace prev frame with current frame, to continue onto next iteration
+            bin_cropped_frame_prev = bin_cropped_frame_curr
+            signature_prev = signature_curr
+            frame_index_prev = frame_index_curr
+
+            # Periodically save the sampler position and the shift counts
+            num_pairs_since_checkpoint += 1
+            if (checkpoint_filename is not None) and (num_pairs_since_checkpoint >= checkpoint_interval):
+                _write_checkpoint(checkpoint_filename,
+                                  {"analysis_params": analysis_params,
+                                   "sampling_state": vid_sampler.get_sampling_state(),
+                                   "tracker_state": shift_tracker.get_state()})
+                num_pairs_since_checkpoint = 0
+
+
+        best_shift = shift_tracker.get_best_shift()
+    finally:
+        if shift_thread_pool is not None:
+            shift_thread_pool.shutdown()
+        _release_pair_buffers(vid_sampler, pair_buffer_reservation)
+
+    # The analysis is complete, so the checkpoint is of no further use
+    if (checkpoint_filename is not None) and os.path.isfile(checkpoint_filename):
+        os.remove(checkpoint_filename)
+
+    if return_skipped_spans:
+        return best_shift, [tuple(span) for span in shift_tracker.skipped_spans]
+
+    return best_shift
+
+
+def _scale_bound(bound, scale_ratio):
+    if bound is None:
+        return None
+    return int(round(bound / scale_ratio))
+
+
+def _find_vertical_shift_rate_at_reduced_scale(vid_sampler,
+                                               top_bound, bottom_bound,
+                                               left_bound, right_bound,
+                                               bin_thresh,
+                                               num_shift_count_threshold,
+                                               checkpoint_filename,
+                                               checkpoint_interval,
+                                               resume,
+                                               resolution_scale,
+                                               num_refine_pairs,
+                                               skip_static_frames,
+                                               return_skipped_spans,
+                                               num_shift_threads,
+                                               prune_shifts,
+                                               use_row_hash):
+
+    # --------------------------------------------------------------------------
+    # --1--: Run the regular analysis on a second sampler with the same
+    #        schedule, but decoding at 1/<resolution_scale> of the size
+    # --------------------------------------------------------------------------
+    scaled_sampler = vid_sampler.clone(scale_factor=resolution_scale)
+
+    # The exact size ratio, since ffmpeg rounds the downscaled frame size
+    row_scale_ratio = float(vid_sampler.frame_height) / scaled_sampler.frame_height
+    col_scale_ratio = float(vid_sampler.frame_width) / scaled_sampler.frame_width
+
+    try:
+        coarse_shift, skipped_spans = find_vertical_shift_rate(scaled_sampler,
+                                                               top_bound=_scale_bound(top_bound, row_scale_ratio),
+                                                               bottom_bound=_scale_bound(bottom_bound, row_scale_ratio),
+                                                               left_bound=_scale_bound(left_bound, col_scale_ratio),
+                                                               right_bound=_scale_bound(right_bound, col_scale_ratio),
+                                                               bin_thresh=bin_thresh,
+                                                               num_shift_count_threshold=num_shift_count_threshold,
+                                                               checkpoint_filename=checkpoint_filename,
+                                                               checkpoint_interval=checkpoint_interval,
+                                                               resume=resume,
+                                                               skip_static_frames=skip_static_frames,
+                                                               return_skipped_spans=True,
+                                                               num_shift_threads=num_shift_threads,
+                                                               prune_shifts=prune_shifts,
+                                                               use_row_hash=use_row_hash)
+        sampling_state = scaled_sampler.get_sampling_state()
+    finally:
+        scaled_sampler.close_sampler()
+
+    # No pair was matched (too few samples, or only static pairs), which the
+    # coarse analysis has already warned about
+    if coarse_shift is None:
+        if return_skipped_spans:
+            return None, skipped_spans
+        return None
+
+    # --------------------------------------------------------------------------
+    # --2--: Refine at full resolution. The exact shift is within one coarse
+    #        pixel of the scaled-up coarse shift, so only that small window is
+    #        searched, on the last few sample pairs the coarse analysis used
+    # --------------------------------------------------------------------------
+    search_radius = int(math.ceil(row_scale_ratio))
+    centre_shift = int(round(coarse_shift * row_scale_ratio))
+
+    last_sample_index = int(sampling_state["curr_sample_index"])
+    first_sample_index = max(0, last_sample_index - num_refine_pairs)
+
+    vid_sampler.set_sampling_state(sampling_state)
+
+    shift_engine = calc_shift_by_row_hash if use_row_hash else calc_shift
+
+    pair_buffer_reservation = _reserve_pair_buffers(vid_sampler,
+                                                    top_bound, bottom_bound,
+                                                    left_bound, right_bound)
+
+    # One pool of shift threads for the whole analysis, shut down with it
+    shift_thread_pool = ThreadPoolExecutor(max_workers=num_shift_threads) if num_shift_threads > 1 else None
+    try:
+        refined_shift_count_dict = {}
+        bin_cropped_frame_prev = None
+        signature_prev = None
+        for sample_index in range(first_sample_index, last_sample_index + 1):
+            _, full_frame_curr = vid_sampler.get_sample_by_index(sample_index)
+            bin_cropped_frame_curr = _get_bin_cropped_frame(full_frame_curr,
+                                                            top_bound=top_bound, bottom_bound=bottom_bound,
+                                                            left_bound=left_bound, right_bound=right_bound,
+                                                            bin_thresh=bin_thresh)
+
+            # Static pairs are skipped here too, as in the coarse analysis
+            signature_curr = calc_frame_signature(bin_cropped_frame_curr) if skip_static_frames else None
+            is_static_pair = skip_static_frames and (signature_curr == signature_prev)
+
+            if (bin_cropped_frame_prev is not None) and (not is_static_pair):
+                curr_shift = shift_engine(bin_cropped_frame_prev, bin_cropped_frame_curr,
+                                          min_shift=centre_shift - search_radius,
+                                          max_shift=centre_shift + search_radius,
+                                          num_threads=num_shift_threads,
+                                          prune_shifts=prune_shifts,
+                                          thread_pool=shift_thread_pool)
+                refined_shift_count_dict[curr_shift] = refined_shift_count_dict.get(curr_shift, 0) + 1
+
+            bin_cropped_frame_prev = bin_cropped_frame_curr
+            signature_prev = signature_curr
+    finally:
+        if shift_thread_pool is not None:
+            shift_thread_pool.shutdown()
+        _release_pair_buffers(vid_sampler, pair_buffer_reservation)
+
+    # Majority vote across the refined pairs (ties go to the smaller shift)
+    if refined_shift_count_dict:
+        best_shift = max(sorted(refined_shift_count_dict),
+                         key=lambda shift: refined_shift_count_dict[shift])
+    else:
+        best_shift = centre_shift
 
+    if return_skipped_spans:
+        return best_shift, skipped_spans
 
     return best_shift
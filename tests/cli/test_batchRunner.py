@@ -0,0 +1,98 @@
+import os
+import io
+import json
+
+from ...src.cli.batchRunner import (collect_video_filenames,
+                                    process_video,
+                                    run_batch)
+
+
+def _get_default_options():
+    return {"top_bound": 15,
+            "bottom_bound": 550,
+            "left_bound": None,
+            "right_bound": None,
+            "bin_thresh": 90,
+            "num_shift_count_threshold": 10,
+            "samples_per_second": 2,
+            "start_time": 10.0,
+            "end_time": 40.0}
+
+
+def test_collect_video_filenames(tmp_path):
+
+    # --------------------------------------------------------------------------
+    # Directory input: only files with video extensions are collected
+    for filename in ["b.mp4", "a.webm", "notes.txt"]:
+        (tmp_path / filename).write_bytes(b"")
+
+    video_filenames = collect_video_filenames(str(tmp_path))
+    assert video_filenames == [os.path.join(str(tmp_path), "a.webm"),
+                               os.path.join(str(tmp_path), "b.mp4")]
+
+    # Manifest input: comments and blank lines skipped, relative paths resolved
+    manifest_filename = tmp_path / "manifest.txt"
+    manifest_filename.write_text("# nightly batch\n\nb.mp4\n/abs/c.mkv\n")
+
+    video_filenames = collect_video_filenames(str(manifest_filename))
+    assert video_filenames == [os.path.join(str(tmp_path), "b.mp4"),
+                               "/abs/c.mkv"]
+    # --------------------------------------------------------------------------
+
+    return
+
+
+def test_process_video(root_data_dir):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+
+    # --------------------------------------------------------------------------
+    # Regular video
+    result = process_video((input_video_filename, _get_default_options()))
+    assert result["status"] == "ok"
+    assert result["vertical_shift_rate"] == 86
+    assert result["timing"]["total"] >= result["timing"]["analysis"]
+
+    # A memory budget is reserved from by the decoder and the shift analysis:
+    # too small for either, the video fails; large enough, its peak is reported
+    for memory_budget_mb in [1, 4]:
+        result = process_video((input_video_filename, dict(_get_default_options(),
+                                                           memory_budget_mb=memory_budget_mb)))
+        assert result["status"] == "error"
+        assert "memory budget" in result["error"]
+
+    result = process_video((input_video_filename, dict(_get_default_options(),
+                                                       memory_budget_mb=32)))
+    assert result["status"] == "ok"
+    assert result["vertical_shift_rate"] == 86
+    assert 0 < result["memory"]["peak_bytes"] <= 32 * 1024 * 1024
+    assert result["memory"]["traced_peak_bytes"] is None
+
+    # Missing video is isolated into an error result
+    result = process_video(("file_not_present.webm", _get_default_options()))
+    assert result["status"] == "error"
+    assert result["vertical_shift_rate"] is None
+    assert result["error"]
+    # --------------------------------------------------------------------------
+
+    return
+
+
+def test_run_batch(root_data_dir):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+
+    # --------------------------------------------------------------------------
+    output_file = io.StringIO()
+    num_failed = run_batch([input_video_filename, "file_not_present.webm"],
+                           _get_default_options(), output_file,
+                           num_workers=2)
+    assert num_failed == 1
+
+    results = [json.loads(line) for line in output_file.getvalue().splitlines()]
+    result_by_video = {result["video"]: result for result in results}
+    assert result_by_video[input_video_filename]["vertical_shift_rate"] == 86
+    assert result_by_video["file_not_present.webm"]["status"] == "error"
+    # --------------------------------------------------------------------------
+
+    return
@@ -0,0 +1,95 @@
+import os
+import asyncio
+
+import pytest
+import numpy as np
+
+from ...src.dataIO.videoIO import VideoSampler
+from ...src.dataIO.asyncVideoIO import AsyncVideoSampler
+
+
+def test_async_vid_sampler_iterator(root_data_dir):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+
+    # -------------------------------------------------------------------------
+    # Reference frames, read synchronously
+    vid_sampler = VideoSampler(input_video_filename)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=20, end_frame=120,
+                                                          samples_per_second=2)
+    expected_frames = list(vid_sampler)
+    vid_sampler.close_sampler()
+
+    # Same frames, in the same order, read asynchronously with read-ahead
+    async def read_all_frames(vid_sampler):
+        async with AsyncVideoSampler(vid_sampler, read_ahead=3) as async_sampler:
+            return [frame async for frame in async_sampler]
+
+    vid_sampler = VideoSampler(input_video_filename)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=20, end_frame=120,
+                                                          samples_per_second=2)
+    async_frames = asyncio.run(read_all_frames(vid_sampler))
+    assert vid_sampler.curr_sample_index == vid_sampler.num_samples - 1
+    vid_sampler.close_sampler()
+
+    assert len(async_frames) == len(expected_frames)
+    for async_frame, expected_frame in zip(async_frames, expected_frames):
+        assert np.all(async_frame == expected_frame)
+
+    # Illegal read ahead
+    with pytest.raises(Exception):
+        _ = AsyncVideoSampler(vid_sampler, read_ahead=0)
+    # -------------------------------------------------------------------------
+
+    return
+
+
+def test_async_vid_sampler_ring_buffer(root_data_dir):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+
+    # -------------------------------------------------------------------------
+    # Reference frames, read synchronously
+    vid_sampler = VideoSampler(input_video_filename)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=20, end_frame=120,
+                                                          samples_per_second=2)
+    expected_frames = list(vid_sampler)
+    vid_sampler.close_sampler()
+
+    # Every frame is held until the end, and compared after the read-ahead
+    # has gone far past it
+    async def hold_all_frames(vid_sampler, read_ahead):
+        async with AsyncVideoSampler(vid_sampler, read_ahead=read_ahead) as async_sampler:
+            held_frames = []
+            async for frame in async_sampler:
+                if held_frames:
+                    # The previous frame is still intact
+                    assert np.all(held_frames[-1] == expected_frames[len(held_frames) - 1])
+                held_frames.append(frame)
+            return held_frames, async_sampler._copy_frames
+
+    # A read-ahead that would overrun the ring buffer gets copies
+    vid_sampler = VideoSampler(input_video_filename, use_ring_buffer=True, ring_buffer_size=4)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=20, end_frame=120,
+                                                          samples_per_second=2)
+    held_frames, is_copying = asyncio.run(hold_all_frames(vid_sampler, read_ahead=4))
+    vid_sampler.close_sampler()
+
+    assert is_copying
+    assert len(held_frames) == len(expected_frames)
+    for held_frame, expected_frame in zip(held_frames, expected_frames):
+        assert np.all(held_frame == expected_frame)
+
+    # With enough margin, frames are views that stay valid for the previous
+    # frame to be held
+    vid_sampler = VideoSampler(input_video_filename, use_ring_buffer=True, ring_buffer_size=8)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=20, end_frame=120,
+                                                          samples_per_second=2)
+    held_frames, is_copying = asyncio.run(hold_all_frames(vid_sampler, read_ahead=4))
+    vid_sampler.close_sampler()
+
+    assert not is_copying
+    assert len(held_frames) == len(expected_frames)
+    # -------------------------------------------------------------------------
+
+    return
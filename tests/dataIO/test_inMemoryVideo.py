@@ -0,0 +1,138 @@
+import io
+import os
+import subprocess
+
+import pytest
+import numpy as np
+import imageio_ffmpeg
+
+from ...src.dataIO.videoIO import VideoReader, VideoSampler
+from ...src.dataIO.inMemoryVideo import (is_pipeable_video_data,
+                                         read_video_data,
+                                         _parse_video_header)
+
+
+def _remux_with_index_first(input_video_filename, output_video_filename):
+    subprocess.run([imageio_ffmpeg.get_ffmpeg_exe(), "-loglevel", "error", "-y",
+                    "-i", input_video_filename,
+                    "-c", "copy", "-movflags", "+faststart",
+                    output_video_filename],
+                   check=True)
+    return
+
+
+def test_in_memory_video_piped(root_data_dir, tmp_path):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+    faststart_video_filename = os.path.join(str(tmp_path), "faststart.mp4")
+    _remux_with_index_first(input_video_filename, faststart_video_filename)
+
+    with open(faststart_video_filename, "rb") as video_file:
+        video_bytes = video_file.read()
+
+    # Forward steps, a long forward jump and a backward jump
+    frame_indices = [0, 1, 5, 300, 60]
+
+    # -------------------------------------------------------------------------
+    file_reader = VideoReader(input_video_filename)
+    expected_frames = [file_reader.get_frame_by_index(frame_index)[1]
+                       for frame_index in frame_indices]
+
+    for video_input in [video_bytes, memoryview(video_bytes), io.BytesIO(video_bytes)]:
+        vid_reader = VideoReader(video_input)
+        assert vid_reader.video_data is not None
+        assert vid_reader.video_filename is None
+
+        assert vid_reader.frame_width == file_reader.frame_width
+        assert vid_reader.frame_height == file_reader.frame_height
+        assert vid_reader.vid_fps == file_reader.vid_fps
+        assert vid_reader.vid_num_frames == file_reader.vid_num_frames
+        assert abs(vid_reader.vid_duration_time - file_reader.vid_duration_time) < 0.1
+
+        for frame_index, expected_frame in zip(frame_indices, expected_frames):
+            s, frame = vid_reader.get_frame_by_index(frame_index)
+            assert s
+            assert np.all(frame == expected_frame)
+
+        vid_reader.close_reader()
+
+    file_reader.close_reader()
+    # -------------------------------------------------------------------------
+
+    # -------------------------------------------------------------------------
+    # Samplers work the same way
+    vid_sampler = VideoSampler(video_bytes, scale_factor=4)
+    assert vid_sampler.frame_width == 318
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=300, end_frame=330,
+                                                          samples_per_second=2)
+    frames = list(vid_sampler)
+    assert len(frames) == 3
+    assert frames[0].shape == (180, 318, 3)
+    vid_sampler.close_sampler()
+    # -------------------------------------------------------------------------
+
+    return
+
+
+def test_in_memory_video_temp_file_fallback(root_data_dir):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+
+    # -------------------------------------------------------------------------
+    # The test video has its index after the media data, so it cannot be piped
+    with open(input_video_filename, "rb") as video_file:
+        video_data = read_video_data(video_file)
+    assert not is_pipeable_video_data(video_data)
+    assert is_pipeable_video_data(memoryview(b"\x1aE\xdf\xa3 any other container"))
+
+    vid_reader = VideoReader(video_data)
+    assert vid_reader.video_data is None
+    temp_video_filename = vid_reader.video_filename
+    assert os.path.isfile(temp_video_filename)
+    assert vid_reader.vid_num_frames == 3952
+
+    s, _ = vid_reader.get_frame_by_index(300)
+    assert s
+
+    vid_reader.close_reader()
+    assert not os.path.exists(temp_video_filename)
+
+    # Illegal inputs
+    with pytest.raises(Exception):
+        _ = VideoReader(b"")
+    with pytest.raises(Exception):
+        _ = VideoReader(io.StringIO("not binary"))
+    # -------------------------------------------------------------------------
+
+    return
+
+
+def test_parse_video_header():
+
+    # -------------------------------------------------------------------------
+    # Only the first video stream of the input counts (not audio, not output)
+    header_text = ("Input #0, matroska,webm, from 'pipe:0':\n"
+                   "  Duration: 00:01:02.50, start: 0.000000, bitrate: N/A\n"
+                   "  Stream #0:0: Audio: opus, 48000 Hz, stereo, fltp (default)\n"
+                   "  Stream #0:1: Video: vp9 (Profile 0), yuv420p(tv, bt709), 1920x1080, SAR 1:1 DAR 16:9, 29.97 fps, 29.97 tbr, 1k tbn\n"
+                   "Output #0, framecrc, to 'pipe:':\n"
+                   "  Stream #0:0: Video: vp9, yuv420p, 640x360, q=2-31, 25 fps, 25 tbr, 1k tbn\n")
+    vid_metadata = _parse_video_header(header_text)
+    assert vid_metadata["source_size"] == (1920, 1080)
+    assert vid_metadata["fps"] == 29.97
+    assert vid_metadata["duration"] == 62.5
+
+    # No fps (the tbr is used instead), and no duration
+    header_text = ("  Duration: N/A, start: 0.000000, bitrate: N/A\n"
+                   "  Stream #0:0: Video: h264 (High), yuv420p(progressive), 1274x720 [SAR 1:1 DAR 637:360], 30 tbr, 1200k tbn\n")
+    vid_metadata = _parse_video_header(header_text)
+    assert vid_metadata["source_size"] == (1274, 720)
+    assert vid_metadata["fps"] == 30.0
+    assert vid_metadata["duration"] is None
+
+    # No video stream
+    with pytest.raises(Exception):
+        _ = _parse_video_header("  Stream #0:0: Audio: opus, 48000 Hz, stereo, fltp\n")
+    # -------------------------------------------------------------------------
+
+    return
@@ -0,0 +1,152 @@
+import os
+import gc
+import asyncio
+
+import pytest
+import numpy as np
+
+from ...src.dataIO.videoIO import VideoReader, VideoSampler
+from ...src.dataIO.asyncVideoIO import AsyncVideoSampler
+from ...src.dataIO.videoReaderPool import VideoReaderPool
+from ...src.dataIO.memoryBudget import MemoryBudget
+
+# Size of one frame of the test video
+FRAME_BYTES = 720 * 1274 * 3
+
+
+def test_memory_budget_accounting():
+
+    # -------------------------------------------------------------------------
+    memory_budget = MemoryBudget(1000)
+    assert memory_budget.reserve(600, "a")
+    assert not memory_budget.reserve(600, "b")
+    memory_budget.release(200, "a")
+    assert memory_budget.reserve(600, "b")
+    assert memory_budget.get_available_bytes() == 0
+
+    # Shrinkable consumers give back what they can, largest first
+    def shrink_b(num_bytes):
+        memory_budget.release(min(num_bytes, 100), "b")
+        return
+    memory_budget.register_shrinkable("b", shrink_b)
+    assert memory_budget.reserve(100, "c")
+    assert not memory_budget.reserve(1000, "c")
+
+    memory_report = memory_budget.get_report()
+    assert memory_report["used_bytes"] == 900
+    assert memory_report["peak_bytes"] == 1000
+    assert memory_report["consumer_peak_bytes"] == {"a": 600, "b": 600, "c": 100}
+
+    # Reservations tied to the lifetime of an array
+    memory_budget = MemoryBudget(1000)
+    memory_budget.reserve(800, "d")
+    array = np.zeros(800, dtype="uint8")
+    memory_budget.release_when_freed(array, 800, "d")
+    del array
+    gc.collect()
+    assert memory_budget.used_bytes == 0
+
+    # Traced peak includes every allocation
+    memory_budget.start_tracing()
+    array = np.zeros(10 ** 6, dtype="uint8")
+    assert memory_budget.get_report()["traced_peak_bytes"] >= 10 ** 6
+    memory_budget.stop_tracing()
+
+    # Illegal budget
+    with pytest.raises(Exception):
+        _ = MemoryBudget(0)
+    # -------------------------------------------------------------------------
+
+    return
+
+
+def test_memory_budget_video_structures(root_data_dir):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+
+    # -------------------------------------------------------------------------
+    # Ring buffers are all or nothing (slots plus the scratch slot)
+    memory_budget = MemoryBudget(4 * FRAME_BYTES)
+    with pytest.raises(Exception):
+        _ = VideoReader(input_video_filename, use_ring_buffer=True, ring_buffer_size=4,
+                        memory_budget=memory_budget)
+    vid_reader = VideoReader(input_video_filename, use_ring_buffer=True, ring_buffer_size=3,
+                             memory_budget=memory_budget)
+    assert memory_budget.used_bytes == 4 * FRAME_BYTES
+
+    # Bulk fetches that do not fit are refused
+    with pytest.raises(Exception):
+        _ = vid_reader.get_frames([0, 1])
+    vid_reader.close_reader()
+    assert memory_budget.used_bytes == 0
+
+    # The imageio decoder holds one frame for as long as it is open
+    vid_reader = VideoReader(input_video_filename, memory_budget=memory_budget)
+    assert memory_budget.used_bytes == FRAME_BYTES
+    frames = vid_reader.get_frames([0, 1, 2])
+    assert memory_budget.used_bytes == 4 * FRAME_BYTES
+    del frames
+    gc.collect()
+    assert memory_budget.used_bytes == FRAME_BYTES
+    vid_reader.close_reader()
+    assert memory_budget.used_bytes == 0
+
+    with pytest.raises(Exception):
+        _ = VideoReader(input_video_filename, memory_budget=MemoryBudget(FRAME_BYTES - 1))
+    # -------------------------------------------------------------------------
+
+    # -------------------------------------------------------------------------
+    # Read-ahead shrinks to what fits, and further when others need memory
+    # (the sampler's own decoder takes one frame)
+    memory_budget = MemoryBudget(7 * FRAME_BYTES)
+    memory_budget.reserve(3 * FRAME_BYTES, "other")
+
+    async def read_all_frames(vid_sampler):
+        async with AsyncVideoSampler(vid_sampler, read_ahead=5) as async_sampler:
+            assert async_sampler.read_ahead == 3
+            assert memory_budget.reserve(FRAME_BYTES, "other")
+            assert async_sampler.read_ahead == 2
+            return [frame async for frame in async_sampler]
+
+    vid_sampler = VideoSampler(input_video_filename, memory_budget=memory_budget)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=20, end_frame=80,
+                                                          samples_per_second=2)
+    async_frames = asyncio.run(read_all_frames(vid_sampler))
+    assert len(async_frames) == 5
+    assert memory_budget.used_bytes == 5 * FRAME_BYTES
+    vid_sampler.close_sampler()
+    assert memory_budget.used_bytes == 4 * FRAME_BYTES
+    # -------------------------------------------------------------------------
+
+    # -------------------------------------------------------------------------
+    # Reader pools open up front only as many handles as fit, and evict idle
+    # ones when others need memory
+    memory_budget = MemoryBudget(3 * FRAME_BYTES)
+    vid_reader_pool = VideoReaderPool(input_video_filename, num_readers=4,
+                                      memory_budget=memory_budget)
+    assert sum(1 for r in vid_reader_pool.video_readers if r is not None) == 3
+    assert memory_budget.used_bytes == 3 * FRAME_BYTES
+
+    # Far apart requests share the open handles, without going over budget
+    for frame_index in [300, 1300, 2300, 3300]:
+        s, _ = vid_reader_pool.get_frame_by_index(frame_index)
+        assert s
+    assert sum(1 for r in vid_reader_pool.video_readers if r is not None) == 3
+    assert memory_budget.used_bytes == 3 * FRAME_BYTES
+
+    assert memory_budget.reserve(FRAME_BYTES, "other")
+    assert sum(1 for r in vid_reader_pool.video_readers if r is not None) == 2
+
+    # Evicted handles are reopened once the budget has room again
+    memory_budget.release(FRAME_BYTES, "other")
+    for frame_index in [300, 3000]:
+        s, _ = vid_reader_pool.get_frame_by_index(frame_index)
+        assert s
+    assert sum(1 for r in vid_reader_pool.video_readers if r is not None) == 3
+
+    assert memory_budget.reserve(FRAME_BYTES, "other")
+    vid_reader_pool.close_pool()
+    assert memory_budget.used_bytes == FRAME_BYTES
+    # -------------------------------------------------------------------------
+
+    return
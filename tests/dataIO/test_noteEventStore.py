@@ -0,0 +1,209 @@
+import struct
+
+import numpy as np
+import pytest
+
+from ...src.dataIO.noteEventStore import (NoteEventStore,
+                                          _encode_vlq,
+                                          LOWEST_PIANO_PITCH)
+
+
+def _read_vlq(data, pos):
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, pos
+
+
+def _read_midi_file(midi_data):
+
+    # A minimal reader: returns (format, ticks_per_beat, tracks), each track
+    # being a list of (absolute_tick, event_bytes)
+    assert midi_data[:4] == b"MThd"
+    _, midi_format, num_tracks, ticks_per_beat = struct.unpack(">IHHH", midi_data[4:14])
+
+    tracks = []
+    pos = 14
+    for _ in range(num_tracks):
+        assert midi_data[pos: pos + 4] == b"MTrk"
+        track_length = struct.unpack(">I", midi_data[pos + 4: pos + 8])[0]
+        track_data = midi_data[pos + 8: pos + 8 + track_length]
+        pos += 8 + track_length
+
+        events = []
+        tick = 0
+        track_pos = 0
+        while track_pos < len(track_data):
+            delta_tick, track_pos = _read_vlq(track_data, track_pos)
+            tick += delta_tick
+            if track_data[track_pos] == 0xFF:
+                meta_length = track_data[track_pos + 2]
+                event_length = 3 + meta_length
+            else:
+                event_length = 3
+            events.append((tick, bytes(track_data[track_pos: track_pos + event_length])))
+            track_pos += event_length
+
+        tracks.append(events)
+
+    assert pos == len(midi_data)
+
+    return midi_format, ticks_per_beat, tracks
+
+
+def test_encode_vlq():
+
+    # --------------------------------------------------------------------------
+    # Examples from the Standard MIDI File specification
+    # --------------------------------------------------------------------------
+    values = [0, 0x40, 0x7F, 0x80, 0x2000, 0x3FFF, 0x4000, 0x100000, 0x1FFFFF, 0x200000, 0x8000000 - 1]
+    expected_encodings = [b"\x00", b"\x40", b"\x7F", b"\x81\x00", b"\xC0\x00", b"\xFF\x7F",
+                          b"\x81\x80\x00", b"\xC0\x80\x00", b"\xFF\xFF\x7F",
+                          b"\x81\x80\x80\x00", b"\xBF\xFF\xFF\x7F"]
+
+    vlq_bytes, vlq_lengths = _encode_vlq(values)
+    for value_bytes, value_length, expected_encoding in zip(vlq_bytes, vlq_lengths, expected_encodings):
+        assert value_bytes[:value_length].tobytes() == expected_encoding
+        assert np.all(value_bytes[value_length:] == 0)
+
+    with pytest.raises(Exception):
+        _encode_vlq([1 << 28])
+    # --------------------------------------------------------------------------
+
+    return
+
+
+def test_append_sort_merge():
+
+    # --------------------------------------------------------------------------
+    # Appending in chunks grows the store past its initial capacity
+    # --------------------------------------------------------------------------
+    rng = np.random.default_rng(3)
+    note_store = NoteEventStore(vid_fps=30.0, initial_capacity=4)
+
+    all_start_frames = []
+    for chunk_index in range(5):
+        start_frames = rng.integers(0, 1000, size=7)
+        note_store.append_key_notes(rng.integers(0, 88, size=7), start_frames, start_frames + 5,
+                                    rng.integers(1, 128, size=7), track=chunk_index % 2)
+        all_start_frames.append(start_frames)
+
+    assert len(note_store) == 35
+    assert np.array_equal(note_store.notes["start_frame"], np.concatenate(all_start_frames))
+    assert np.all(note_store.notes["pitch"] >= LOWEST_PIANO_PITCH)
+    assert np.allclose(note_store.notes["start_time"], note_store.notes["start_frame"] / 30.0)
+    assert np.allclose(note_store.notes["end_time"] - note_store.notes["start_time"], 5 / 30.0)
+    # --------------------------------------------------------------------------
+
+    # --------------------------------------------------------------------------
+    # Sorting, by start and then pitch
+    # --------------------------------------------------------------------------
+    note_store.sort()
+    notes = note_store.notes
+    sort_keys = notes["start_frame"] * 256 + notes["pitch"]
+    assert np.all(np.diff(sort_keys) >= 0)
+    # --------------------------------------------------------------------------
+
+    # --------------------------------------------------------------------------
+    # Merging
+    # --------------------------------------------------------------------------
+    other_store = NoteEventStore(vid_fps=30.0)
+    other_store.append_notes([60, 64], [3, 500], [10, 520], [100, 90], track=2)
+
+    merged_store = note_store.merge(other_store)
+    assert len(merged_store) == 37
+    assert np.all(np.diff(merged_store.notes["start_frame"]) >= 0)
+    assert np.sum(merged_store.notes["track"] == 2) == 2
+
+    with pytest.raises(Exception):
+        note_store.merge(NoteEventStore(vid_fps=25.0))
+
+    # Stores timed differently cannot be merged either
+    frame_timestamps = np.arange(1000) / 30.0
+    with pytest.raises(Exception):
+        note_store.merge(NoteEventStore(vid_fps=30.0, frame_timestamps=frame_timestamps))
+    with pytest.raises(Exception):
+        NoteEventStore(vid_fps=30.0, frame_timestamps=frame_timestamps).merge(
+            NoteEventStore(vid_fps=30.0, frame_timestamps=frame_timestamps + 0.01))
+    # --------------------------------------------------------------------------
+
+    # --------------------------------------------------------------------------
+    # Notes that start together (same pitch, even) come out in the same
+    # order, whichever order the shards are merged in
+    # --------------------------------------------------------------------------
+    shard_stores = []
+    for end_frames, track in [([20, 15], 0), ([18, 15], 1), ([20, 12], 0)]:
+        shard_store = NoteEventStore(vid_fps=30.0)
+        shard_store.append_notes([60, 64], [10, 10], end_frames, [100, 90], track=track)
+        shard_stores.append(shard_store)
+
+    forward_notes = shard_stores[0].merge(shard_stores[1]).merge(shard_stores[2]).notes
+    backward_notes = shard_stores[2].merge(shard_stores[1]).merge(shard_stores[0]).notes
+    assert np.array_equal(forward_notes, backward_notes)
+    assert forward_notes["end_frame"].tolist() == [18, 20, 20, 12, 15, 15]
+    # --------------------------------------------------------------------------
+
+    return
+
+
+def test_frame_timestamp_times():
+
+    # --------------------------------------------------------------------------
+    # Variable frame rate: times come from the frame timestamps
+    # --------------------------------------------------------------------------
+    frame_timestamps = np.array([0.0, 0.1, 0.2, 0.5, 0.8])
+    note_store = NoteEventStore(vid_fps=10.0, frame_timestamps=frame_timestamps)
+    note_store.append_notes([60, 62], [1, 3], [3, 5], [80, 80])
+
+    assert np.allclose(note_store.notes["start_time"], [0.1, 0.5])
+    assert np.allclose(note_store.notes["end_time"], [0.5, 0.9])
+    # --------------------------------------------------------------------------
+
+    return
+
+
+def test_to_midi_bytes(tmp_path):
+
+    # --------------------------------------------------------------------------
+    # At 120 bpm and 480 ticks per beat, a second is 960 ticks
+    # --------------------------------------------------------------------------
+    note_store = NoteEventStore(vid_fps=10.0)
+    note_store.append_notes([60, 60, 64], [0, 10, 5], [10, 20, 300], [100, 90, 80], track=0)
+    note_store.append_notes([48], [2], [4], [70], track=1)
+
+    midi_format, ticks_per_beat, tracks = _read_midi_file(note_store.to_midi_bytes())
+
+    assert midi_format == 1
+    assert ticks_per_beat == 480
+    assert len(tracks) == 3
+
+    # Tempo track: 500000 microseconds per beat
+    assert tracks[0] == [(0, b"\xFF\x51\x03\x07\xA1\x20"), (0, b"\xFF\x2F\x00")]
+
+    # The repeated note is turned off before it is turned on again
+    assert tracks[1] == [(0, b"\x90\x3C\x64"),
+                         (480, b"\x90\x40\x50"),
+                         (960, b"\x80\x3C\x40"),
+                         (960, b"\x90\x3C\x5A"),
+                         (1920, b"\x80\x3C\x40"),
+                         (28800, b"\x80\x40\x40"),
+                         (28800, b"\xFF\x2F\x00")]
+
+    assert tracks[2] == [(192, b"\x91\x30\x46"),
+                         (384, b"\x81\x30\x40"),
+                         (384, b"\xFF\x2F\x00")]
+    # --------------------------------------------------------------------------
+
+    # --------------------------------------------------------------------------
+    # Writing to a file
+    # --------------------------------------------------------------------------
+    midi_filename = str(tmp_path / "notes.mid")
+    note_store.write_midi_file(midi_filename)
+    with open(midi_filename, "rb") as midi_file:
+        assert midi_file.read() == note_store.to_midi_bytes()
+    # --------------------------------------------------------------------------
+
+    return
@@ -0,0 +1,97 @@
+import os
+
+import pytest
+import numpy as np
+
+from ...src.dataIO.videoIO import VideoReader, VideoSampler
+from ...src.dataIO.rawFrameSource import RawFrameSource
+
+
+def test_raw_frame_source_ring_buffer(root_data_dir):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+
+    # Forward steps, a long forward jump and a backward jump
+    frame_indices = [0, 1, 5, 120, 121, 3000, 60]
+
+    # -------------------------------------------------------------------------
+    # Reference frames from the imageio reader
+    vid_reader = VideoReader(input_video_filename)
+    expected_frames = [vid_reader.get_frame_by_index(frame_index)[1].copy()
+                       for frame_index in frame_indices]
+
+    # Illegal number of slots
+    with pytest.raises(Exception):
+        _ = RawFrameSource(input_video_filename,
+                           vid_reader.frame_width, vid_reader.frame_height,
+                           vid_reader.vid_fps, num_slots=0)
+
+    frame_source = RawFrameSource(input_video_filename,
+                                  vid_reader.frame_width, vid_reader.frame_height,
+                                  vid_reader.vid_fps, num_slots=2)
+    vid_reader.close_reader()
+
+    views = []
+    for frame_index, expected_frame in zip(frame_indices, expected_frames):
+        s, frame = frame_source.get_frame_by_index(frame_index)
+        assert s
+        assert frame_source.curr_frame_index == frame_index
+        assert np.shares_memory(frame, frame_source.ring_buffer)
+        assert np.all(frame == expected_frame)
+        views.append(frame)
+
+    # Slots are recycled: the view from two reads ago now holds the last frame
+    assert np.all(views[-3] == expected_frames[-1])
+
+    # Re-reading the current frame does not consume a slot
+    s, frame = frame_source.get_frame_by_index(60)
+    assert s
+    assert frame.__array_interface__["data"] == views[-1].__array_interface__["data"]
+
+    # Reading past the end of the video
+    s, frame = frame_source.get_frame_by_index(3952)
+    assert not s
+    assert frame is None
+    # -------------------------------------------------------------------------
+
+    frame_source.close()
+
+    return
+
+
+def test_vid_sampler_ring_buffer_mode(root_data_dir):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+
+    # -------------------------------------------------------------------------
+    vid_sampler = VideoSampler(input_video_filename)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=20, end_frame=120,
+                                                          samples_per_second=2)
+    expected_frames = [frame.copy() for frame in vid_sampler]
+    vid_sampler.close_sampler()
+
+    # Views into the ring buffer, identical frames
+    vid_sampler = VideoSampler(input_video_filename, use_ring_buffer=True, ring_buffer_size=2)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=20, end_frame=120,
+                                                          samples_per_second=2)
+    for frame, expected_frame in zip(vid_sampler, expected_frames):
+        assert np.shares_memory(frame, vid_sampler.frame_source.ring_buffer)
+        assert np.all(frame == expected_frame)
+    assert vid_sampler.curr_sample_index == vid_sampler.num_samples - 1
+    vid_sampler.close_sampler()
+
+    # Copies on demand
+    vid_sampler = VideoSampler(input_video_filename, use_ring_buffer=True, ring_buffer_size=2,
+                               copy_frames=True)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=20, end_frame=120,
+                                                          samples_per_second=2)
+    frames = list(vid_sampler)
+    vid_sampler.close_sampler()
+
+    assert len(frames) == len(expected_frames)
+    for frame, expected_frame in zip(frames, expected_frames):
+        assert not np.shares_memory(frame, vid_sampler.frame_source.ring_buffer)
+        assert np.all(frame == expected_frame)
+    # -------------------------------------------------------------------------
+
+    return
@@ -0,0 +1,60 @@
+import os
+
+from ...src.dataIO.resultCache import ResultCache, calc_video_fingerprint
+
+
+def test_calc_video_fingerprint(root_data_dir, tmp_path):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+
+    # -------------------------------------------------------------------------
+    # Same content, same fingerprint, whether from a file or from memory
+    with open(input_video_filename, "rb") as video_file:
+        video_bytes = video_file.read()
+    fingerprint = calc_video_fingerprint(input_video_filename)
+    assert fingerprint == calc_video_fingerprint(video_bytes)
+    assert fingerprint.startswith("{}-".format(len(video_bytes)))
+
+    # A change in a sampled chunk changes the fingerprint
+    changed_bytes = bytearray(video_bytes)
+    changed_bytes[-1] ^= 0xFF
+    assert calc_video_fingerprint(changed_bytes) != fingerprint
+
+    # Small data is hashed entirely
+    assert calc_video_fingerprint(b"abc") != calc_video_fingerprint(b"abd")
+    # -------------------------------------------------------------------------
+
+    return
+
+
+def test_result_cache(tmp_path):
+    cache_filename = str(tmp_path / "cache_dir" / "results.sqlite")
+
+    # -------------------------------------------------------------------------
+    result_cache = ResultCache(cache_filename)
+    assert os.path.isfile(cache_filename)
+
+    params = {"bin_thresh": 90, "top_bound": 15}
+    assert result_cache.get_result("video-a", "analysis", params) == (False, None)
+
+    result_cache.put_result("video-a", "analysis", params, {"best_shift": 86})
+    result_cache.put_result("video-a", "other_analysis", params, [1, 2])
+    result_cache.put_result("video-b", "analysis", params, None)
+
+    # Parameter order does not matter, but values do
+    assert result_cache.get_result("video-a", "analysis", {"top_bound": 15, "bin_thresh": 90}) == (True, {"best_shift": 86})
+    assert result_cache.get_result("video-a", "analysis", {"top_bound": 15, "bin_thresh": 91}) == (False, None)
+    assert result_cache.get_result("video-b", "analysis", params) == (True, None)
+    result_cache.close()
+
+    # Results persist, and can be invalidated selectively
+    result_cache = ResultCache(cache_filename)
+    assert result_cache.get_result("video-a", "other_analysis", params) == (True, [1, 2])
+    assert result_cache.invalidate(analysis_name="other_analysis") == 1
+    assert result_cache.invalidate(fingerprint="video-a") == 1
+    assert result_cache.get_result("video-b", "analysis", params) == (True, None)
+    assert result_cache.invalidate() == 1
+    result_cache.close()
+    # -------------------------------------------------------------------------
+
+    return
@@ -0,0 +1,171 @@
+import os
+
+import numpy as np
+import pytest
+
+from ...src.dataIO.videoIO import VideoReader, VideoSampler
+from ...src.dataIO.teeFrameSource import TeeFrameSource, run_tee_consumers
+from ...src.videoAnalysis.verticalShiftRateUtils import find_vertical_shift_rate
+from ...src.videoAnalysis.noteActivityUtils import extract_key_activity
+
+
+def _collect_frames(consumer):
+    frame_indices, frames = [], []
+    for frame in consumer:
+        frame_indices.append(consumer.curr_frame_index)
+        frames.append(frame)
+    return frame_indices, frames
+
+
+def test_tee_frame_source(root_data_dir):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+
+    # --------------------------------------------------------------------------
+    # Three consumers with overlapping schedules, and their own crops
+    # --------------------------------------------------------------------------
+    vid_sampler = VideoSampler(input_video_filename)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=300, end_frame=600,
+                                                          samples_per_second=2)
+    shift_frame_indices = vid_sampler.get_schedule_frame_indices()
+    vid_sampler.close_sampler()
+
+    vid_reader = VideoReader(input_video_filename, use_ring_buffer=True)
+    tee_source = TeeFrameSource(vid_reader, max_queued_frames=2)
+    tee_source.add_consumer(shift_frame_indices, top_bound=15, bottom_bound=550)
+    tee_source.add_consumer(np.arange(0, 900, 150))
+    tee_source.add_consumer(np.arange(300, 900, 30), left_bound=100, right_bound=200)
+
+    (shift_indices, shift_frames), (overview_indices, _), (band_indices, band_frames) = run_tee_consumers(tee_source,
+                                                                                                           [_collect_frames] * 3)
+    # --------------------------------------------------------------------------
+
+    # --------------------------------------------------------------------------
+    # Every consumer got its own schedule and crop, and every frame of the
+    # union was decoded once
+    # --------------------------------------------------------------------------
+    assert shift_indices == shift_frame_indices.tolist()
+    assert overview_indices == list(range(0, 900, 150))
+    assert band_indices == list(range(300, 900, 30))
+
+    union_frame_indices = np.union1d(np.union1d(shift_frame_indices, np.arange(0, 900, 150)), np.arange(300, 900, 30))
+    assert tee_source.num_decoded_frames == len(union_frame_indices)
+
+    assert shift_frames[0].shape == (535, vid_reader.frame_width, 3)
+    assert band_frames[0].shape == (vid_reader.frame_height, 100, 3)
+
+    for frame_index, shift_frame, band_frame in [(300, shift_frames[0], band_frames[0]),
+                                                 (450, shift_frames[10], band_frames[5])]:
+        _, frame = vid_reader.get_frame_by_index(frame_index)
+        assert np.array_equal(shift_frame, frame[15: 550])
+        assert np.array_equal(band_frame, frame[:, 100: 200])
+    # --------------------------------------------------------------------------
+
+    # --------------------------------------------------------------------------
+    # A consumer that stops early does not hold the others back, and once no
+    # consumer is left, decoding stops
+    # --------------------------------------------------------------------------
+    def take_three_frames(consumer):
+        return [next(consumer).shape for _ in range(3)]
+
+    tee_source = TeeFrameSource(vid_reader, max_queued_frames=1)
+    tee_source.add_consumer(np.arange(0, 3000, 10))
+    tee_source.add_consumer(np.arange(0, 600, 60))
+    three_frame_shapes, (overview_indices, _) = run_tee_consumers(tee_source, [take_three_frames, _collect_frames])
+
+    assert len(three_frame_shapes) == 3
+    assert overview_indices == list(range(0, 600, 60))
+    assert tee_source.num_decoded_frames < 300
+    # --------------------------------------------------------------------------
+
+    # --------------------------------------------------------------------------
+    # Failures reach the consumers
+    # --------------------------------------------------------------------------
+    def fail_on_second_frame(consumer):
+        next(consumer)
+        raise Exception("Analysis failed")
+
+    tee_source = TeeFrameSource(vid_reader)
+    tee_source.add_consumer(np.arange(0, 300, 30))
+    tee_source.add_consumer(np.arange(0, 300, 30))
+    with pytest.raises(Exception, match="Analysis failed"):
+        run_tee_consumers(tee_source, [_collect_frames, fail_on_second_frame])
+
+    with pytest.raises(Exception):
+        TeeFrameSource(vid_reader).add_consumer([vid_reader.vid_num_frames])
+    # --------------------------------------------------------------------------
+
+    vid_reader.close_reader()
+
+    return
+
+
+def test_tee_frame_source_analyses(root_data_dir):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+
+    # --------------------------------------------------------------------------
+    # The shift rate and the key activity from one decode, each within its
+    # consumer's crop
+    # --------------------------------------------------------------------------
+    vid_sampler = VideoSampler(input_video_filename)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=300, end_frame=1200,
+                                                          samples_per_second=2)
+    shift_frame_indices = vid_sampler.get_schedule_frame_indices()
+    vid_sampler.close_sampler()
+    activity_frame_indices = np.arange(300, 500)
+
+    vid_reader = VideoReader(input_video_filename, use_ring_buffer=True)
+    tee_source = TeeFrameSource(vid_reader)
+    tee_source.add_consumer(shift_frame_indices, top_bound=15, bottom_bound=550)
+    tee_source.add_consumer(activity_frame_indices, top_bound=530, bottom_bound=550)
+
+    def shift_analysis(consumer):
+        return find_vertical_shift_rate(consumer, None, None, None, None)
+
+    def activity_analysis(consumer):
+        return extract_key_activity(consumer, None, None, None, None, 90)
+
+    shift_rate, (tee_frame_indices, tee_activity) = run_tee_consumers(tee_source,
+                                                                      [shift_analysis, activity_analysis])
+    assert shift_rate == 86
+
+    # The shift analysis stops once the rate is found, and so does the decode
+    # once no consumer is left
+    assert len(activity_frame_indices) <= tee_source.num_decoded_frames
+    assert tee_source.num_decoded_frames < len(np.union1d(shift_frame_indices, activity_frame_indices))
+    vid_reader.close_reader()
+    # --------------------------------------------------------------------------
+
+    # --------------------------------------------------------------------------
+    # Same key activity as from a sampler of its own
+    # --------------------------------------------------------------------------
+    vid_sampler = VideoSampler(input_video_filename)
+    vid_sampler.gen_sampling_schedule_using_frame_array(activity_frame_indices)
+    frame_indices, activity = extract_key_activity(vid_sampler, 530, 550, None, None, 90)
+    vid_sampler.close_sampler()
+
+    assert np.array_equal(tee_frame_indices, frame_indices)
+    assert np.array_equal(tee_activity, activity)
+    # --------------------------------------------------------------------------
+
+    # --------------------------------------------------------------------------
+    # A consumer cannot be rewound
+    # --------------------------------------------------------------------------
+    vid_reader = VideoReader(input_video_filename)
+    tee_source = TeeFrameSource(vid_reader)
+    consumer = tee_source.add_consumer(np.arange(0, 60, 30))
+    assert consumer.num_samples == 2
+    assert consumer.get_sampling_state()["sample_frame_indices"] == [0, 30]
+
+    def read_twice(consumer):
+        next(consumer)
+        assert consumer.curr_sample_index == 0
+        consumer.curr_sample_index = None
+
+    with pytest.raises(Exception, match="cannot be moved"):
+        run_tee_consumers(tee_source, [read_twice])
+    vid_reader.close_reader()
+    # --------------------------------------------------------------------------
+
+    return
@@ -0,0 +1,143 @@
+import os
+import sys
+import stat
+
+import numpy as np
+import pytest
+from skimage.transform import resize
+
+from ...src.dataIO.videoIO import VideoReader
+from ...src.dataIO.resultCache import calc_video_fingerprint
+from ...src.dataIO import thumbnailIndex
+from ...src.dataIO.thumbnailIndex import load_thumbnail_index, build_thumbnail_index
+from ...src.videoAnalysis.frameProcessingUtils import convert_frame_to_grayscale
+
+
+def test_thumbnail_index(root_data_dir, tmp_path):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+    thumbnail_filename = str(tmp_path / "thumbs.npy")
+
+    vid_reader = VideoReader(input_video_filename)
+
+    # --------------------------------------------------------------------------
+    # One thumbnail every 30 frames, over the whole video
+    # --------------------------------------------------------------------------
+    frame_indices, thumbnails = load_thumbnail_index(vid_reader, frame_step=30,
+                                                     thumbnail_filename=thumbnail_filename)
+
+    assert isinstance(thumbnails, np.memmap)
+    assert thumbnails.dtype == np.uint8
+    assert thumbnails.shape == (len(frame_indices), 36, 64)
+    assert len(frame_indices) == int(np.ceil(vid_reader.vid_num_frames / 30.0))
+    assert np.array_equal(frame_indices, np.arange(len(frame_indices)) * 30)
+    # --------------------------------------------------------------------------
+
+    # --------------------------------------------------------------------------
+    # Thumbnails look like the (shrunk) frames they stand for
+    # --------------------------------------------------------------------------
+    for thumbnail_index in [10, 20, 40]:
+        success, frame = vid_reader.get_frame_by_index(int(frame_indices[thumbnail_index]))
+        assert success
+        gray_frame = convert_frame_to_grayscale(frame).astype("float64")
+        if gray_frame.max() <= 1.0:
+            gray_frame *= 255.0
+        shrunk_frame = resize(gray_frame, (36, 64), anti_aliasing=True, preserve_range=True)
+
+        # (ffmpeg's gray is the luma plane, which weighs colours differently)
+        thumbnail_correlation = np.corrcoef(shrunk_frame.ravel(), thumbnails[thumbnail_index].ravel())[0, 1]
+        next_thumbnail_correlation = np.corrcoef(shrunk_frame.ravel(), thumbnails[thumbnail_index + 1].ravel())[0, 1]
+        assert thumbnail_correlation > 0.95
+        assert thumbnail_correlation > next_thumbnail_correlation
+    # --------------------------------------------------------------------------
+
+    # --------------------------------------------------------------------------
+    # Loading again reuses the index
+    # --------------------------------------------------------------------------
+    index_mtime = os.path.getmtime(thumbnail_filename)
+    _, reloaded_thumbnails = load_thumbnail_index(vid_reader, frame_step=30,
+                                                  thumbnail_filename=thumbnail_filename)
+    assert os.path.getmtime(thumbnail_filename) == index_mtime
+    assert np.array_equal(reloaded_thumbnails, thumbnails)
+    # --------------------------------------------------------------------------
+
+    vid_reader.close_reader()
+
+    return
+
+
+def test_thumbnail_index_ffmpeg_errors(root_data_dir, tmp_path, monkeypatch):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+
+    # --------------------------------------------------------------------------
+    # An "ffmpeg" that writes far more to stderr than a pipe holds, before
+    # failing: the pass must not block on it, and the error must carry it
+    # --------------------------------------------------------------------------
+    fake_ffmpeg_filename = str(tmp_path / "fake_ffmpeg")
+    with open(fake_ffmpeg_filename, "w") as fake_ffmpeg_file:
+        fake_ffmpeg_file.write("#!{}\n".format(sys.executable))
+        fake_ffmpeg_file.write("import sys\n")
+        fake_ffmpeg_file.write("sys.stderr.write(\"noise \" * 200000 + \"Fake decoding error\")\n")
+        fake_ffmpeg_file.write("sys.exit(1)\n")
+    os.chmod(fake_ffmpeg_filename, os.stat(fake_ffmpeg_filename).st_mode | stat.S_IXUSR)
+    monkeypatch.setattr(thumbnailIndex.imageio_ffmpeg, "get_ffmpeg_exe", lambda: fake_ffmpeg_filename)
+
+    vid_reader = VideoReader(input_video_filename)
+    thumbnail_filename = str(tmp_path / "thumbs.npy")
+    with pytest.raises(Exception, match="Fake decoding error"):
+        build_thumbnail_index(vid_reader, thumbnail_filename, frame_step=30)
+    assert not os.path.isfile(thumbnail_filename)
+    assert not os.path.isfile(thumbnail_filename + ".raw.tmp")
+    vid_reader.close_reader()
+    # --------------------------------------------------------------------------
+
+    return
+
+
+def test_thumbnail_index_cache_dir(root_data_dir, tmp_path, monkeypatch):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+    vid_reader = VideoReader(input_video_filename)
+    next_to_video_filename = "{}.thumbs-64x36-step200.npy".format(input_video_filename)
+
+    # --------------------------------------------------------------------------
+    # With a cache directory, the index goes there (by content), and not next
+    # to the video
+    # --------------------------------------------------------------------------
+    cache_dir = str(tmp_path / "thumbs")
+    frame_indices, thumbnails = load_thumbnail_index(vid_reader, frame_step=200, cache_dir=cache_dir)
+    assert len(frame_indices) == len(thumbnails) == 20
+    assert os.listdir(cache_dir) == ["{}.thumbs-64x36-step200.npy".format(calc_video_fingerprint(input_video_filename))]
+    assert not os.path.isfile(next_to_video_filename)
+    # --------------------------------------------------------------------------
+
+    # --------------------------------------------------------------------------
+    # If the video's directory cannot be written to, the index goes to the
+    # default cache directory instead
+    # --------------------------------------------------------------------------
+    original_build_thumbnail_index = thumbnailIndex.build_thumbnail_index
+
+    def read_only_build_thumbnail_index(vid_reader, thumbnail_filename, **kwargs):
+        if thumbnail_filename == next_to_video_filename:
+            raise PermissionError("Read-only file system: '{}'".format(thumbnail_filename))
+        return original_build_thumbnail_index(vid_reader, thumbnail_filename, **kwargs)
+
+    default_cache_dir = str(tmp_path / "default_thumbs")
+    monkeypatch.setattr(thumbnailIndex, "build_thumbnail_index", read_only_build_thumbnail_index)
+    monkeypatch.setattr(thumbnailIndex, "DEFAULT_THUMBNAIL_CACHE_DIR", default_cache_dir)
+
+    _, fallback_thumbnails = load_thumbnail_index(vid_reader, frame_step=200)
+    assert np.array_equal(fallback_thumbnails, thumbnails)
+    assert os.listdir(default_cache_dir) == os.listdir(cache_dir)
+    assert not os.path.isfile(next_to_video_filename)
+
+    # An explicitly named index is never moved elsewhere
+    with pytest.raises(PermissionError):
+        _ = load_thumbnail_index(vid_reader, frame_step=200,
+                                 thumbnail_filename=next_to_video_filename)
+    # --------------------------------------------------------------------------
+
+    vid_reader.close_reader()
+
+    return
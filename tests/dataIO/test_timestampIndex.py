@@ -0,0 +1,100 @@
+import os
+import subprocess
+
+import numpy as np
+import imageio_ffmpeg
+
+from ...src.dataIO.videoIO import VideoReader, VideoSampler
+from ...src.dataIO.timestampIndex import (build_frame_timestamps,
+                                          load_frame_timestamps,
+                                          calc_frame_index_by_time)
+
+
+def _make_vfr_video(output_video_filename):
+
+    # 30 frames at 30 fps, followed by 30 frames at 10 fps (the last of which
+    # x264 trims with an edit list)
+    subprocess.run([imageio_ffmpeg.get_ffmpeg_exe(), "-loglevel", "error", "-y",
+                    "-f", "lavfi", "-i", "testsrc2=size=160x90:rate=30",
+                    "-frames:v", "60",
+                    "-vf", "setpts='if(lt(N,30),N/30,1+(N-30)/10)/TB'",
+                    "-fps_mode", "passthrough",
+                    "-c:v", "libx264", "-pix_fmt", "yuv420p",
+                    output_video_filename],
+                   check=True)
+    return
+
+
+def test_frame_timestamps(root_data_dir, tmp_path):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+    timestamp_cache_dir = str(tmp_path / "timestamps")
+
+    # -------------------------------------------------------------------------
+    # Constant frame rate: every 1/30 s
+    frame_timestamps = load_frame_timestamps(input_video_filename, cache_dir=timestamp_cache_dir)
+    assert len(frame_timestamps) == 3952
+    assert np.allclose(frame_timestamps, np.arange(3952) / 30.0)
+    assert len(os.listdir(timestamp_cache_dir)) == 1
+
+    # Second load comes from the cache
+    assert np.all(load_frame_timestamps(input_video_filename, cache_dir=timestamp_cache_dir) == frame_timestamps)
+
+    assert calc_frame_index_by_time(frame_timestamps, 10.0) == 300
+    assert calc_frame_index_by_time(frame_timestamps, 10.01) == 300
+    assert calc_frame_index_by_time(frame_timestamps, 10.04) == 301
+
+    # Same frames as without the index
+    vid_reader = VideoReader(input_video_filename)
+    indexed_reader = VideoReader(input_video_filename, use_timestamp_index=True,
+                                 timestamp_cache_dir=timestamp_cache_dir)
+    for frame_index in [300, 1200, 301]:
+        _, expected_frame = vid_reader.get_frame_by_index(frame_index)
+        _, frame = indexed_reader.get_frame_by_index(frame_index)
+        assert np.all(frame == expected_frame)
+    vid_reader.close_reader()
+    indexed_reader.close_reader()
+    # -------------------------------------------------------------------------
+
+    return
+
+
+def test_frame_timestamps_variable_frame_rate(tmp_path):
+    vfr_video_filename = str(tmp_path / "vfr.mp4")
+    _make_vfr_video(vfr_video_filename)
+
+    # -------------------------------------------------------------------------
+    frame_timestamps = build_frame_timestamps(vfr_video_filename)
+    assert len(frame_timestamps) == 59
+    assert np.allclose(frame_timestamps[28: 32], [28 / 30.0, 29 / 30.0, 1.0, 1.1])
+
+    # Reference: every frame, decoded in order
+    vid_reader = VideoReader(vfr_video_filename, use_timestamp_index=True, timestamp_cache_dir=None)
+    assert vid_reader.vid_num_frames == 59
+    expected_frames = [vid_reader.get_frame_by_index(frame_index)[1]
+                       for frame_index in range(vid_reader.vid_num_frames)]
+    vid_reader.close_reader()
+
+    # Random access, by index and by time, lands on exactly those frames
+    vid_reader = VideoReader(vfr_video_filename, use_timestamp_index=True, timestamp_cache_dir=None)
+    for frame_index in [58, 0, 35, 31, 30, 29, 45]:
+        s, frame = vid_reader.get_frame_by_index(frame_index)
+        assert s
+        assert np.all(frame == expected_frames[frame_index])
+
+    s, frame = vid_reader.get_frame_by_time(1.55)
+    assert s
+    assert vid_reader.curr_frame_index == 35
+    assert vid_reader.curr_time_instant == frame_timestamps[35]
+    assert np.all(frame == expected_frames[35])
+    vid_reader.close_reader()
+
+    # Samples are evenly spaced in time, not in frames
+    vid_sampler = VideoSampler(vfr_video_filename, use_timestamp_index=True, timestamp_cache_dir=None)
+    vid_sampler.gen_sampling_schedule_using_time(start_time=0.0, end_time=3.0, samples_per_second=2)
+    assert vid_sampler.sample_frame_indices.tolist() == [0, 15, 30, 35, 40, 45, 50]
+    assert vid_sampler.end_time == frame_timestamps[50]
+    vid_sampler.close_sampler()
+    # -------------------------------------------------------------------------
+
+    return
@@ -435,3 +435,214 @@ def test_vid_sampler_get_sample(root_data_dir):
     vid_sampler.close_sampler()
 
     return
+
+
+def test_vid_sampler_sampling_state(root_data_dir):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+    vid_sampler = VideoSampler(input_video_filename)
+
+    # -------------------------------------------------------------------------
+    # State cannot be requested without a sampling
+    with pytest.raises(Exception):
+        _ = vid_sampler.get_sampling_state()
+
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=120, end_frame=740,
+                                                          samples_per_second=2)
+    _, _ = vid_sampler.get_sample_by_index(3)
+    sampling_state = vid_sampler.get_sampling_state()
+    vid_sampler.close_sampler()
+
+    # Restore the state on a fresh sampler
+    vid_sampler = VideoSampler(input_video_filename)
+    vid_sampler.set_sampling_state(sampling_state)
+    assert vid_sampler.is_sampling_generated
+    assert vid_sampler.start_frame == 120
+    assert math.isclose(vid_sampler.start_time, 4.0)
+    assert vid_sampler.end_frame == 735
+    assert vid_sampler.sample_step == 15
+    assert math.isclose(vid_sampler.sample_time_diff, 0.5)
+    assert vid_sampler.num_samples == 42
+    assert vid_sampler.curr_sample_index == 3
+
+    # Iteration continues from the restored position
+    s, _ = vid_sampler.get_next_sample()
+    assert s
+    assert vid_sampler.curr_sample_index == 4
+    assert vid_sampler.curr_frame_index == 180
+
+    # State that does not fit in the video
+    sampling_state["end_frame"] = 3952
+    with pytest.raises(Exception):
+        vid_sampler.set_sampling_state(sampling_state)
+    # -------------------------------------------------------------------------
+
+    vid_sampler.close_sampler()
+
+    return
+
+
+def test_vid_reader_scale_factor(root_data_dir):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+
+    # -------------------------------------------------------------------------
+    # Illegal scale factor
+    with pytest.raises(Exception):
+        _ = VideoReader(input_video_filename, scale_factor=3)
+
+    # Frames (and frame size metadata) are decoded at the reduced size
+    vid_reader = VideoReader(input_video_filename, scale_factor=2)
+    assert vid_reader.frame_height == 360
+    assert vid_reader.frame_width == 637
+    assert vid_reader.vid_num_frames == 3952
+
+    s, f = vid_reader.get_frame_by_index(120)
+    assert s
+    assert f.shape == (360, 637, 3)
+    vid_reader.close_reader()
+
+    # Same in ring buffer mode
+    vid_reader = VideoReader(input_video_filename, scale_factor=4, use_ring_buffer=True)
+    s, f = vid_reader.get_frame_by_index(120)
+    assert s
+    assert f.shape == (180, 318, 3)
+    vid_reader.close_reader()
+    # -------------------------------------------------------------------------
+
+    return
+
+
+def test_vid_reader_get_frames(root_data_dir):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+    vid_reader = VideoReader(input_video_filename)
+
+    # -------------------------------------------------------------------------
+    # Unordered, with a repeated index
+    frame_indices = [150, 30, 900, 30, 31]
+    frames = vid_reader.get_frames(frame_indices)
+    assert frames.shape == (5, 720, 1274, 3)
+    assert vid_reader.curr_frame_index == 900
+
+    for frame_index, frame in zip(frame_indices, frames):
+        _, expected_frame = vid_reader.get_frame_by_index(frame_index)
+        assert np.all(frame == expected_frame)
+
+    # Illegal indices
+    with pytest.raises(Exception):
+        _ = vid_reader.get_frames([10, 3952])
+    with pytest.raises(Exception):
+        _ = vid_reader.get_frames([1.5, 2.5])
+    # -------------------------------------------------------------------------
+
+    vid_reader.close_reader()
+    return
+
+
+def test_vid_sampler_frame_array_schedule(root_data_dir):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+    vid_sampler = VideoSampler(input_video_filename)
+
+    # -------------------------------------------------------------------------
+    # Clustered, non-uniform sampling
+    frame_indices = np.array([30, 31, 32, 300, 600, 601])
+    vid_sampler.gen_sampling_schedule_using_frame_array(frame_indices)
+    assert vid_sampler.is_sampling_generated
+    assert vid_sampler.start_frame == 30
+    assert math.isclose(vid_sampler.start_time, 1.0)
+    assert vid_sampler.end_frame == 601
+    assert vid_sampler.num_samples == 6
+    assert vid_sampler.sample_step is None
+    assert vid_sampler.curr_sample_index is None
+
+    # Iteration follows the array
+    index_list = []
+    frame_list = []
+    for _ in vid_sampler:
+        index_list.append(vid_sampler.curr_sample_index)
+        frame_list.append(vid_sampler.curr_frame_index)
+    assert index_list == list(range(6))
+    assert frame_list == frame_indices.tolist()
+
+    # Float sampling between two samples
+    s, _ = vid_sampler.get_sample_by_index(3.5)
+    assert s
+    assert vid_sampler.curr_frame_index == 450
+    assert math.isclose(vid_sampler.curr_sample_index, 3.5)
+    s, _ = vid_sampler.get_next_sample()
+    assert s
+    assert vid_sampler.curr_sample_index == 4
+    assert vid_sampler.curr_frame_index == 600
+
+    # Bulk sample fetch, in the caller's order
+    frames = vid_sampler.get_samples([5, 0, 3], update_curr_sample_index=False)
+    assert vid_sampler.curr_sample_index == 4
+    _, expected_frame = vid_sampler.get_sample_by_index(0)
+    assert np.all(frames[1] == expected_frame)
+
+    # State round trip
+    sampling_state = vid_sampler.get_sampling_state()
+    vid_sampler.gen_sampling_schedule_using_frame_indices()
+    vid_sampler.set_sampling_state(sampling_state)
+    assert np.all(vid_sampler.sample_frame_indices == frame_indices)
+    assert vid_sampler.curr_sample_index == 0
+
+    # Illegal arrays
+    with pytest.raises(Exception):
+        vid_sampler.gen_sampling_schedule_using_frame_array([])
+    with pytest.raises(Exception):
+        vid_sampler.gen_sampling_schedule_using_frame_array([30, 30, 40])
+    with pytest.raises(Exception):
+        vid_sampler.gen_sampling_schedule_using_frame_array([30.0, 40.0])
+    with pytest.raises(Exception):
+        vid_sampler.gen_sampling_schedule_using_frame_array([30, 3952])
+    # -------------------------------------------------------------------------
+
+    vid_sampler.close_sampler()
+
+    return
+
+
+def test_vid_sampler_clone(root_data_dir, tmp_path):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+    with open(input_video_filename, "rb") as video_file:
+        video_data = video_file.read()
+
+    # -------------------------------------------------------------------------
+    # In-memory, ring buffer, timestamp-indexed sampler, part way through its
+    # schedule
+    vid_sampler = VideoSampler(video_data, use_ring_buffer=True, ring_buffer_size=3,
+                               use_timestamp_index=True,
+                               timestamp_cache_dir=str(tmp_path))
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=120, end_frame=740,
+                                                          samples_per_second=2)
+    _, _ = vid_sampler.get_sample_by_index(3)
+
+    # The clone keeps every reader option, the schedule and the position
+    scaled_sampler = vid_sampler.clone(scale_factor=2)
+    assert scaled_sampler.scale_factor == 2
+    assert scaled_sampler.frame_height == 360
+    assert scaled_sampler.video_source == vid_sampler.video_source
+    assert scaled_sampler.use_ring_buffer
+    assert scaled_sampler.ring_buffer_size == 3
+    assert np.all(scaled_sampler.frame_timestamps == vid_sampler.frame_timestamps)
+    assert scaled_sampler.get_sampling_state() == vid_sampler.get_sampling_state()
+
+    s, f = scaled_sampler.get_next_sample()
+    assert s
+    assert f.shape == (360, 637, 3)
+    assert scaled_sampler.curr_frame_index == 180
+    scaled_sampler.close_sampler()
+
+    # Without a scale factor, the clone is at the same scale
+    same_scale_sampler = vid_sampler.clone()
+    assert same_scale_sampler.scale_factor == 1
+    same_scale_sampler.close_sampler()
+    # -------------------------------------------------------------------------
+
+    vid_sampler.close_sampler()
+
+    return
@@ -0,0 +1,80 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import numpy as np
+
+from ...src.dataIO.videoIO import VideoReader
+from ...src.dataIO.videoReaderPool import VideoReaderPool
+
+
+def test_vid_reader_pool_routing(root_data_dir):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+
+    # -------------------------------------------------------------------------
+    # Illegal number of readers
+    with pytest.raises(Exception):
+        _ = VideoReaderPool(input_video_filename, num_readers=0)
+
+    vid_reader_pool = VideoReaderPool(input_video_filename, num_readers=2)
+    assert vid_reader_pool.vid_num_frames == 3952
+
+    # Warm: every handle is open before the first request
+    assert all(vid_reader is not None for vid_reader in vid_reader_pool.video_readers)
+
+    # Place the two handles far apart in the video
+    s, _ = vid_reader_pool.get_frame_by_index(100)
+    assert s
+    s, _ = vid_reader_pool.get_frame_by_index(2000)
+    assert s
+    reader_frame_indices = sorted(vid_reader.curr_frame_index
+                                  for vid_reader in vid_reader_pool.video_readers)
+    assert reader_frame_indices == [100, 2000]
+
+    # Requests close to either handle are routed to that handle
+    s, _ = vid_reader_pool.get_frame_by_index(110)
+    assert s
+    s, _ = vid_reader_pool.get_frame_by_index(2005)
+    assert s
+    reader_frame_indices = sorted(vid_reader.curr_frame_index
+                                  for vid_reader in vid_reader_pool.video_readers)
+    assert reader_frame_indices == [110, 2005]
+
+    # Out of range requests behave like VideoReader
+    with pytest.warns(Warning):
+        s, f = vid_reader_pool.get_frame_by_index(3952)
+        assert not s
+        assert f is None
+    # -------------------------------------------------------------------------
+
+    vid_reader_pool.close_pool()
+
+    return
+
+
+def test_vid_reader_pool_concurrent_access(root_data_dir):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+
+    frame_indices = [30, 900, 31, 1500, 905, 32, 1501, 60, 2500, 910]
+
+    # -------------------------------------------------------------------------
+    # Reference frames from a single reader
+    vid_reader = VideoReader(input_video_filename)
+    expected_frames = [vid_reader.get_frame_by_index(frame_index)[1].copy()
+                       for frame_index in frame_indices]
+    vid_reader.close_reader()
+
+    # The same frames, requested from many threads at once
+    vid_reader_pool = VideoReaderPool(input_video_filename, num_readers=3)
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        results = list(executor.map(vid_reader_pool.get_frame_by_index, frame_indices))
+    vid_reader_pool.close_pool()
+
+    for (s, frame), expected_frame in zip(results, expected_frames):
+        assert s
+        assert np.all(frame == expected_frame)
+    # -------------------------------------------------------------------------
+
+    return
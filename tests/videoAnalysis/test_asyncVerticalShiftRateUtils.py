@@ -0,0 +1,63 @@
+import os
+import asyncio
+
+import pytest
+
+from ...src.dataIO.videoIO import VideoSampler
+from ...src.videoAnalysis.asyncVerticalShiftRateUtils import async_find_vertical_shift_rate
+
+
+def test_async_find_vertical_shift_rate(root_data_dir):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+
+    top_bound = 15
+    bottom_bound = 550
+    left_bound = None
+    right_bound = None
+    bin_thresh = 90
+
+    # --------------------------------------------------------------------------
+    # (1): Definite shift rate found, for two videos analysed concurrently
+    async def find_concurrently(vid_samplers):
+        return await asyncio.gather(*[async_find_vertical_shift_rate(vid_sampler,
+                                                                     top_bound=top_bound, bottom_bound=bottom_bound,
+                                                                     left_bound=left_bound, right_bound=right_bound,
+                                                                     bin_thresh=bin_thresh,
+                                                                     num_shift_count_threshold=10)
+                                      for vid_sampler in vid_samplers])
+
+    vid_samplers = [VideoSampler(input_video_filename) for _ in range(2)]
+    for vid_sampler in vid_samplers:
+        vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=300, end_frame=1200,
+                                                              samples_per_second=2)
+
+    vertical_shift_rates = asyncio.run(find_concurrently(vid_samplers))
+    assert vertical_shift_rates == [86, 86]
+
+    for vid_sampler in vid_samplers:
+        vid_sampler.close_sampler()
+
+
+    # (2): Cancellation while the analysis is running
+    async def find_and_cancel(vid_sampler):
+        task = asyncio.ensure_future(async_find_vertical_shift_rate(vid_sampler,
+                                                                    top_bound=top_bound, bottom_bound=bottom_bound,
+                                                                    left_bound=left_bound, right_bound=right_bound,
+                                                                    bin_thresh=bin_thresh,
+                                                                    num_shift_count_threshold=1000))
+        await asyncio.sleep(0.5)
+        task.cancel()
+        await task
+
+    vid_sampler = VideoSampler(input_video_filename)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(samples_per_second=2)
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(find_and_cancel(vid_sampler))
+    assert vid_sampler.curr_sample_index < vid_sampler.num_samples - 1
+
+    vid_sampler.close_sampler()
+    # --------------------------------------------------------------------------
+
+    return
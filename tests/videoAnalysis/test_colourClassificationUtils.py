@@ -0,0 +1,93 @@
+import pytest
+import numpy as np
+
+from ...src.videoAnalysis.colourClassificationUtils import (build_colour_lut,
+                                                            classify_frame_colours,
+                                                            calc_key_class_activity,
+                                                            BACKGROUND_CLASS_ID)
+
+LEFT_HAND_COLOUR = (80, 220, 80)
+RIGHT_HAND_COLOUR = (100, 150, 255)
+
+
+def test_build_colour_lut():
+
+    # --------------------------------------------------------------------------
+    colour_lut = build_colour_lut([LEFT_HAND_COLOUR, RIGHT_HAND_COLOUR])
+    assert colour_lut.shape == (32, 32, 32)
+    assert colour_lut.dtype == "uint8"
+    assert set(np.unique(colour_lut).tolist()) == {0, 1, 2}
+
+    # Coarser bins
+    assert build_colour_lut([LEFT_HAND_COLOUR], bins_per_channel=16).shape == (16, 16, 16)
+
+    # Illegal inputs
+    with pytest.raises(Exception):
+        _ = build_colour_lut([(1, 2)])
+    with pytest.raises(Exception):
+        _ = build_colour_lut([LEFT_HAND_COLOUR], bins_per_channel=30)
+    # --------------------------------------------------------------------------
+
+    return
+
+
+def test_classify_frame_colours():
+
+    colour_lut = build_colour_lut([LEFT_HAND_COLOUR, RIGHT_HAND_COLOUR])
+
+    # --------------------------------------------------------------------------
+    frame = np.zeros((4, 3, 3), dtype="uint8")
+    frame[0, :] = LEFT_HAND_COLOUR
+    frame[1, :] = (75, 210, 90)             # Close to the left hand colour
+    frame[2, :] = RIGHT_HAND_COLOUR
+    frame[3, :] = (255, 255, 255)           # Far from both
+
+    label_frame = classify_frame_colours(frame, colour_lut)
+    assert label_frame.shape == (4, 3)
+    assert np.all(label_frame[0] == 1)
+    assert np.all(label_frame[1] == 1)
+    assert np.all(label_frame[2] == 2)
+    assert np.all(label_frame[3] == BACKGROUND_CLASS_ID)
+
+    # Only uint8 RGB frames
+    with pytest.raises(Exception):
+        _ = classify_frame_colours(frame.astype("float"), colour_lut)
+    with pytest.raises(Exception):
+        _ = classify_frame_colours(frame[..., 0], colour_lut)
+    # --------------------------------------------------------------------------
+
+    return
+
+
+def test_calc_key_class_activity():
+
+    colour_lut = build_colour_lut([LEFT_HAND_COLOUR, RIGHT_HAND_COLOUR])
+
+    # --------------------------------------------------------------------------
+    # 4 keys of 10 columns each; key 0 fully left hand, half of key 2 right hand
+    frame = np.zeros((20, 40, 3), dtype="uint8")
+    frame[:, 0: 10] = LEFT_HAND_COLOUR
+    frame[10: 20, 20: 30] = RIGHT_HAND_COLOUR
+
+    key_class_activity = calc_key_class_activity(frame, None, None, None, None,
+                                                 colour_lut, 2, num_keys=4)
+    assert key_class_activity.shape == (2, 4)
+    assert np.allclose(key_class_activity, [[1.0, 0.0, 0.0, 0.0],
+                                            [0.0, 0.0, 0.5, 0.0]])
+
+    # A class that wins no bin (here, a duplicate of the last colour) still
+    # has its row
+    colour_lut = build_colour_lut([LEFT_HAND_COLOUR, RIGHT_HAND_COLOUR, RIGHT_HAND_COLOUR])
+    assert int(colour_lut.max()) == 2
+    key_class_activity = calc_key_class_activity(frame, None, None, None, None,
+                                                 colour_lut, 3, num_keys=4)
+    assert key_class_activity.shape == (3, 4)
+    assert np.allclose(key_class_activity[2], 0.0)
+
+    # Fewer classes than the LUT has
+    with pytest.raises(Exception):
+        _ = calc_key_class_activity(frame, None, None, None, None,
+                                    colour_lut, 1, num_keys=4)
+    # --------------------------------------------------------------------------
+
+    return
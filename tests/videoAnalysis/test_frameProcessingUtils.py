@@ -8,7 +8,8 @@ from imageio import imread
 
 from ...src.videoAnalysis.frameProcessingUtils import (crop_frame,
                                                        convert_frame_to_grayscale,
-                                                       binarise_frame)
+                                                       binarise_frame,
+                                                       calc_frame_signature)
 
 
 def test_regular_crop_frame(root_data_dir):
@@ -188,3 +189,26 @@ def test_binarise_frame(root_data_dir):
     # --------------------------------------------------------------------------
 
     return
+
+
+def test_calc_frame_signature(root_data_dir):
+
+    input_frame = imread(os.path.join(root_data_dir, "frames",
+                                      "marioverehrer_minecraft_frame_0300.png"))
+
+    # --------------------------------------------------------------------------
+    bin_frame = binarise_frame(input_frame, thresh=90)
+
+    # Identical frames (even separate copies) have the same signature
+    assert calc_frame_signature(bin_frame) == calc_frame_signature(bin_frame.copy())
+
+    # A single changed pixel changes the signature
+    changed_bin_frame = bin_frame.copy()
+    changed_bin_frame[10, 10] = not changed_bin_frame[10, 10]
+    assert calc_frame_signature(bin_frame) != calc_frame_signature(changed_bin_frame)
+
+    # Same pixels, different shape
+    assert calc_frame_signature(bin_frame) != calc_frame_signature(bin_frame.reshape(bin_frame.shape[1], -1))
+    # --------------------------------------------------------------------------
+
+    return
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+import numpy as np
+from imageio import imread
+
+from ...src.dataIO.videoIO import VideoSampler
+from ...src.videoAnalysis.frameProcessingUtils import (crop_frame,
+                                                       binarise_frame)
+from ...src.videoAnalysis.noteActivityUtils import (calc_key_column_edges,
+                                                    calc_key_activity,
+                                                    extract_key_activity)
+
+
+def test_calc_key_activity(root_data_dir):
+
+    input_frame = imread(os.path.join(root_data_dir, "frames",
+                                      "marioverehrer_minecraft_frame_0300.png"))
+
+    # --------------------------------------------------------------------------
+    # Column edges cover all columns, in equal-ish groups
+    col_edges = calc_key_column_edges(1274, 88)
+    assert len(col_edges) == 89
+    assert col_edges[0] == 0 and col_edges[-1] == 1274
+    assert np.all(np.diff(col_edges) >= 14)
+
+    with pytest.raises(Exception):
+        _ = calc_key_column_edges(50, 88)
+
+    # Activity is the lit fraction of each key's column group
+    key_activity = calc_key_activity(input_frame, 500, 550, None, None, 90, 88)
+    assert key_activity.shape == (88,)
+    assert key_activity.dtype == "float32"
+    assert np.all((key_activity >= 0.0) & (key_activity <= 1.0))
+
+    bin_band = binarise_frame(crop_frame(input_frame, top_row=500, bottom_row=550), 90)
+    for key in [0, 40, 87]:
+        expected_activity = np.mean(bin_band[:, col_edges[key]: col_edges[key + 1]])
+        assert np.isclose(key_activity[key], expected_activity)
+    # --------------------------------------------------------------------------
+
+    return
+
+
+def test_extract_key_activity(root_data_dir, tmp_path):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+
+    # --------------------------------------------------------------------------
+    vid_sampler = VideoSampler(input_video_filename)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=300, end_frame=600,
+                                                          samples_per_second=2)
+
+    frame_indices, activity_matrix = extract_key_activity(vid_sampler, 500, 550, None, None, 90)
+    assert activity_matrix.shape == (vid_sampler.num_samples, 88)
+    assert activity_matrix.dtype == "float32"
+    assert frame_indices.tolist() == list(range(300, 601, 15))
+
+    # Every row matches the activity of its frame
+    for sample_index in [0, 7, 20]:
+        _, frame = vid_sampler.get_frame_by_index(int(frame_indices[sample_index]))
+        assert np.allclose(activity_matrix[sample_index],
+                           calc_key_activity(frame, 500, 550, None, None, 90, 88))
+
+    # Scaled to uint8, and memory-mapped to disk
+    output_filename = str(tmp_path / "key_activity.npy")
+    _, uint8_activity_matrix = extract_key_activity(vid_sampler, 500, 550, None, None, 90,
+                                                    dtype="uint8", output_filename=output_filename)
+    assert uint8_activity_matrix.dtype == "uint8"
+    assert np.all(np.abs(uint8_activity_matrix.astype("float") - (activity_matrix * 255)) <= 0.5 + 1e-3)
+    assert np.all(np.load(output_filename) == uint8_activity_matrix)
+
+    with pytest.raises(Exception):
+        _ = extract_key_activity(vid_sampler, 500, 550, None, None, 90, dtype="int32")
+    vid_sampler.close_sampler()
+    # --------------------------------------------------------------------------
+
+    return
@@ -0,0 +1,118 @@
+import pytest
+import numpy as np
+
+from ...src.videoAnalysis.noteDetectionUtils import (NoteEventDetector,
+                                                     detect_note_events,
+                                                     detect_note_events_in_chunks,
+                                                     find_note_runs)
+
+
+def _detect_note_events_by_loop(activity_matrix, on_thresh, off_thresh, min_duration_frames):
+
+    # Straightforward frame-by-frame reference
+    notes = []
+    for key in range(activity_matrix.shape[1]):
+        onset_frame = None
+        for frame_index, activity in enumerate(activity_matrix[:, key]):
+            if (onset_frame is None) and (activity >= on_thresh):
+                onset_frame = frame_index
+            elif (onset_frame is not None) and (activity < off_thresh):
+                notes.append((key, onset_frame, frame_index))
+                onset_frame = None
+        if onset_frame is not None:
+            notes.append((key, onset_frame, activity_matrix.shape[0]))
+
+    return [note for note in notes if (note[2] - note[1]) >= min_duration_frames]
+
+
+def test_detect_note_events():
+
+    # --------------------------------------------------------------------------
+    activity_matrix = np.array([[0.9, 0.0, 0.6],
+                                [0.4, 0.0, 0.6],
+                                [0.1, 0.7, 0.2],
+                                [0.9, 0.0, 0.6],
+                                [1.0, 0.0, 0.4]], dtype="float32")
+
+    # Hysteresis keeps key 0 on at 0.4; key 1 is too short
+    note_keys, onset_frames, offset_frames, velocities = detect_note_events(activity_matrix,
+                                                                            on_thresh=0.5, off_thresh=0.3,
+                                                                            min_duration_frames=2)
+    assert note_keys.tolist() == [0, 0, 2, 2]
+    assert onset_frames.tolist() == [0, 3, 0, 3]
+    assert offset_frames.tolist() == [2, 5, 2, 5]
+    assert velocities.tolist() == [114, 127, 76, 76]
+
+    # Same notes from uint8 activities
+    uint8_notes = detect_note_events(np.rint(activity_matrix * 255).astype("uint8"),
+                                     on_thresh=0.5, off_thresh=0.3, min_duration_frames=2)
+    assert uint8_notes[0].tolist() == note_keys.tolist()
+    assert uint8_notes[1].tolist() == onset_frames.tolist()
+
+    # Illegal thresholds
+    with pytest.raises(Exception):
+        _ = NoteEventDetector(on_thresh=0.3, off_thresh=0.5)
+    # --------------------------------------------------------------------------
+
+    return
+
+
+def test_note_event_detector_chunks():
+
+    # --------------------------------------------------------------------------
+    rng = np.random.default_rng(0)
+    activity_matrix = rng.random((500, 12)).astype("float32")
+    activity_matrix[100: 300, 3] = 0.9      # A note spanning many chunks
+
+    expected_notes = _detect_note_events_by_loop(activity_matrix, 0.6, 0.4, 2)
+    note_keys, onset_frames, offset_frames, velocities = detect_note_events(activity_matrix, 0.6, 0.4, 2)
+    assert list(zip(note_keys.tolist(), onset_frames.tolist(), offset_frames.tolist())) == sorted(expected_notes)
+
+    # Streaming, in uneven chunks, gives the same notes
+    note_detector = NoteEventDetector(num_keys=12, on_thresh=0.6, off_thresh=0.4, min_duration_frames=2)
+    chunk_notes = []
+    for chunk_start, chunk_end in [(0, 1), (1, 77), (77, 150), (150, 151), (151, 500)]:
+        chunk_notes.append(note_detector.process_chunk(activity_matrix[chunk_start: chunk_end]))
+    chunk_notes.append(note_detector.flush())
+
+    streamed_notes = sorted(zip(*[np.concatenate(arrays).tolist() for arrays in zip(*chunk_notes)]))
+    assert streamed_notes == sorted(zip(note_keys.tolist(), onset_frames.tolist(),
+                                        offset_frames.tolist(), velocities.tolist()))
+
+    # The same, from any iterable of chunks
+    chunked_notes = detect_note_events_in_chunks((activity_matrix[chunk_start: chunk_start + 60]
+                                                  for chunk_start in range(0, 500, 60)),
+                                                 num_keys=12, on_thresh=0.6, off_thresh=0.4, min_duration_frames=2)
+    for chunked, expected in zip(chunked_notes, (note_keys, onset_frames, offset_frames, velocities)):
+        assert np.array_equal(chunked, expected)
+    assert any((key == 3) and (onset_frame <= 100) and (offset_frame >= 300)
+               for key, onset_frame, offset_frame, _ in streamed_notes)
+
+    # Chunks must have the right number of keys
+    with pytest.raises(Exception):
+        _ = note_detector.process_chunk(np.zeros((5, 11)))
+    # --------------------------------------------------------------------------
+
+    return
+
+
+def test_find_note_runs():
+
+    # --------------------------------------------------------------------------
+    activity_matrix = np.array([[0.9, 0.0, 0.6],
+                                [0.8, 0.0, 0.6],
+                                [0.1, 0.7, 0.6],
+                                [0.9, 0.7, 0.2],
+                                [0.9, 0.0, 0.6]], dtype="float32")
+
+    note_keys, onset_frames, offset_frames = find_note_runs(activity_matrix, activity_thresh=0.5)
+    assert note_keys.tolist() == [0, 0, 1, 2, 2]
+    assert onset_frames.tolist() == [0, 3, 2, 0, 4]
+    assert offset_frames.tolist() == [2, 5, 4, 3, 5]
+
+    # No notes at all
+    note_keys, onset_frames, offset_frames = find_note_runs(np.zeros((5, 3)))
+    assert len(note_keys) == len(onset_frames) == len(offset_frames) == 0
+    # --------------------------------------------------------------------------
+
+    return
@@ -0,0 +1,54 @@
+import os
+
+from ...src.dataIO.videoIO import VideoSampler
+from ...src.dataIO.memoryBudget import MemoryBudget
+from ...src.videoAnalysis.verticalShiftRateUtils import find_vertical_shift_rate
+from ...src.videoAnalysis.parallelVerticalShiftRateUtils import parallel_find_vertical_shift_rate
+
+
+def test_parallel_find_vertical_shift_rate(root_data_dir):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+
+    # --------------------------------------------------------------------------
+    # Same result as find_vertical_shift_rate(), with the smallest possible
+    # ring (so that decoding keeps waiting for free slots) and with a larger one
+    # --------------------------------------------------------------------------
+    memory_budget = MemoryBudget(256 * 1024 * 1024)
+    vid_sampler = VideoSampler(input_video_filename, memory_budget=memory_budget)
+
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=300, end_frame=1200,
+                                                          samples_per_second=2)
+    serial_best_shift = find_vertical_shift_rate(vid_sampler,
+                                                 top_bound=15, bottom_bound=550,
+                                                 left_bound=None, right_bound=None,
+                                                 bin_thresh=90)
+    serial_sampling_state = vid_sampler.get_sampling_state()
+
+    # (The shift options of the serial function are passed on to the workers)
+    for num_workers, num_slots, shift_options in [(2, 2, {}),
+                                                  (3, None, {"prune_shifts": True}),
+                                                  (2, 3, {"num_shift_threads": 2, "use_row_hash": True})]:
+        vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=300, end_frame=1200,
+                                                              samples_per_second=2)
+        best_shift = parallel_find_vertical_shift_rate(vid_sampler,
+                                                       top_bound=15, bottom_bound=550,
+                                                       left_bound=None, right_bound=None,
+                                                       bin_thresh=90,
+                                                       num_workers=num_workers,
+                                                       num_slots=num_slots,
+                                                       **shift_options)
+        assert best_shift == serial_best_shift == 86
+
+        # The sampler is left at the last sample used, as by the serial function
+        assert vid_sampler.get_sampling_state() == serial_sampling_state
+
+    # The shared ring is given back to the budget; only the sampler's own
+    # decoder frame is left, until it is closed
+    assert memory_budget.used_bytes == vid_sampler.frame_height * vid_sampler.frame_width * 3
+
+    vid_sampler.close_sampler()
+    assert memory_budget.used_bytes == 0
+    # --------------------------------------------------------------------------
+
+    return
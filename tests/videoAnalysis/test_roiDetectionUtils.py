@@ -0,0 +1,86 @@
+import os
+
+import pytest
+import numpy as np
+
+from ...src.dataIO.videoIO import VideoSampler
+from ...src.videoAnalysis.frameProcessingUtils import crop_frame
+from ...src.videoAnalysis.verticalShiftRateUtils import _calc_sampler_roi, find_vertical_shift_rate
+from ...src.videoAnalysis.roiDetectionUtils import (calc_falling_notes_roi,
+                                                    detect_falling_notes_roi,
+                                                    clear_roi_cache)
+
+
+def test_calc_falling_notes_roi():
+
+    # --------------------------------------------------------------------------
+    # Synthetic frames: notes falling in rows [20, 70) and columns [10, 90),
+    # above a "keyboard" in rows [80, 100) whose keys light up at random
+    rng = np.random.default_rng(0)
+    notes = (rng.random((300, 100)) > 0.9).repeat(4, axis=0)
+    key_state = rng.random((8, 100)) > 0.5
+
+    gray_frames = np.zeros((8, 100, 100), dtype="uint8")
+    for i in range(8):
+        gray_frames[i, 20: 70, 10: 90] = notes[i * 7: i * 7 + 50, 10: 90] * 200
+        gray_frames[i, 80: 100, :] = 120 + key_state[i] * 100
+
+    roi = calc_falling_notes_roi(gray_frames)
+    assert roi == (20, 70, 10, 90)
+
+    # Frames that never change
+    with pytest.raises(Exception):
+        _ = calc_falling_notes_roi(np.zeros((8, 100, 100)))
+
+    # Not enough frames
+    with pytest.raises(Exception):
+        _ = calc_falling_notes_roi(gray_frames[:1])
+    # --------------------------------------------------------------------------
+
+    return
+
+
+def test_detect_falling_notes_roi(root_data_dir):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+
+    # --------------------------------------------------------------------------
+    clear_roi_cache()
+    roi = detect_falling_notes_roi(input_video_filename)
+    top_row, bottom_row, left_col, right_col = roi
+
+    # Usable as crop bounds
+    cropped_frame = crop_frame(np.zeros((720, 1274, 3)),
+                               top_row=top_row, bottom_row=bottom_row,
+                               left_col=left_col, right_col=right_col)
+    assert cropped_frame.size > 0
+
+    # Cached
+    assert detect_falling_notes_roi(input_video_filename) is roi
+
+    # Shift rate from the detected ROI
+    vid_sampler = VideoSampler(input_video_filename)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=300, end_frame=1200,
+                                                          samples_per_second=2)
+    vertical_shift_rate = find_vertical_shift_rate(vid_sampler,
+                                                   top_bound=None, bottom_bound=None,
+                                                   left_bound=None, right_bound=None,
+                                                   auto_roi=True)
+    assert vertical_shift_rate == 86
+    vid_sampler.close_sampler()
+
+    # A sampler decoding at half the size gets the ROI in its own pixels
+    vid_sampler = VideoSampler(input_video_filename, scale_factor=2)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=300, end_frame=1200,
+                                                          samples_per_second=2)
+    assert _calc_sampler_roi(vid_sampler) == (int(np.ceil(top_row / 2)), bottom_row // 2,
+                                              int(np.ceil(left_col / 2)), right_col // 2)
+    vertical_shift_rate = find_vertical_shift_rate(vid_sampler,
+                                                   top_bound=None, bottom_bound=None,
+                                                   left_bound=None, right_bound=None,
+                                                   auto_roi=True)
+    assert vertical_shift_rate == 43
+    vid_sampler.close_sampler()
+    # --------------------------------------------------------------------------
+
+    return
@@ -0,0 +1,61 @@
+import os
+
+import pytest
+import numpy as np
+
+from ...src.dataIO.videoIO import VideoSampler
+from ...src.videoAnalysis.noteActivityUtils import extract_key_activity
+from ...src.videoAnalysis.noteDetectionUtils import detect_note_events
+from ...src.videoAnalysis.shardedTranscription import (split_into_shards,
+                                                       transcribe_video_sharded)
+
+
+def test_split_into_shards():
+
+    # --------------------------------------------------------------------------
+    shards = split_into_shards(100, 400, 3)
+    assert shards == [(100, 200), (200, 300), (300, 400)]
+
+    assert split_into_shards(0, 3, 3) == [(0, 1), (1, 2), (2, 3)]
+
+    # No shards, or more shards than frames
+    with pytest.raises(Exception):
+        _ = split_into_shards(100, 400, 0)
+    with pytest.raises(Exception):
+        _ = split_into_shards(100, 103, 4)
+    # --------------------------------------------------------------------------
+
+    return
+
+
+def test_transcribe_video_sharded(root_data_dir):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+
+    band_bounds = (530, 550, None, None)
+
+    # --------------------------------------------------------------------------
+    # The streaming path: one pass over every frame, and the notes of the
+    # whole activity matrix
+    vid_sampler = VideoSampler(input_video_filename)
+    vid_sampler.gen_sampling_schedule_using_frame_array(np.arange(300, 500))
+    _, activity_matrix = extract_key_activity(vid_sampler, *band_bounds, bin_thresh=90)
+    vid_sampler.close_sampler()
+
+    expected_notes = detect_note_events(activity_matrix)
+    assert len(expected_notes[0]) > 0
+
+    # Sharded, in any number of shards, gives exactly the same notes (with
+    # frame indices of the video)
+    for num_shards, num_workers in [(1, 1), (3, 2), (7, 2)]:
+        sharded_notes = transcribe_video_sharded(input_video_filename, *band_bounds,
+                                                 bin_thresh=90,
+                                                 start_frame=300, end_frame=500,
+                                                 num_shards=num_shards, num_workers=num_workers)
+        assert np.array_equal(sharded_notes[0], expected_notes[0])
+        assert np.array_equal(sharded_notes[1], expected_notes[1] + 300)
+        assert np.array_equal(sharded_notes[2], expected_notes[2] + 300)
+        assert np.array_equal(sharded_notes[3], expected_notes[3])
+    # --------------------------------------------------------------------------
+
+    return
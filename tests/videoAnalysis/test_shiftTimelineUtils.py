@@ -0,0 +1,88 @@
+import os
+
+from ...src.dataIO.videoIO import VideoReader
+from ...src.videoAnalysis.shiftTimelineUtils import (ShiftChangeDetector,
+                                                     build_shift_timeline,
+                                                     find_shift_timeline)
+
+
+def test_shift_change_detector():
+
+    # --------------------------------------------------------------------------
+    # Lone outliers, and small jitter, are not changes
+    # --------------------------------------------------------------------------
+    change_detector = ShiftChangeDetector(shift_tolerance=1, num_confirm_probes=2)
+    for frame_index, curr_shift in enumerate([40, 41, 40, 3, 40, 39, 40, 90, 40]):
+        assert change_detector.update(frame_index, curr_shift) is None
+    assert change_detector.get_segment_shift() == 40
+    # --------------------------------------------------------------------------
+
+    # --------------------------------------------------------------------------
+    # Two agreeing probes confirm a change, between the last probe of the old
+    # segment and the first probe of the new one
+    # --------------------------------------------------------------------------
+    assert change_detector.update(9, 60) is None
+    assert change_detector.update(10, 61) == (8, 9, 40, 60)
+    assert change_detector.get_segment_shift() == 60
+    # --------------------------------------------------------------------------
+
+    return
+
+
+def test_build_shift_timeline():
+
+    # --------------------------------------------------------------------------
+    # Shift 40 until frame 1234, 60 until frame 3001, then 25; with an
+    # occasional outlier pair
+    # --------------------------------------------------------------------------
+    num_calls = [0]
+
+    def calc_pair_shift(frame_index):
+        num_calls[0] += 1
+        if frame_index % 1000 == 500:
+            return 2
+        if frame_index < 1234:
+            return 40
+        if frame_index < 3001:
+            return 60
+        return 25
+
+    timeline = build_shift_timeline(calc_pair_shift, 0, 6000,
+                                    probe_step=150, frame_resolution=15)
+
+    assert [segment["shift"] for segment in timeline] == [40, 60, 25]
+    assert timeline[0]["start_frame"] == 0
+    assert timeline[-1]["end_frame"] == 6000
+    assert timeline[0]["end_frame"] == timeline[1]["start_frame"]
+    assert 1234 <= timeline[1]["start_frame"] < 1234 + 15
+    assert 3001 <= timeline[2]["start_frame"] < 3001 + 15
+
+    # Far fewer pairs than one every 15 frames
+    assert num_calls[0] < 6000 / 15 / 5
+    # --------------------------------------------------------------------------
+
+    return
+
+
+def test_find_shift_timeline(root_data_dir):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+
+    # --------------------------------------------------------------------------
+    # Constant scroll: one segment, with the shift of find_vertical_shift_rate()
+    # --------------------------------------------------------------------------
+    vid_reader = VideoReader(input_video_filename, use_ring_buffer=True)
+    timeline, num_decoded_frames = find_shift_timeline(vid_reader,
+                                                       top_bound=15, bottom_bound=550,
+                                                       left_bound=None, right_bound=None,
+                                                       bin_thresh=90,
+                                                       samples_per_second=2,
+                                                       start_frame=300, end_frame=1200,
+                                                       return_num_decoded_frames=True)
+    vid_reader.close_reader()
+
+    assert timeline == [{"start_frame": 300, "end_frame": 1200, "shift": 86}]
+    assert num_decoded_frames < (1200 - 300) / 15
+    # --------------------------------------------------------------------------
+
+    return
@@ -1,12 +1,19 @@
 import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import pytest
 
 from imageio import imread
 
 from ...src.dataIO.videoIO import VideoSampler
+from ...src.dataIO.resultCache import ResultCache, calc_video_fingerprint
+from ...src.videoAnalysis import verticalShiftRateUtils
 from ...src.videoAnalysis.verticalShiftRateUtils import (_get_bin_cropped_frame,
+                                                         _split_column_bands,
                                                          calc_shift,
+                                                         calc_shift_by_row_hash,
                                                          find_vertical_shift_rate)
 
 
@@ -40,6 +47,176 @@ def test_calc_shift(root_data_dir):
     curr_shift = calc_shift(bin_cropped_prev_frame, bin_cropped_curr_frame)
 
     assert curr_shift == 86
+
+    # Restricted shift range, containing the best shift
+    curr_shift = calc_shift(bin_cropped_prev_frame, bin_cropped_curr_frame,
+                            min_shift=80, max_shift=90)
+    assert curr_shift == 86
+
+    # Empty shift range
+    with pytest.raises(Exception):
+        _ = calc_shift(bin_cropped_prev_frame, bin_cropped_curr_frame,
+                       min_shift=90, max_shift=80)
+    # --------------------------------------------------------------------------
+
+    return
+
+
+def test_calc_shift_parallel(root_data_dir):
+    input_prev_frame = imread(os.path.join(root_data_dir, "frames",
+                                           "marioverehrer_minecraft_frame_0300.png"))
+
+    input_curr_frame = imread(os.path.join(root_data_dir, "frames",
+                                           "marioverehrer_minecraft_frame_0315.png"))
+
+    bin_cropped_prev_frame = _get_bin_cropped_frame(input_prev_frame,
+                                                    top_bound=15, bottom_bound=550,
+                                                    left_bound=None, right_bound=None,
+                                                    bin_thresh=90)
+    bin_cropped_curr_frame = _get_bin_cropped_frame(input_curr_frame,
+                                                    top_bound=15, bottom_bound=550,
+                                                    left_bound=None, right_bound=None,
+                                                    bin_thresh=90)
+
+    # --------------------------------------------------------------------------
+    # Any number of threads (including more than there are shifts) gives the
+    # serial result, with a pool per call or a shared one
+    # --------------------------------------------------------------------------
+    for num_threads in [2, 3, 16]:
+        assert calc_shift(bin_cropped_prev_frame, bin_cropped_curr_frame, num_threads=num_threads) == 86
+        with ThreadPoolExecutor(max_workers=num_threads) as thread_pool:
+            assert calc_shift(bin_cropped_prev_frame, bin_cropped_curr_frame,
+                              num_threads=num_threads, thread_pool=thread_pool) == 86
+            assert calc_shift(bin_cropped_prev_frame, bin_cropped_curr_frame,
+                              min_shift=80, max_shift=90,
+                              num_threads=num_threads, thread_pool=thread_pool) == 86
+
+    # The columns are split into contiguous bands of about equal width, which
+    # cover the frame exactly
+    column_bands = _split_column_bands(1274, 4)
+    assert len(column_bands) == 4
+    assert column_bands[0][0] == 0
+    assert column_bands[-1][1] == 1274
+    assert all(band[1] == next_band[0] for band, next_band in zip(column_bands[:-1], column_bands[1:]))
+    band_widths = [band[1] - band[0] for band in column_bands]
+    assert max(band_widths) - min(band_widths) <= 1
+    assert _split_column_bands(3, 16) == [(0, 1), (1, 2), (2, 3)]
+
+    rng = np.random.default_rng(7)
+    for _ in range(5):
+        prev_frame = rng.random((60, 5)) > 0.6
+        curr_frame = rng.random((60, 5)) > 0.6
+        serial_shift = calc_shift(prev_frame, curr_frame)
+        for num_threads in [2, 4, 16]:
+            assert calc_shift(prev_frame, curr_frame, num_threads=num_threads) == serial_shift
+    # --------------------------------------------------------------------------
+
+    return
+
+
+def test_calc_shift_pruned(root_data_dir):
+    input_prev_frame = imread(os.path.join(root_data_dir, "frames",
+                                           "marioverehrer_minecraft_frame_0300.png"))
+
+    input_curr_frame = imread(os.path.join(root_data_dir, "frames",
+                                           "marioverehrer_minecraft_frame_0315.png"))
+
+    bin_cropped_prev_frame = _get_bin_cropped_frame(input_prev_frame,
+                                                    top_bound=15, bottom_bound=550,
+                                                    left_bound=None, right_bound=None,
+                                                    bin_thresh=90)
+    bin_cropped_curr_frame = _get_bin_cropped_frame(input_curr_frame,
+                                                    top_bound=15, bottom_bound=550,
+                                                    left_bound=None, right_bound=None,
+                                                    bin_thresh=90)
+
+    # --------------------------------------------------------------------------
+    # Pruning gives the exhaustive result, including ties (which go to the
+    # smaller shift) and all-empty frames
+    # --------------------------------------------------------------------------
+    assert calc_shift(bin_cropped_prev_frame, bin_cropped_curr_frame, prune_shifts=True) == 86
+    assert calc_shift(bin_cropped_prev_frame, bin_cropped_curr_frame,
+                      min_shift=80, max_shift=90, prune_shifts=True) == 86
+
+    rng = np.random.default_rng(11)
+    for _ in range(200):
+        frame_shape = (rng.integers(2, 40), rng.integers(1, 6))
+        prev_frame = rng.random(frame_shape) > rng.random()
+        curr_frame = rng.random(frame_shape) > rng.random()
+        assert calc_shift(prev_frame, curr_frame, prune_shifts=True) == calc_shift(prev_frame, curr_frame)
+
+    empty_frame = np.zeros((20, 4), dtype="bool")
+    assert calc_shift(empty_frame, empty_frame, prune_shifts=True) == calc_shift(empty_frame, empty_frame)
+
+    with pytest.raises(Exception):
+        _ = calc_shift(bin_cropped_prev_frame, bin_cropped_curr_frame, num_threads=2, prune_shifts=True)
+
+    # The analysis rejects the combination before decoding anything
+    vid_sampler = VideoSampler(os.path.join(root_data_dir, "videos", "marioverehrer_minecraft.mp4"))
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=300, end_frame=600,
+                                                          samples_per_second=2)
+    with pytest.raises(Exception, match="Shift pruning"):
+        _ = find_vertical_shift_rate(vid_sampler, 15, 550, None, None,
+                                     num_shift_threads=2, prune_shifts=True)
+    assert vid_sampler.curr_frame_index == -1
+    vid_sampler.close_sampler()
+    # --------------------------------------------------------------------------
+
+    return
+
+
+def test_calc_shift_by_row_hash(root_data_dir, monkeypatch):
+    input_prev_frame = imread(os.path.join(root_data_dir, "frames",
+                                           "marioverehrer_minecraft_frame_0300.png"))
+
+    input_curr_frame = imread(os.path.join(root_data_dir, "frames",
+                                           "marioverehrer_minecraft_frame_0315.png"))
+
+    bin_cropped_prev_frame = _get_bin_cropped_frame(input_prev_frame,
+                                                    top_bound=15, bottom_bound=550,
+                                                    left_bound=None, right_bound=None,
+                                                    bin_thresh=90)
+    bin_cropped_curr_frame = _get_bin_cropped_frame(input_curr_frame,
+                                                    top_bound=15, bottom_bound=550,
+                                                    left_bound=None, right_bound=None,
+                                                    bin_thresh=90)
+
+    # Counts the fallbacks to the IoU search
+    num_iou_searches = [0]
+
+    def counting_calc_shift(*args, **kwargs):
+        num_iou_searches[0] += 1
+        return calc_shift(*args, **kwargs)
+
+    monkeypatch.setattr(verticalShiftRateUtils, "calc_shift", counting_calc_shift)
+
+    # --------------------------------------------------------------------------
+    # Clean frames: rows match exactly, without any IoU search
+    # --------------------------------------------------------------------------
+    assert calc_shift_by_row_hash(bin_cropped_prev_frame, bin_cropped_curr_frame) == 86
+    assert calc_shift_by_row_hash(bin_cropped_prev_frame, bin_cropped_curr_frame,
+                                  min_shift=80, max_shift=90) == 86
+
+    rng = np.random.default_rng(5)
+    translated_frame = np.concatenate((rng.random((37, bin_cropped_prev_frame.shape[1])) > 0.5,
+                                       bin_cropped_prev_frame[:-37]))
+    assert calc_shift_by_row_hash(bin_cropped_prev_frame, translated_frame) == 37
+
+    assert num_iou_searches[0] == 0
+    # --------------------------------------------------------------------------
+
+    # --------------------------------------------------------------------------
+    # Noisy frames: too few rows match, so the IoU search decides
+    # --------------------------------------------------------------------------
+    noisy_frame = translated_frame ^ (rng.random(translated_frame.shape) > 0.999)
+    assert calc_shift_by_row_hash(bin_cropped_prev_frame, noisy_frame) == calc_shift(bin_cropped_prev_frame, noisy_frame)
+    assert num_iou_searches[0] == 1
+
+    # Out of range matches are not accepted either
+    assert calc_shift_by_row_hash(bin_cropped_prev_frame, bin_cropped_curr_frame,
+                                  min_shift=90, max_shift=100) == calc_shift(bin_cropped_prev_frame, bin_cropped_curr_frame,
+                                                                             min_shift=90, max_shift=100)
+    assert num_iou_searches[0] == 2
     # --------------------------------------------------------------------------
 
     return
@@ -93,3 +270,305 @@ def test_find_vertical_shift_rate(root_data_dir):
     # --------------------------------------------------------------------------
 
     return
+
+
+class _CrashingVideoSampler(VideoSampler):
+
+    # Simulates a job dying after a fixed number of samples have been read
+    def __init__(self, video_filename, num_samples_before_crash):
+        super().__init__(video_filename)
+        self.num_samples_before_crash = num_samples_before_crash
+        return
+
+    def __next__(self):
+        if self.num_samples_before_crash == 0:
+            raise RuntimeError("Simulated crash")
+        self.num_samples_before_crash -= 1
+        return super().__next__()
+
+
+def test_find_vertical_shift_rate_checkpoint_resume(root_data_dir, tmp_path):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+    checkpoint_filename = str(tmp_path / "shift_rate.ckpt")
+
+    shift_rate_kwargs = {"top_bound": 15, "bottom_bound": 550,
+                         "left_bound": None, "right_bound": None,
+                         "bin_thresh": 90,
+                         "num_shift_count_threshold": 30}
+
+    # --------------------------------------------------------------------------
+    # Uninterrupted run, as the reference
+    vid_sampler = VideoSampler(input_video_filename)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=300, end_frame=600,
+                                                          samples_per_second=2)
+    with pytest.warns(Warning):
+        expected_shift_rate = find_vertical_shift_rate(vid_sampler, **shift_rate_kwargs)
+    vid_sampler.close_sampler()
+
+    # Run that dies midway, leaving a checkpoint behind
+    vid_sampler = _CrashingVideoSampler(input_video_filename, num_samples_before_crash=12)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=300, end_frame=600,
+                                                          samples_per_second=2)
+    with pytest.raises(RuntimeError):
+        find_vertical_shift_rate(vid_sampler,
+                                 checkpoint_filename=checkpoint_filename,
+                                 checkpoint_interval=4,
+                                 **shift_rate_kwargs)
+    vid_sampler.close_sampler()
+    assert os.path.isfile(checkpoint_filename)
+
+    # The checkpoint is only resumed for the same video, method and schedule
+    other_video_filename = str(tmp_path / "other_video.mp4")
+    with open(input_video_filename, "rb") as input_video_file, open(other_video_filename, "wb") as other_video_file:
+        other_video_file.write(input_video_file.read() + bytes(1024))
+
+    vid_sampler = VideoSampler(other_video_filename)
+    with pytest.raises(Exception, match="video_fingerprint"):
+        find_vertical_shift_rate(vid_sampler, checkpoint_filename=checkpoint_filename,
+                                 resume=True, **shift_rate_kwargs)
+    vid_sampler.close_sampler()
+
+    vid_sampler = VideoSampler(input_video_filename)
+    with pytest.raises(Exception, match="use_row_hash"):
+        find_vertical_shift_rate(vid_sampler, checkpoint_filename=checkpoint_filename,
+                                 resume=True, use_row_hash=True, **shift_rate_kwargs)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=330, end_frame=600,
+                                                          samples_per_second=2)
+    with pytest.raises(Exception, match="sample_schedule"):
+        find_vertical_shift_rate(vid_sampler, checkpoint_filename=checkpoint_filename,
+                                 resume=True, **shift_rate_kwargs)
+    vid_sampler.close_sampler()
+    assert os.path.isfile(checkpoint_filename)
+
+    # Resumed run, on a fresh sampler without any schedule
+    vid_sampler = VideoSampler(input_video_filename)
+    with pytest.warns(Warning):
+        resumed_shift_rate = find_vertical_shift_rate(vid_sampler,
+                                                      checkpoint_filename=checkpoint_filename,
+                                                      checkpoint_interval=4,
+                                                      resume=True,
+                                                      **shift_rate_kwargs)
+    assert vid_sampler.curr_sample_index == vid_sampler.num_samples - 1
+    vid_sampler.close_sampler()
+
+    assert resumed_shift_rate == expected_shift_rate
+    assert not os.path.isfile(checkpoint_filename)
+    # --------------------------------------------------------------------------
+
+    return
+
+
+def test_find_vertical_shift_rate_reduced_resolution(root_data_dir):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+
+    # --------------------------------------------------------------------------
+    # The shift is estimated at a reduced scale, but refined to exact
+    # full-resolution pixels
+    for resolution_scale in [2, 4]:
+        vid_sampler = VideoSampler(input_video_filename)
+        vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=300, end_frame=1200,
+                                                              samples_per_second=2)
+
+        vertical_shift_rate = find_vertical_shift_rate(vid_sampler,
+                                                       top_bound=15, bottom_bound=550,
+                                                       left_bound=None, right_bound=None,
+                                                       bin_thresh=90,
+                                                       num_shift_count_threshold=10,
+                                                       resolution_scale=resolution_scale)
+        assert vertical_shift_rate == 86
+
+        vid_sampler.close_sampler()
+
+    # Static pairs are skipped in the refinement too, title card included
+    vid_sampler = VideoSampler(input_video_filename)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=0, end_frame=1200,
+                                                          samples_per_second=2)
+    vertical_shift_rate = find_vertical_shift_rate(vid_sampler,
+                                                   top_bound=15, bottom_bound=550,
+                                                   left_bound=None, right_bound=None,
+                                                   bin_thresh=90,
+                                                   num_shift_count_threshold=10,
+                                                   resolution_scale=2,
+                                                   num_refine_pairs=200,
+                                                   skip_static_frames=True)
+    assert vertical_shift_rate == 86
+    vid_sampler.close_sampler()
+
+    # A schedule too short for a single pair has no shift, as at full scale
+    vid_sampler = VideoSampler(input_video_filename)
+    vid_sampler.gen_sampling_schedule_using_frame_array([300])
+    with pytest.warns(UserWarning):
+        vertical_shift_rate = find_vertical_shift_rate(vid_sampler,
+                                                       top_bound=15, bottom_bound=550,
+                                                       left_bound=None, right_bound=None,
+                                                       resolution_scale=2)
+    assert vertical_shift_rate is None
+    vid_sampler.close_sampler()
+    # --------------------------------------------------------------------------
+
+    return
+
+
+def test_find_vertical_shift_rate_skip_static_frames(root_data_dir):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+
+    # --------------------------------------------------------------------------
+    # Sampling from the very start of the video, title card included
+    vid_sampler = VideoSampler(input_video_filename)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=0, end_frame=1200,
+                                                          samples_per_second=2)
+
+    vertical_shift_rate, skipped_spans = find_vertical_shift_rate(vid_sampler,
+                                                                  top_bound=15, bottom_bound=550,
+                                                                  left_bound=None, right_bound=None,
+                                                                  bin_thresh=90,
+                                                                  num_shift_count_threshold=10,
+                                                                  skip_static_frames=True,
+                                                                  return_skipped_spans=True)
+    assert vertical_shift_rate == 86
+
+    # Spans lie on the sampling schedule, in order, and do not overlap
+    prev_end_frame = -1
+    for start_frame, end_frame in skipped_spans:
+        assert prev_end_frame < start_frame < end_frame <= vid_sampler.curr_frame_index
+        assert start_frame % vid_sampler.sample_step == 0
+        assert end_frame % vid_sampler.sample_step == 0
+        prev_end_frame = end_frame
+
+    vid_sampler.close_sampler()
+    # --------------------------------------------------------------------------
+
+    return
+
+
+def test_find_vertical_shift_rate_result_cache(root_data_dir, tmp_path):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+    result_cache = ResultCache(str(tmp_path / "results.sqlite"))
+
+    shift_rate_kwargs = {"top_bound": 15, "bottom_bound": 550,
+                         "left_bound": None, "right_bound": None,
+                         "bin_thresh": 90,
+                         "num_shift_count_threshold": 10,
+                         "result_cache": result_cache}
+
+    # --------------------------------------------------------------------------
+    # First run: analysed, and stored
+    vid_sampler = VideoSampler(input_video_filename)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=300, end_frame=1200,
+                                                          samples_per_second=2)
+    assert find_vertical_shift_rate(vid_sampler, **shift_rate_kwargs) == 86
+    vid_sampler.close_sampler()
+
+    # Second run: served from the cache, without reading a single sample
+    vid_sampler = _CrashingVideoSampler(input_video_filename, num_samples_before_crash=0)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=300, end_frame=1200,
+                                                          samples_per_second=2)
+    assert find_vertical_shift_rate(vid_sampler, **shift_rate_kwargs) == 86
+
+    # Any other parameter or schedule is a different result
+    with pytest.raises(RuntimeError):
+        _ = find_vertical_shift_rate(vid_sampler, **dict(shift_rate_kwargs, bin_thresh=91))
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=330, end_frame=1200,
+                                                          samples_per_second=2)
+    with pytest.raises(RuntimeError):
+        _ = find_vertical_shift_rate(vid_sampler, **shift_rate_kwargs)
+
+    # Explicit invalidation
+    assert result_cache.invalidate(fingerprint=calc_video_fingerprint(input_video_filename)) == 1
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=300, end_frame=1200,
+                                                          samples_per_second=2)
+    with pytest.raises(RuntimeError):
+        _ = find_vertical_shift_rate(vid_sampler, **shift_rate_kwargs)
+    vid_sampler.close_sampler()
+    # --------------------------------------------------------------------------
+
+    result_cache.close()
+
+    return
+
+
+def test_find_vertical_shift_rate_result_cache_scale(root_data_dir, tmp_path):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+    result_cache = ResultCache(str(tmp_path / "results.sqlite"))
+
+    # --------------------------------------------------------------------------
+    # A sampler decoding at half the size finds half the shift, which must
+    # never be served to a full-size sampler with the same parameters
+    vid_sampler = VideoSampler(input_video_filename, scale_factor=2)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=300, end_frame=600,
+                                                          samples_per_second=2)
+    scaled_shift = find_vertical_shift_rate(vid_sampler, 8, 275, None, None,
+                                            num_shift_count_threshold=2,
+                                            result_cache=result_cache)
+    vid_sampler.close_sampler()
+    assert scaled_shift == 43
+
+    vid_sampler = VideoSampler(input_video_filename)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=300, end_frame=600,
+                                                          samples_per_second=2)
+    assert find_vertical_shift_rate(vid_sampler, 8, 275, None, None,
+                                    num_shift_count_threshold=2,
+                                    result_cache=result_cache) == 86
+    vid_sampler.close_sampler()
+
+    # Two separate entries
+    assert result_cache.invalidate(fingerprint=calc_video_fingerprint(input_video_filename)) == 2
+    # --------------------------------------------------------------------------
+
+    result_cache.close()
+
+    return
+
+
+def test_find_vertical_shift_rate_result_cache_warnings(root_data_dir, tmp_path, monkeypatch):
+    input_video_filename = os.path.join(root_data_dir, "videos",
+                                        "marioverehrer_minecraft.mp4")
+    result_cache = ResultCache(str(tmp_path / "results.sqlite"))
+
+    shift_rate_kwargs = {"top_bound": 15, "bottom_bound": 550,
+                         "left_bound": None, "right_bound": None,
+                         "num_shift_count_threshold": 2,
+                         "result_cache": result_cache}
+
+    original_calc_shift = verticalShiftRateUtils.calc_shift
+
+    def warning_calc_shift(*args, **kwargs):
+        warnings.warn("Noisy pair", RuntimeWarning)
+        return original_calc_shift(*args, **kwargs)
+
+    # --------------------------------------------------------------------------
+    # Warnings are re-issued from the cache with their own category
+    monkeypatch.setattr(verticalShiftRateUtils, "calc_shift", warning_calc_shift)
+    vid_sampler = VideoSampler(input_video_filename)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=300, end_frame=600,
+                                                          samples_per_second=2)
+    with pytest.warns(RuntimeWarning, match="Noisy pair"):
+        assert find_vertical_shift_rate(vid_sampler, **shift_rate_kwargs) == 86
+    vid_sampler.close_sampler()
+    monkeypatch.undo()
+
+    vid_sampler = _CrashingVideoSampler(input_video_filename, num_samples_before_crash=0)
+    vid_sampler.gen_sampling_schedule_using_frame_indices(start_frame=300, end_frame=600,
+                                                          samples_per_second=2)
+    with warnings.catch_warnings(record=True) as warn_list:
+        warnings.simplefilter("always")
+        assert find_vertical_shift_rate(vid_sampler, **shift_rate_kwargs) == 86
+    assert [w.category for w in warn_list] == [RuntimeWarning, RuntimeWarning]
+    vid_sampler.close_sampler()
+
+    # Plain messages (as stored before categories were), and categories that
+    # cannot be found, come back as UserWarning
+    assert verticalShiftRateUtils._get_cached_warning("Old warning") == (UserWarning, "Old warning")
+    assert verticalShiftRateUtils._get_cached_warning({"category_module": "not_loaded_module",
+                                                       "category": "CustomWarning",
+                                                       "message": "Custom"}) == (UserWarning, "Custom")
+    # --------------------------------------------------------------------------
+
+    result_cache.close()
+
+    return